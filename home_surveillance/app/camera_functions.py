@@ -1,18 +1,20 @@
+import asyncio
+import json
 import logging
 import numpy as np
 import time
-import base64
 import random
-import socket
-import selectors
 import traceback
 import types
+import uuid
 import zmq
+import zmq.asyncio
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.http.response import HttpResponse, StreamingHttpResponse
 from .models import DimCameras, DimPerson
-from server.libclient import Message
+from .control_client import get_control_client
+from server.commands import CommandResponse, STATUS_OK
 
 # Create loggers for code
 logger = logging.getLogger("camera_functions")
@@ -33,6 +35,14 @@ consoleHandler.setFormatter(formatter)
 # GLOBAL VARS
 MESSAGE_PORT = 8080
 IP_ADRESS = "192.168.0.135"
+BROKER_PORT = 5550
+BROKER_TIMEOUT = 5
+SNAPSHOT_VIEWER_ID = b"snapshot"
+
+# Django 4.2 under ASGI keeps iterating a stream after the client has gone, so every stream ends on its own.
+# The page opens a new stream before STREAM_MAX_DURATION has passed.
+STREAM_MAX_DURATION = 600
+STREAM_MAX_IDLE = 30
 
 
 ################################################################################
@@ -50,106 +60,125 @@ def import_camera_list(user_id):
 ################################################################################
 # Manage sockets
 ################################################################################
-def create_request(message):
-    ''' Create request in bytes '''
-
-    return dict(
-        type="binary/custom-client-binary-type",
-        encoding="binary",
-        content=message,
-    )
-
-#-------------------------------------------------------------------------------
-def create_socket_connection(request):
-    ''' Start socket connection '''
+def send_command(command):
+    ''' Send a Command to the server over the persistent control connection, returns the CommandResponse or None '''
 
     try:
-        sel = selectors.DefaultSelector()
-        addr = (IP_ADRESS, MESSAGE_PORT)
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setblocking(False)
-        sock.connect_ex(addr)
-        events = selectors.EVENT_READ | selectors.EVENT_WRITE
-        message = Message(sel, sock, addr, request)
-        sel.register(sock, events, data=message)
-        logger.info("Starting connection to host %s through port %s." % addr)
-        return sel
+        response = CommandResponse.from_dict(get_control_client(IP_ADRESS, MESSAGE_PORT).request(command.to_dict()))
+        if response.status != STATUS_OK:
+            logger.error("Server failed to handle %s: %s" % (command, response.error))
+        return response
     except Exception as e:
-        logger.error("Failed to start connection under select camera: %s." % e)
+        logger.error("Failed to send %s to server: %s" % (command, e))
         return None
 
 ################################################################################
 # Support functions for views
 ################################################################################
-def check_if_port_is_used(ip, port: int) -> bool:
-    ''' Check if the port is beeing used '''
+def create_broker_socket():
+    ''' Create an asyncio socket for requesting frames from the frame broker '''
 
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            if s.connect_ex((ip, port)) == 0:
-                s.shutdown(socket.SHUT_RDWR)
-                s.close()
-                logger.info("Port %s was closed for %s" % (port, ip))
-    except Exception as e:
-        logger.error("The check if port is beeing used failed for port %s: %s" % (port, e))
+    context = zmq.asyncio.Context.instance()
+    broker_socket = context.socket(zmq.REQ)
+    broker_socket.setsockopt(zmq.LINGER, 0)
+    broker_socket.connect('tcp://localhost:%s' % BROKER_PORT)
+    return broker_socket
 
 #-------------------------------------------------------------------------------
-def create_new_socket(camera_id):
-    ''' Create a new socket. '''
-
-    # Import web port for selected camera
-    port = DimCameras.objects.get(id=camera_id).web_socket
-    logger.info("Creating a connection for camera %s and port %s." % (camera_id, port))
-
-    # Check if port beeing used
-    check_if_port_is_used(IP_ADRESS, port)
-
-    for i in range(0,3):
-        try:
-            # Create the connection to recieve video stream
-            context = zmq.Context()
-            footage_socket = context.socket(zmq.SUB)
-            footage_socket.setsockopt(socket.SO_REUSEADDR, 1)
-            footage_socket.bind('tcp://*:%s' % port)
-            footage_socket.setsockopt_string(zmq.SUBSCRIBE, "")
-            return footage_socket
-        except Exception as e:
-            logger.error("Failed to create socket on client side: %s" % e)
+def get_user_id(request):
+    ''' Id of the logged in user or None, async views call it with sync_to_async since the user is loaded from the session '''
+
+    return request.user.id if request.user.is_authenticated else None
 
 #-------------------------------------------------------------------------------
 def gen(camera_id):
-    ''' Function generating streaming frames. '''
+    ''' Function generating streaming frames of one camera. '''
+
+    return stream_frames(b"frame", camera_id)
+
+#-------------------------------------------------------------------------------
+def gen_mosaic(camera_ids):
+    ''' Function generating streaming frames of a mosaic of several cameras, composed by the broker. '''
+
+    return stream_frames(b"mosaic", ",".join(str(camera_id) for camera_id in camera_ids))
+
+#-------------------------------------------------------------------------------
+async def stream_frames(command, camera_id):
+    '''
+    Frames are requested from the frame broker, which answers with the latest frame newer than
+    the one the viewer already has. The generator is async so that waiting viewers do not hold
+    a thread each. The stream ends after STREAM_MAX_DURATION seconds, or after STREAM_MAX_IDLE
+    seconds without a new frame, since a client that has disconnected is not noticed.
+    '''
 
     # Define parameters
     fps_limit = 4
+    last_sequence = 0
+    viewer_id = uuid.uuid4().hex.encode("utf-8")
+    stream_start = time.monotonic()
+    last_frame_time = stream_start
 
     # Set up socket
-    footage_socket = create_new_socket(camera_id)
+    broker_socket = create_broker_socket()
 
     # Run streaming loop
-    while True:
-        start_time = time.time()
-        try:
-            frame = footage_socket.recv_string()
-            img = base64.b64decode(frame)
-        except Exception as e:
-            logger.error("Camera %s: No frame recieved from socket under gen: %s" % (camera_id, e))
-            break
-
-        try:
-            # Resize image and generate img to show in browser
-            if img != None:
-                yield (b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' + img + b'\r\n')
-
-                # Keeping cameras at fixed FPS
-                end_time = time.time() - start_time
-                if end_time < (1/fps_limit):
-                    diff = (1/fps_limit) - end_time
-                    time.sleep(diff)
-
-        except Exception as e:
-            logger.error("Camera %s: Failed to convert image to jpg under gen: %s" % (camera_id, e))
+    try:
+        while True:
+            start_time = time.monotonic()
+            if start_time - stream_start > STREAM_MAX_DURATION:
+                logger.info("Camera %s: Stream ended after %s seconds" % (camera_id, STREAM_MAX_DURATION))
+                break
+            if start_time - last_frame_time > STREAM_MAX_IDLE:
+                logger.info("Camera %s: Stream ended after %s seconds without frames" % (camera_id, STREAM_MAX_IDLE))
+                break
+
+            try:
+                sequence, header, img = await request_frame(broker_socket, command, camera_id, viewer_id, last_sequence)
+            except Exception as e:
+                logger.error("Camera %s: No frame recieved from broker under gen: %s" % (camera_id, e))
+                break
+
+            # No new frame within the timeout of the broker
+            if len(img) == 0:
+                continue
+            last_sequence = int(sequence)
+            last_frame_time = time.monotonic()
+
+            # The capture time lets clients measure how far the stream is behind the camera
+            capture_time = json.loads(header).get("timestamp", 0)
+            yield (b'--frame\r\n'
+                b'Content-Type: image/jpeg\r\n'
+                b'X-Capture-Time: %.3f\r\n\r\n' % capture_time + img + b'\r\n')
+
+            # Keeping cameras at fixed FPS
+            end_time = time.monotonic() - start_time
+            if end_time < (1/fps_limit):
+                await asyncio.sleep((1/fps_limit) - end_time)
+    finally:
+        broker_socket.close()
+
+#-------------------------------------------------------------------------------
+async def get_snapshot(camera_id):
+    ''' Get the latest jpg of the camera from the frame broker, returns capture time and jpg or None '''
+
+    broker_socket = create_broker_socket()
+    try:
+        sequence, header, img = await request_frame(broker_socket, b"snapshot", camera_id, SNAPSHOT_VIEWER_ID, 0)
+        if len(img) == 0:
+            return None
+        return json.loads(header)["timestamp"], img
+    except Exception as e:
+        logger.error("Camera %s: No snapshot recieved from broker: %s" % (camera_id, e))
+        return None
+    finally:
+        broker_socket.close()
+
+#-------------------------------------------------------------------------------
+async def request_frame(broker_socket, command, camera_id, viewer_id, last_sequence):
+    ''' Request a frame from the broker, the reply is the sequence, a json header with frame metadata and the jpg '''
+
+    await broker_socket.send_multipart([command, str(camera_id).encode("utf-8"), viewer_id, str(last_sequence).encode("utf-8")])
+    return await asyncio.wait_for(broker_socket.recv_multipart(), BROKER_TIMEOUT)
 
 #-------------------------------------------------------------------------------
 def update_system_status(user_id, value):
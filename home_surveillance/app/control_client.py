@@ -0,0 +1,160 @@
+import concurrent.futures
+import itertools
+import logging
+import os
+import socket
+import struct
+from threading import Lock, Thread
+from server.framing import MessageDecoder, encode_message
+
+# Create loggers for code
+logger = logging.getLogger("control_client")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# One client per process, shared by all requests
+_client = None
+_client_lock = Lock()
+
+
+class ControlClient():
+    def __init__(self, host, port, timeout=5, connect_timeout=2, send_timeout=2):
+        '''
+        Persistent connection to the control port of the server, shared by all threads of the
+        Django process. Every request gets an id and a future that is resolved by a reader
+        thread when the response with that id arrives, so many requests can be in flight at once.
+            timeout = Default time in seconds to wait for a response
+            connect_timeout = Time in seconds to wait for the connection to the server
+            send_timeout = Time in seconds a request may wait for a server that does not read, the connection is dropped after it
+        '''
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.lock = Lock()
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+        self.sock = None
+        self.pid = os.getpid()
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        with self.lock:
+            sock = self.sock
+        if sock is not None:
+            self.disconnect(sock, ConnectionError("Client closed."))
+
+    #-------------------------------------------------------------------------------
+    def connect(self):
+        ''' Connect to the server and start the thread reading responses, called with the lock held '''
+
+        sock = socket.create_connection((self.host, self.port), self.connect_timeout)
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # The reader thread blocks in recv without a timeout, so only sending is limited, in the kernel
+        seconds = int(self.send_timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                        struct.pack("ll", seconds, int((self.send_timeout - seconds) * 1e6)))
+        self.sock = sock
+        Thread(target=self.read_responses, args=(sock,), daemon=True).start()
+        logger.info("Connected to control port of host %s through port %s." % (self.host, self.port))
+
+    #-------------------------------------------------------------------------------
+    def disconnect(self, sock, error):
+        ''' Close the connection and fail every request still waiting for a response '''
+
+        with self.lock:
+            # Requests sent on a newer connection are left alone
+            pending = {}
+            if self.sock is sock or self.sock is None:
+                self.sock = None
+                pending = self.pending
+                self.pending = {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection to server lost: %s" % error))
+
+    #-------------------------------------------------------------------------------
+    def read_responses(self, sock):
+        ''' Loop for the reader thread, resolves the future of each response '''
+
+        decoder = MessageDecoder()
+        try:
+            while True:
+                if not decoder.recv_into(sock):
+                    raise ConnectionError("Server closed the connection.")
+                for header, response in decoder.messages():
+                    with self.lock:
+                        future = self.pending.pop(header.get("request-id"), None)
+                    if future is not None and not future.done():
+                        future.set_result(response)
+        except Exception as e:
+            if self.sock is sock:
+                logger.error("Control connection to %s lost: %s" % (self.host, e))
+            self.disconnect(sock, e)
+
+    #-------------------------------------------------------------------------------
+    def request(self, content, timeout=None):
+        ''' Send a request and wait for its response, raises TimeoutError or ConnectionError '''
+
+        future = self.submit(content)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                self.pending.pop(future.request_id, None)
+            raise
+
+    #-------------------------------------------------------------------------------
+    def submit(self, content):
+        ''' Send a request without waiting, returns a future resolved with the response '''
+
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.sock is None:
+                self.connect()
+            future.request_id = next(self.request_ids)
+            self.pending[future.request_id] = future
+            sock = self.sock
+            try:
+                sock.sendall(encode_message(content, future.request_id))
+            except OSError as e:
+                # Part of the message may have been sent, so the connection is dropped even after a send timeout.
+                # The reader thread fails the other pending requests when the socket is closed
+                logger.error("Sending to control port of %s failed: %s" % (self.host, e))
+                self.pending.pop(future.request_id, None)
+                self.sock = None
+                sock.close()
+                if isinstance(e, BlockingIOError):
+                    raise TimeoutError("Server did not read the request within %s seconds." % self.send_timeout) from e
+                raise
+        return future
+
+
+#-------------------------------------------------------------------------------
+def get_control_client(host, port):
+    ''' Get the control client of this process, a new one is created after a fork '''
+
+    global _client
+    with _client_lock:
+        if _client is None or _client.pid != os.getpid():
+            _client = ControlClient(host, port)
+        return _client
@@ -12,7 +12,9 @@ urlpatterns = [
     path("about", views.about, name="about"),
 
     # Select camera
-    path('camera/<camera_id>/', views.camera, name='camera'),
+    path('camera/<int:camera_id>/', views.camera, name='camera'),
+    path('camera/<int:camera_id>/snapshot/', views.snapshot, name='snapshot'),
+    path('mosaic/', views.mosaic, name='mosaic'),
     path('include_camera/<camera_id>/', views.include_camera, name='include_camera'),
     path('exclude_camera/<camera_id>/', views.exclude_camera, name='exclude_camera'),
     path('view_camera/<camera_id>/', views.view_camera, name='view_camera'),
@@ -3,13 +3,16 @@ import socket
 import sys
 import time
 import traceback
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.http.response import HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.db.models import Sum
 from django.contrib.auth.decorators import login_required
-from server.libclient import Message
+from django.contrib.auth.views import redirect_to_login
+from django.utils.http import http_date
 from .models import DimCameras, DimPerson
 from app import camera_functions
+from server.commands import Command, CONFIG_CHANGED, VIEW_CAMERA, START_SYSTEM, STOP_SYSTEM
 
 # Create loggers for code
 logger = logging.getLogger("views")
@@ -45,6 +48,10 @@ def main(request):
         data.append(temp_dict)
         if camera.selected_status == 1:
             selected_camera = str(camera.id)
+
+    # Show all cameras in one mosaic stream instead of the selected camera
+    if request.GET.get("view") == "mosaic":
+        selected_camera = "mosaic"
     return render(request, "home.html", {"selected_camera":selected_camera, "system_status":system_status, "data":data})
 
 #------------------------------------------------------------------------------
@@ -57,10 +64,21 @@ def about(request):
     return render(request, "about.html")
 
 #------------------------------------------------------------------------------
-def camera(request, camera_id):
-    ''' Function for creating StreamingHttpResponse for camera 1. '''
+async def camera(request, camera_id):
+    '''
+    Function for creating StreamingHttpResponse for camera 1. The stream is an async
+    generator, served without a thread per viewer when running under ASGI.
+    '''
+
+    # login_required does not wrap async views before Django 5.0
+    current_user = await sync_to_async(camera_functions.get_user_id)(request)
+    if current_user is None:
+        return redirect_to_login(request.get_full_path())
 
     try:
+        if not await DimCameras.objects.filter(id=camera_id, user_id=current_user).aexists():
+            return HttpResponse(status=404)
+
         # Create streaming object for selected camera
         return StreamingHttpResponse(camera_functions.gen(camera_id),
                     content_type='multipart/x-mixed-replace; boundary=frame')
@@ -68,6 +86,52 @@ def camera(request, camera_id):
         logger.error("Camera stream failed due to: %s" % e)
         return HttpResponse(False, content_type='text/plain')
 
+#------------------------------------------------------------------------------
+async def mosaic(request):
+    ''' One stream with the active cameras of the user in a grid, composed and encoded once by the frame broker. '''
+
+    current_user = await sync_to_async(camera_functions.get_user_id)(request)
+    if current_user is None:
+        return redirect_to_login(request.get_full_path())
+
+    try:
+        camera_ids = [camera.id async for camera in DimCameras.objects.filter(user_id=current_user, detection_status=1).order_by("id")]
+        if not camera_ids:
+            return HttpResponse(status=404)
+        return StreamingHttpResponse(camera_functions.gen_mosaic(camera_ids),
+                    content_type='multipart/x-mixed-replace; boundary=frame')
+    except Exception as e:
+        logger.error("Mosaic stream failed due to: %s" % e)
+        return HttpResponse(False, content_type='text/plain')
+
+#------------------------------------------------------------------------------
+async def snapshot(request, camera_id):
+    '''
+    Latest jpg of the camera, used for the thumbnails in the camera list. The ETag is the
+    capture time of the frame so that browsers only download a frame they have not seen.
+    '''
+
+    current_user = await sync_to_async(camera_functions.get_user_id)(request)
+    if current_user is None:
+        return redirect_to_login(request.get_full_path())
+    if not await DimCameras.objects.filter(id=camera_id, user_id=current_user).aexists():
+        return HttpResponse(status=404)
+
+    frame = await camera_functions.get_snapshot(camera_id)
+    if frame is None:
+        return HttpResponse(status=503)
+
+    timestamp, img = frame
+    etag = '"%s-%s"' % (camera_id, timestamp)
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(img, content_type="image/jpeg")
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(timestamp)
+    response["Cache-Control"] = "no-cache"
+    return response
+
 #------------------------------------------------------------------------------
 def include_camera(request, camera_id):
     # Current user
@@ -81,6 +145,9 @@ def include_camera(request, camera_id):
     camera_obj.detection_status = 1
     camera_obj.save()
 
+    # Tell the server, a running worker reads the settings of the camera again
+    camera_functions.send_command(Command(CONFIG_CHANGED, current_user, camera_id))
+
     # Create a dictionary of cameras to create camera list at home view
     data = camera_functions.import_camera_list(current_user)
 
@@ -99,6 +166,9 @@ def exclude_camera(request, camera_id):
     camera_obj.detection_status = 0
     camera_obj.save()
 
+    # Tell the server, a running worker reads the settings of the camera again
+    camera_functions.send_command(Command(CONFIG_CHANGED, current_user, camera_id))
+
     # Create a dictionary of cameras to create camera list at home view
     data = camera_functions.import_camera_list(current_user)
 
@@ -122,31 +192,10 @@ def view_camera(request, camera_id):
     camera.selected_status = 1
     camera.save()
 
-    # Start connection
-    msg = "view-" + str(camera_id) + "-" + str(current_user)
-    bytes_msg = bytes(msg, encoding="utf-8")
-    selection_request = camera_functions.create_request(bytes_msg)
-    sel = camera_functions.create_socket_connection(selection_request)
-
-    # Start loop for managing connection
-    try:
-        while True:
-            events = sel.select(timeout=1)
-            for key, mask in events:
-                message = key.data
-                try:
-                    message.process_events(mask)
-                    message.close()
-                except Exception as e:
-                    logger.error("Failed to send message to handle camera due to: %s" % e)
-                    message.close()
-            # Check for a socket being monitored to continue.
-            if not sel.get_map():
-                break
-    except KeyboardInterrupt:
-        logger.error("Caught keyboard interrupt, exiting.")
-    finally:
-        sel.close()
+    # Tell the server to start the camera and show it
+    response = camera_functions.send_command(Command(VIEW_CAMERA, current_user, camera_id))
+    if response is not None:
+        logger.info("Camera %s for user %s: %s" % (camera_id, current_user, response.cameras))
 
     # Create a dictionary of cameras to create camera list at home view
     data = camera_functions.import_camera_list(current_user)
@@ -167,31 +216,13 @@ def manage_system(request, task):
     else:
         system_status = camera_functions.update_system_status(current_user, 0)
 
-    # Start connection
-    msg = "manage-" + str(task) + "-" + str(current_user)
-    bytes_msg = bytes(msg, encoding="utf-8")
-    selection_request = camera_functions.create_request(bytes_msg)
-    sel = camera_functions.create_socket_connection(selection_request)
+    # The row of the user changed, the server drops its cached user and class settings
+    camera_functions.send_command(Command(CONFIG_CHANGED, current_user))
 
-    # Start loop for managing connection
-    try:
-        while True:
-            events = sel.select(timeout=1)
-            for key, mask in events:
-                message = key.data
-                try:
-                    message.process_events(mask)
-                    message.close()
-                    logger.info("Message sent to server to %s cameras for user %s." % (task, current_user))
-                except Exception as e:
-                    logger.error("Failed to send message to handle camera due to: %s" % e)
-                    message.close()
-            # Check for a socket being monitored to continue.
-            if not sel.get_map():
-                break
-    except KeyboardInterrupt:
-        logger.error("Caught keyboard interrupt, exiting.")
-    finally:
-        sel.close()
+    # Tell the server to start or stop the cameras
+    action = START_SYSTEM if task == "start" else STOP_SYSTEM
+    response = camera_functions.send_command(Command(action, current_user))
+    if response is not None:
+        logger.info("Server %s cameras for user %s: %s" % (task, current_user, response.cameras))
 
     return redirect(main)
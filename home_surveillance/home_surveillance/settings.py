@@ -90,6 +90,13 @@ DATABASES = {
         }
     }
 
+# The same SQLite file as the server, relative paths are relative to BASE_DIR, see server/sqlite_backend.py
+if os.getenv('DB_BACKEND') == 'sqlite':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, os.getenv('SQLITE_DB', 'home_surveillance.sqlite3')),
+        }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -0,0 +1,349 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from home_surveillance.server.mysql_conn import MysqlConnection, is_connection_error
+
+# Create loggers for code
+logger = logging.getLogger("alarm_log")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# Rows written in one statement, and the longest time in seconds a row waits before it is written
+BATCH_SIZE = int(os.getenv('ALARM_LOG_BATCH_SIZE', 100))
+FLUSH_INTERVAL = float(os.getenv('ALARM_LOG_FLUSH_INTERVAL', 1))
+# Directory for rows that could not be written while the database was unavailable
+JOURNAL_DIR = os.getenv('ALARM_LOG_JOURNAL_DIR', 'alarm_journal')
+JOURNAL_PREFIX = "alarm_log_"
+JOURNAL_SUFFIX = ".journal"
+# Rows the database refused for another reason than the connection are kept apart in files with this suffix
+REJECTED_SUFFIX = ".rejected"
+
+
+class AlarmLog():
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, journal_dir=JOURNAL_DIR,
+                 retry_interval=5, connection=None):
+        '''
+        Write-behind logger for rows inserted by the workers. Rows are buffered and written by a
+        background thread with one multi-row insert per table, once batch_size rows are waiting
+        or the oldest has waited flush_interval. While the database is unavailable the rows are
+        appended to a journal file and written once it is back, in the order they were logged.
+        Rows the database refuses for another reason are not retried, they are moved to a file of
+        rejected rows and their callers get the error.
+            batch_size = Number of rows that triggers a write
+            flush_interval = Longest time in seconds a row waits before it is written
+            journal_dir = Directory of the journal files
+            retry_interval = Time in seconds between attempts to write the journal
+            connection = MysqlConnection to write with, the one of the process if not given
+        '''
+
+        self.batch_size = batch_size
+        self.buffer = []
+        self.condition = threading.Condition()
+        self.connection = connection
+        self.flush_interval = flush_interval
+        self.journal_dir = journal_dir
+        self.journal_futures = {}
+        self.journal_pending = False
+        self.journal_path = os.path.join(journal_dir, "%s%s%s" % (JOURNAL_PREFIX, os.getpid(), JOURNAL_SUFFIX))
+        self.journal_sequence = 0
+        self.rejected_path = os.path.join(journal_dir, "%s%s%s" % (JOURNAL_PREFIX, os.getpid(), REJECTED_SUFFIX))
+        self.retry_interval = retry_interval
+        self.retry_time = 0
+        self.thread = None
+        self.write_lock = threading.Lock()
+
+        # Statistics
+        self.rows_journaled = 0
+        self.rows_rejected = 0
+        self.rows_written = 0
+        self.writes = 0
+
+    #-------------------------------------------------------------------------------
+    def append_to_journal(self, table, columns, rows, futures):
+        ''' Keep rows that could not be written, their futures are resolved once the journal is written '''
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(self.journal_path, "a") as f:
+            for values, future in zip(rows, futures):
+                self.journal_sequence += 1
+                f.write(json.dumps({"sequence": self.journal_sequence, "table": table, "columns": columns,
+                                    "values": values}) + "\n")
+                if future is not None:
+                    self.journal_futures[self.journal_sequence] = future
+        self.journal_pending = True
+        self.rows_journaled += len(rows)
+
+    #-------------------------------------------------------------------------------
+    def claim_journals(self):
+        '''
+        Take over the journals of processes that are no longer running, returns the journals taken
+        over now or before that are left to write, oldest first
+        '''
+
+        try:
+            names = sorted(os.listdir(self.journal_dir))
+        except FileNotFoundError:
+            return []
+
+        journals = []
+        for name in names:
+            if not (name.startswith(JOURNAL_PREFIX) and name.endswith(JOURNAL_SUFFIX)):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            if path == self.journal_path:
+                continue
+            if path.startswith(self.journal_path + "."):
+                journals.append(path)
+                continue
+            try:
+                pid = int(name[len(JOURNAL_PREFIX):-len(JOURNAL_SUFFIX)].split(".")[0])
+                os.kill(pid, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except (ValueError, PermissionError):
+                continue
+
+            # Renaming is atomic, only one process gets each journal
+            claimed = "%s.%s" % (self.journal_path, name)
+            try:
+                os.rename(path, claimed)
+                journals.append(claimed)
+            except FileNotFoundError:
+                pass
+        return journals
+
+    #-------------------------------------------------------------------------------
+    def fail(self, batch, error):
+        ''' Pass the error to the callers of rows that were neither written nor journaled '''
+
+        for table, data, future, queued in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    #-------------------------------------------------------------------------------
+    def flush(self):
+        ''' Write the buffered rows now, e.g. before the process stops '''
+
+        with self.condition:
+            batch, self.buffer = self.buffer, []
+        try:
+            self.write(batch)
+        except Exception as e:
+            self.fail(batch, e)
+            raise
+
+    #-------------------------------------------------------------------------------
+    def get_connection(self):
+        return self.connection if self.connection is not None else MysqlConnection()
+
+    #-------------------------------------------------------------------------------
+    def log(self, table, data):
+        '''
+        Queue a row for insertion, returns a Future resolved with True once the row is written
+            table = String with table name
+            data = List with tuples with column name and values
+        '''
+
+        future = Future()
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.buffer.append((table, data, future, time.monotonic()))
+            # The thread is woken to time the first row, and when a batch is full
+            if len(self.buffer) == 1 or len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+        return future
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        ''' Loop of the thread writing the rows '''
+
+        while True:
+            with self.condition:
+                while len(self.buffer) < self.batch_size:
+                    if self.buffer:
+                        timeout = self.buffer[0][3] + self.flush_interval - time.monotonic()
+                    elif self.journal_pending:
+                        timeout = self.retry_time - time.monotonic()
+                    else:
+                        timeout = None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                batch, self.buffer = self.buffer, []
+
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.error("Failed to write %s rows: %s" % (len(batch), e))
+                self.fail(batch, e)
+
+    #-------------------------------------------------------------------------------
+    def write(self, batch):
+        ''' Write the journal if there is one, then the batch, or append the batch to the journal '''
+
+        with self.write_lock:
+            written = self.write_journals()
+
+            # Rows of one table with the same columns are written together, in the order they were logged
+            groups = {}
+            for table, data, future, queued in batch:
+                columns = tuple(column for column, value in data)
+                rows, futures = groups.setdefault((table, columns), ([], []))
+                rows.append([value for column, value in data])
+                futures.append(future)
+
+            # At most batch_size rows go into one statement
+            for (table, columns), (rows, futures) in groups.items():
+                for start in range(0, len(rows), self.batch_size):
+                    chunk_rows = rows[start:start + self.batch_size]
+                    chunk_futures = futures[start:start + self.batch_size]
+                    if written:
+                        handled, error = self.write_chunk(table, list(columns), chunk_rows, chunk_futures)
+                        chunk_rows, chunk_futures = chunk_rows[handled:], chunk_futures[handled:]
+                        if error is not None:
+                            logger.error("Database unavailable, %s rows kept in journal: %s" % (len(rows) - start - handled, error))
+                            self.retry_time = time.monotonic() + self.retry_interval
+                            self.journal_pending = True
+                            written = False
+                    if not written:
+                        self.append_to_journal(table, list(columns), chunk_rows, chunk_futures)
+
+    #-------------------------------------------------------------------------------
+    def write_chunk(self, table, columns, rows, futures):
+        '''
+        Write rows in one statement, returns the number of rows handled and the connection error that
+        stopped the others, if any. When the database refuses the rows for another reason, they are
+        written one by one so that only the bad rows are rejected.
+        '''
+
+        try:
+            self.write_rows(table, columns, rows, futures)
+            return len(rows), None
+        except Exception as e:
+            if is_connection_error(e):
+                return 0, e
+            if len(rows) == 1:
+                self.reject(table, columns, rows, futures, e)
+                return 1, None
+
+        for position in range(len(rows)):
+            handled, error = self.write_chunk(table, columns, rows[position:position + 1], futures[position:position + 1])
+            if error is not None:
+                return position, error
+        return len(rows), None
+
+    #-------------------------------------------------------------------------------
+    def write_journals(self):
+        ''' Write the journals of this and stopped processes, returns False if rows are left in one '''
+
+        if time.monotonic() < self.retry_time:
+            return not self.journal_pending
+
+        for path in self.claim_journals() + [self.journal_path]:
+            try:
+                with open(path) as f:
+                    entries = [json.loads(line) for line in f if line.strip()]
+            except FileNotFoundError:
+                continue
+
+            position = 0
+            error = None
+            while position < len(entries):
+                # Consecutive entries of the same table and columns are written together
+                table, columns = entries[position]["table"], entries[position]["columns"]
+                end = position + 1
+                while (end < len(entries) and end - position < self.batch_size and
+                       entries[end]["table"] == table and entries[end]["columns"] == columns):
+                    end += 1
+                futures = [self.journal_futures.pop(entry["sequence"], None) if path == self.journal_path else None
+                           for entry in entries[position:end]]
+                handled, error = self.write_chunk(table, columns, [entry["values"] for entry in entries[position:end]], futures)
+                if error is not None:
+                    # The rows that were not written stay in the journal together with their futures
+                    for entry, future in zip(entries[position + handled:end], futures[handled:]):
+                        if future is not None:
+                            self.journal_futures[entry["sequence"]] = future
+                    position += handled
+                    break
+                position = end
+
+            if error is not None:
+                logger.error("Database unavailable, %s rows left in journal %s: %s" %
+                             (len(entries) - position, path, error))
+                self.journal_pending = True
+                self.retry_time = time.monotonic() + self.retry_interval
+                self.rewrite_journal(path, entries[position:])
+                return False
+
+            os.remove(path)
+            logger.info("Wrote %s rows from journal %s." % (len(entries), path))
+
+        self.journal_pending = False
+        return True
+
+    #-------------------------------------------------------------------------------
+    def reject(self, table, columns, rows, futures, error):
+        ''' Keep rows the database refused in the file of rejected rows and pass the error to their callers '''
+
+        logger.error("%s rows for %s rejected by the database, kept in %s: %s" % (len(rows), table, self.rejected_path, error))
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(self.rejected_path, "a") as f:
+            for values in rows:
+                f.write(json.dumps({"table": table, "columns": columns, "values": values, "error": str(error)}) + "\n")
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_exception(error)
+        self.rows_rejected += len(rows)
+
+    #-------------------------------------------------------------------------------
+    def rewrite_journal(self, path, entries):
+        ''' Replace the journal with the entries that are left '''
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, path)
+
+    #-------------------------------------------------------------------------------
+    def write_rows(self, table, columns, rows, futures):
+        ''' Insert rows in one statement and resolve their futures '''
+
+        self.get_connection().insert_many(table, columns, rows)
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_result(True)
+        self.rows_written += len(rows)
+        self.writes += 1
+
+
+# One alarm log per process, its thread does not exist in forked processes
+alarm_logs = {}
+alarm_logs_lock = threading.Lock()
+
+
+#-------------------------------------------------------------------------------
+def get_alarm_log():
+    pid = os.getpid()
+    alarm_log = alarm_logs.get(pid)
+    if alarm_log is None:
+        with alarm_logs_lock:
+            alarm_log = alarm_logs.setdefault(pid, AlarmLog())
+    return alarm_log
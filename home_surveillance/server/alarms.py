@@ -0,0 +1,234 @@
+import cv2
+import logging
+import queue
+import requests
+import time
+from datetime import datetime
+from threading import Lock, Thread
+from alarm_log import get_alarm_log
+from config_cache import get_config_cache
+
+# Create loggers for code
+logger = logging.getLogger("alarms")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# GLOBAL VARS
+PUSHOVER_URL = "https://api.pushover.net/1/messages.json"
+
+
+class Alarm():
+    def __init__(self, user_id, camera_id, camera_name, class_id, spotted_class, score, image, snapshot=None):
+        '''
+        Everything needed to log and notify about a class that has been spotted. The snapshot
+        is the image already encoded as jpg, if the worker had encoded it anyway.
+        '''
+
+        self.user_id = user_id
+        self.camera_id = camera_id
+        self.camera_name = camera_name
+        self.class_id = class_id
+        self.spotted_class = spotted_class
+        self.score = score
+        self.image = image
+        self.snapshot = snapshot
+        self.timestamp = datetime.now()
+
+
+class AlarmDispatcher():
+    def __init__(self, camera_id, num_threads=2, max_queue_size=50, max_retries=3, retry_delay=1,
+                 pushover_url=PUSHOVER_URL, request_timeout=10):
+        '''
+        Logs alarms to SQL and delivers notifications in background threads, so that the
+        worker never waits for the database or the network.
+            num_threads = Number of threads handling alarms
+            max_queue_size = Max number of alarms waiting, new alarms are dropped when full
+            max_retries = Number of retries for each step of an alarm before giving up
+            retry_delay = Delay in seconds before the first retry, doubled for every retry
+        '''
+
+        self.camera_id = camera_id
+        self.alarm_queue = queue.Queue(maxsize=max_queue_size)
+        self.max_retries = max_retries
+        self.num_threads = num_threads
+        self.pushover_url = pushover_url
+        self.request_timeout = request_timeout
+        self.retry_delay = retry_delay
+        self.threads = []
+
+        # Statistics
+        self.lock = Lock()
+        self.alarms_delivered = 0
+        self.alarms_dropped = 0
+        self.alarms_failed = 0
+
+    #-------------------------------------------------------------------------------
+    def deliver_pushover(self, alarm, snapshot):
+        ''' Message user when something has been spotted. '''
+
+        settings = self.import_user_data_from_sql(alarm.user_id)
+        priority = 1
+        r = requests.post(self.pushover_url, data = {
+          "token": settings["push_token"],
+          "user": settings["push_user"],
+          "message": "A %s has been spotted on camera %s with priority %s!" % (alarm.spotted_class, alarm.camera_name, priority),
+          "priority": priority,
+          "retry": 60,
+          "expire": 180
+        },
+        files = {"attachment": ("image.jpg", snapshot, "image/jpeg")},
+        timeout = self.request_timeout
+        )
+        r.raise_for_status()
+        logger.info("Camera %s: Pushover successfully delivered with priority %s" % (alarm.camera_id, priority))
+
+    #-------------------------------------------------------------------------------
+    def dispatch(self, alarm):
+        ''' Queue alarm without blocking, returns False if the queue is full '''
+
+        try:
+            self.alarm_queue.put_nowait(alarm)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.alarms_dropped += 1
+            logger.error("Camera %s: Alarm queue is full, alarm for %s was dropped." % (self.camera_id, alarm.spotted_class))
+            return False
+
+    #-------------------------------------------------------------------------------
+    def encode_snapshot(self, alarm):
+        ''' Encode the image of the alarm to jpg '''
+
+        if alarm.snapshot is not None:
+            return alarm.snapshot
+        is_success, im_buf_arr = cv2.imencode(".jpg", alarm.image)
+        if not is_success:
+            raise ValueError("Unable to encode snapshot.")
+        return im_buf_arr.tobytes()
+
+    #-------------------------------------------------------------------------------
+    def import_user_data_from_sql(self, user_id):
+        ''' Import user data '''
+
+        return get_config_cache().user(user_id)
+
+    #-------------------------------------------------------------------------------
+    def is_retryable_pushover_error(self, error):
+        '''
+        Only errors where Pushover did not get or did not handle the message are retried. After a read
+        timeout the message may have been delivered already, retrying it could notify the user twice.
+        '''
+
+        if isinstance(error, requests.ConnectionError):
+            return True
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code >= 500
+        return False
+
+    #-------------------------------------------------------------------------------
+    def log_alarm_to_sql(self, alarm):
+        ''' Log event to SQL, returns a Future resolved with True once the log row has been written '''
+
+        table = "app_factalarmlog"
+        data = [
+            ("user_id", alarm.user_id),
+            ("camera_id", alarm.camera_id),
+            ("log_date", alarm.timestamp.strftime("%Y-%m-%d %H:%M:%S")),
+            ("log_class", alarm.class_id),
+            ("log_score", float(alarm.score)),
+            ("log_num_img", 0),
+            ("log_status", 0),
+            ("download_status", 0),
+            ("download_url", ""),
+        ]
+        future = get_alarm_log().log(table, data)
+        logger.info('Camera %s: Detection queued for SQL, alarm status %s.' % (alarm.camera_id, 1))
+        return future
+
+    #-------------------------------------------------------------------------------
+    def process_alarm(self, alarm):
+        ''' Log alarm and notify user, each step is retried on its own '''
+
+        delivered = True
+        try:
+            self.retry(self.log_alarm_to_sql, alarm)
+        except Exception as e:
+            delivered = False
+            logger.error('Camera %s: Saving log to SQL failed: %s' % (alarm.camera_id, e))
+
+        try:
+            snapshot = self.encode_snapshot(alarm)
+            self.retry(self.deliver_pushover, alarm, snapshot, retryable=self.is_retryable_pushover_error)
+        except Exception as e:
+            delivered = False
+            logger.error("Camera %s: Pushover failed to deliver alarm message: %s" % (alarm.camera_id, e))
+
+        with self.lock:
+            if delivered:
+                self.alarms_delivered += 1
+            else:
+                self.alarms_failed += 1
+
+    #-------------------------------------------------------------------------------
+    def retry(self, function, *args, retryable=None):
+        '''
+        Call function and retry with exponential backoff if it fails
+            retryable = Function telling if an error should be retried, all errors are retried if not given
+        '''
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return function(*args)
+            except Exception as e:
+                if attempt == self.max_retries or (retryable is not None and not retryable(e)):
+                    raise
+                delay = self.retry_delay * (2 ** attempt)
+                logger.info("Camera %s: %s failed, retrying in %s s: %s" % (self.camera_id, function.__name__, delay, e))
+                time.sleep(delay)
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        ''' Loop for each alarm thread '''
+
+        while True:
+            alarm = self.alarm_queue.get()
+            try:
+                if alarm is None:
+                    break
+                self.process_alarm(alarm)
+            finally:
+                self.alarm_queue.task_done()
+
+    #-------------------------------------------------------------------------------
+    def start(self):
+        for i in range(self.num_threads):
+            thread = Thread(target=self.run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    #-------------------------------------------------------------------------------
+    def stop(self, timeout=30):
+        ''' Let the threads finish the queued alarms and stop them '''
+
+        for thread in self.threads:
+            self.alarm_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+        # Write the logged alarms that are still buffered
+        try:
+            get_alarm_log().flush()
+        except Exception as e:
+            logger.error("Camera %s: Failed to write buffered alarms to SQL: %s" % (self.camera_id, e))
@@ -0,0 +1,66 @@
+''' Throughput of logging alarms with one insert per alarm against the write-behind alarm log '''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alarm_log import AlarmLog
+from bench_mysql_pool import create_sqlite_database
+from home_surveillance.server import mysql_conn
+from home_surveillance.server.mysql_conn import ConnectionPool, MysqlConnection
+from home_surveillance.server.sqlite_backend import SqliteConnection
+
+ALARM = [("user_id", 1), ("camera_id", 1), ("log_date", "2024-01-01 12:00:00"), ("log_class", 0), ("log_score", 0.9),
+         ("log_num_img", 0), ("log_status", 0), ("download_status", 0), ("download_url", "")]
+
+
+#-------------------------------------------------------------------------------
+def log_with_inserts(connection, alarms):
+    ''' Before, every alarm is its own insert and transaction '''
+
+    start = time.perf_counter()
+    for i in range(alarms):
+        connection.insert_data("app_factalarmlog", ALARM)
+    return time.perf_counter() - start
+
+#-------------------------------------------------------------------------------
+def log_with_alarm_log(connection, alarms, batch_size):
+    ''' After, alarms are buffered and written batch_size rows at a time '''
+
+    alarm_log = AlarmLog(batch_size=batch_size, flush_interval=60, journal_dir=tempfile.mkdtemp(),
+                         connection=connection)
+    start = time.perf_counter()
+    futures = [alarm_log.log("app_factalarmlog", ALARM) for i in range(alarms)]
+    alarm_log.flush()
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    assert alarm_log.rows_written == alarms
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--alarms", type=int, default=5000, help="Number of alarms logged")
+    parser.add_argument("--mysql", action="store_true",
+                        help="Use the MySQL server of the MYSQL_* environment variables instead of SQLite, "
+                             "it needs the app_factalarmlog table")
+    args = parser.parse_args()
+
+    if args.mysql:
+        connect = mysql_conn.connect
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        create_sqlite_database(path)
+        connect = lambda: SqliteConnection(path)
+    connection = MysqlConnection(ConnectionPool(connect, size=1))
+
+    elapsed = log_with_inserts(connection, args.alarms)
+    print("%-24s %8.0f rows/s" % ("insert_data per alarm", args.alarms / elapsed))
+    for batch_size in (1, 10, 100):
+        elapsed = log_with_alarm_log(connection, args.alarms, batch_size)
+        print("%-24s %8.0f rows/s" % ("alarm log, %s per flush" % batch_size, args.alarms / elapsed))
@@ -0,0 +1,125 @@
+''' Round trip latency of control commands, one connection per command against the persistent control connection '''
+
+import asyncio
+import contextlib
+import io
+import os
+import selectors
+import socket
+import sys
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import libclient
+import libserver
+from app.control_client import ControlClient
+from commands import Command, VIEW_CAMERA
+from control import ControlConnection
+
+COMMANDS_PER_USER = 200
+CONCURRENT_USERS = [1, 10, 50]
+
+
+#-------------------------------------------------------------------------------
+def serve(lsock, create_handler):
+    ''' Selectors loop like the old one in server_main, create_handler wraps every accepted connection '''
+
+    sel = selectors.DefaultSelector()
+    sel.register(lsock, selectors.EVENT_READ, data=None)
+    while True:
+        for key, mask in sel.select(timeout=None):
+            if key.data is None:
+                conn, addr = key.fileobj.accept()
+                conn.setblocking(False)
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sel.register(conn, selectors.EVENT_READ, data=create_handler(sel, conn, addr))
+            else:
+                try:
+                    key.data.process_events(mask)
+                except Exception:
+                    key.data.close()
+
+#-------------------------------------------------------------------------------
+async def handle_command(request):
+    return {"status": "ok", "cameras": {}, "error": None}
+
+#-------------------------------------------------------------------------------
+def serve_control(lsock):
+    ''' Event loop like the one in server_main serving persistent control connections '''
+
+    async def main():
+        server = await asyncio.get_running_loop().create_server(lambda: ControlConnection(handle_command), sock=lsock)
+        await server.serve_forever()
+    asyncio.run(main())
+
+#-------------------------------------------------------------------------------
+def start_control_server():
+    lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    lsock.bind(("127.0.0.1", 0))
+    lsock.listen(512)
+    Thread(target=serve_control, args=(lsock,), daemon=True).start()
+    return lsock.getsockname()
+
+#-------------------------------------------------------------------------------
+def start_server(create_handler):
+    lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    lsock.bind(("127.0.0.1", 0))
+    lsock.listen(512)
+    lsock.setblocking(False)
+    Thread(target=serve, args=(lsock, create_handler), daemon=True).start()
+    return lsock.getsockname()
+
+#-------------------------------------------------------------------------------
+def send_with_new_connection(addr):
+    ''' The way the views sent commands before, a new connection and selectors loop per command '''
+
+    sel = selectors.DefaultSelector()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    sock.connect_ex(addr)
+    request = dict(type="text/json", encoding="utf-8", content={"action": "search", "value": "ring"})
+    message = libclient.Message(sel, sock, addr, request)
+    sel.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, data=message)
+    while sel.get_map():
+        for key, mask in sel.select(timeout=1):
+            key.data.process_events(mask)
+    sel.close()
+
+#-------------------------------------------------------------------------------
+def run_users(name, num_users, send):
+    ''' Let every user send commands one after the other, returns a summary of the round trip times '''
+
+    latencies = []
+    def user():
+        for i in range(COMMANDS_PER_USER):
+            start = time.perf_counter()
+            send()
+            latencies.append(time.perf_counter() - start)
+
+    threads = [Thread(target=user) for i in range(num_users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return ("%-22s %3s users: %7.0f commands/s, round trip %6.3f ms median, %6.3f ms p95, %6.3f ms p99" %
+            (name, num_users, len(latencies) / elapsed, 1000 * latencies[len(latencies) // 2],
+             1000 * latencies[int(0.95 * len(latencies))], 1000 * latencies[int(0.99 * len(latencies))]))
+
+
+if __name__ == '__main__':
+    old_addr = start_server(lambda sel, conn, addr: libserver.Message(sel, conn, addr))
+    new_addr = start_control_server()
+    client = ControlClient(*new_addr)
+
+    for num_users in CONCURRENT_USERS:
+        # The old message classes print every request and response
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_users("Connection per command", num_users, lambda: send_with_new_connection(old_addr))
+        print(result)
+        print(run_users("Persistent connection", num_users, lambda: client.request(Command(VIEW_CAMERA, 1, 1).to_dict())))
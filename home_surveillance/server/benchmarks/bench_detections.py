@@ -0,0 +1,49 @@
+''' Compare the tensor based detection extraction with the old result.verbose() string parsing '''
+
+import os
+import sys
+import timeit
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from detections import extract_detections
+
+NAMES = {0: "person", 1: "bicycle", 2: "car", 3: "motorcycle", 5: "bus", 7: "truck", 16: "dog", 17: "horse"}
+
+
+#-------------------------------------------------------------------------------
+def create_results(num_boxes):
+    ''' Create a results object like the one from YOLOv8 with random boxes '''
+
+    image = np.zeros((600, 920, 3), dtype=np.uint8)
+    class_ids = np.random.choice(list(NAMES.keys()), num_boxes)
+    boxes = torch.zeros((num_boxes, 6))
+    boxes[:, 2:4] = 100
+    boxes[:, 4] = torch.rand(num_boxes) * 0.2 + 0.8
+    boxes[:, 5] = torch.tensor(class_ids)
+    return [Results(image, path="", names=NAMES, boxes=boxes)]
+
+#-------------------------------------------------------------------------------
+def extract_with_strings(results):
+    ''' The old extraction, parsing the verbose string of the results '''
+
+    result_class_list = []
+    max_class_probability = 0
+    for result in results:
+        if "(no detections)," not in result.verbose():
+            max_class_probability = result.boxes.conf[0].detach().item()
+            class_string = result.verbose().split(" ")[1]
+            result_class_list.append(class_string[0:len(class_string)-1])
+    return result_class_list, max_class_probability
+
+
+if __name__ == '__main__':
+    number = 10000
+    for num_boxes in (0, 1, 5, 20):
+        results = create_results(num_boxes)
+        string_time = timeit.timeit(lambda: extract_with_strings(results), number=number) / number
+        tensor_time = timeit.timeit(lambda: extract_detections(results), number=number) / number
+        print("%2s boxes: verbose() parsing %7.1f us, tensor extraction %7.1f us, speedup %.1fx" %
+              (num_boxes, string_time * 1e6, tensor_time * 1e6, string_time / tensor_time))
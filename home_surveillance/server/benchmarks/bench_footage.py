@@ -0,0 +1,75 @@
+''' Compare base64 text frames with raw multipart jpg frames on the footage socket '''
+
+import base64
+import json
+import time
+import cv2
+import numpy as np
+import zmq
+
+NUM_FRAMES = 500
+
+
+#-------------------------------------------------------------------------------
+def create_image():
+    ''' Camera like image, smooth gradients with some noise '''
+
+    x = np.linspace(0, 255, 920, dtype=np.float32)
+    y = np.linspace(0, 255, 600, dtype=np.float32)
+    image = np.dstack([np.add.outer(y, x) / 2, np.add.outer(y, x[::-1]) / 2, np.add.outer(y[::-1], x) / 2])
+    image += np.random.normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+#-------------------------------------------------------------------------------
+def send_base64(socket, buffer, sequence):
+    message = base64.b64encode(buffer)
+    socket.send(message)
+    return len(message)
+
+#-------------------------------------------------------------------------------
+def recv_base64(socket):
+    return base64.b64decode(socket.recv_string())
+
+#-------------------------------------------------------------------------------
+def send_multipart(socket, buffer, sequence):
+    header = json.dumps({"camera_id": 1, "sequence": sequence, "timestamp": time.time()}).encode("utf-8")
+    socket.send_multipart([header, buffer], copy=False)
+    return len(header) + buffer.nbytes
+
+#-------------------------------------------------------------------------------
+def recv_multipart(socket):
+    header, img = socket.recv_multipart()
+    return img
+
+#-------------------------------------------------------------------------------
+def run(name, send, recv, buffer):
+    ''' Send frames through a socket pair and measure bytes and cpu time per frame '''
+
+    context = zmq.Context.instance()
+    sender = context.socket(zmq.PUSH)
+    receiver = context.socket(zmq.PULL)
+    port = receiver.bind_to_random_port("tcp://127.0.0.1")
+    sender.connect("tcp://127.0.0.1:%s" % port)
+
+    wire_bytes = 0
+    send_time = 0
+    recv_time = 0
+    for sequence in range(NUM_FRAMES):
+        start = time.process_time()
+        wire_bytes += send(sender, buffer, sequence)
+        send_time += time.process_time() - start
+
+        start = time.process_time()
+        recv(receiver)
+        recv_time += time.process_time() - start
+
+    sender.close()
+    receiver.close()
+    print("%-10s %8.0f bytes/frame, send %6.1f us cpu/frame, receive %6.1f us cpu/frame" %
+          (name, wire_bytes / NUM_FRAMES, send_time / NUM_FRAMES * 1e6, recv_time / NUM_FRAMES * 1e6))
+
+
+if __name__ == '__main__':
+    encoded, buffer = cv2.imencode(".jpg", create_image())
+    run("base64", send_base64, recv_base64, buffer)
+    run("multipart", send_multipart, recv_multipart, buffer)
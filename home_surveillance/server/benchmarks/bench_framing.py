@@ -0,0 +1,122 @@
+''' Throughput of the framing codec against the Message classes of libserver and libclient '''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import libclient
+import libserver
+from framing import MessageDecoder, encode_message
+
+# Largest read the kernel hands over in one recv on a loopback connection
+READ_SIZE = 65536
+MIN_DURATION = 1
+
+PAYLOADS = [
+    ("small json", {"action": "view_camera", "user_id": 1, "camera_id": 2}, "text/json", "utf-8"),
+    ("64 kB json", {"detections": [{"label": "person", "box": [1, 2, 3, 4]}] * 1500}, "text/json", "utf-8"),
+    ("1 MB binary", os.urandom(1 << 20), "binary/custom-client-binary-type", "binary"),
+    ("8 MB binary", os.urandom(8 << 20), "binary/custom-client-binary-type", "binary"),
+]
+
+
+class StreamSocket():
+    def __init__(self, data, count=1):
+        ''' Socket handing out data count times from memory, in reads of at most READ_SIZE bytes '''
+
+        self.data = memoryview(data)
+        self.count = count
+        self.position = 0
+
+    #-------------------------------------------------------------------------------
+    def next_read(self, size):
+        ''' Return the next part of the stream, a read ends at the end of each copy of data '''
+
+        if self.position == len(self.data) and self.count > 1:
+            self.count -= 1
+            self.position = 0
+        size = min(size, READ_SIZE, len(self.data) - self.position)
+        self.position += size
+        return self.data[self.position - size:self.position]
+
+    #-------------------------------------------------------------------------------
+    def recv(self, size):
+        return bytes(self.next_read(size))
+
+    #-------------------------------------------------------------------------------
+    def recv_into(self, buffer):
+        data = self.next_read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class NoSelector():
+    def modify(self, *args, **kwargs):
+        pass
+
+
+#-------------------------------------------------------------------------------
+def decode_with_message(message_bytes, count):
+    ''' The Message classes read one message per connection, so every message gets a new one '''
+
+    for i in range(count):
+        message = libserver.Message(NoSelector(), StreamSocket(message_bytes), None)
+        while message.request is None:
+            message.read()
+
+#-------------------------------------------------------------------------------
+def decode_with_decoder(message_bytes, count):
+    ''' All messages arrive back to back on one connection '''
+
+    sock = StreamSocket(message_bytes, count)
+    decoder = MessageDecoder()
+    received = 0
+    while received < count:
+        decoder.recv_into(sock)
+        received += len(decoder.messages())
+
+#-------------------------------------------------------------------------------
+def encode_with_message(content, content_type, content_encoding, count):
+    message = libclient.Message(NoSelector(), None, None, None)
+    if content_type == "text/json":
+        for i in range(count):
+            message._create_message(content_bytes=message._json_encode(content, content_encoding),
+                                    content_type=content_type, content_encoding=content_encoding)
+    else:
+        for i in range(count):
+            message._create_message(content_bytes=content, content_type=content_type, content_encoding=content_encoding)
+
+#-------------------------------------------------------------------------------
+def encode_with_codec(content, content_type, content_encoding, count):
+    for i in range(count):
+        encode_message(content, i, content_type, content_encoding)
+
+#-------------------------------------------------------------------------------
+def measure(function, *args):
+    ''' Run function with growing counts until it takes MIN_DURATION, returns messages per second '''
+
+    count = 1
+    while True:
+        start = time.perf_counter()
+        function(*args, count)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_DURATION:
+            return count / elapsed
+        count *= 2
+
+
+if __name__ == '__main__':
+    # The Message classes print every json request they receive
+    libserver.print = lambda *args, **kwargs: None
+
+    for name, content, content_type, content_encoding in PAYLOADS:
+        message_bytes = encode_message(content, None, content_type, content_encoding)
+        size = len(message_bytes) / 1e6
+        for label, rate in [
+            ("decode, Message", measure(decode_with_message, message_bytes)),
+            ("decode, MessageDecoder", measure(decode_with_decoder, message_bytes)),
+            ("encode, Message", measure(encode_with_message, content, content_type, content_encoding)),
+            ("encode, encode_message", measure(encode_with_codec, content, content_type, content_encoding)),
+        ]:
+            print("%-12s %-24s %10.1f messages/s %9.1f MB/s" % (name, label, rate, rate * size))
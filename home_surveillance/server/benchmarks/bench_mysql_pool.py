@@ -0,0 +1,97 @@
+''' Latency of the statements of the alarm path, opening a connection per statement against the connection pool '''
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from home_surveillance.server import mysql_conn
+from home_surveillance.server.mysql_conn import ConnectionPool, MysqlConnection
+from home_surveillance.server.sqlite_backend import SqliteConnection
+
+USER_COLUMNS = ["account_type", "max_cameras", "push_token", "push_user", "user_id", "system_status"]
+ALARM_COLUMNS = ["user_id", "camera_id", "log_date", "log_class", "log_score", "log_num_img", "log_status",
+                 "download_status", "download_url"]
+
+
+class SlowSqliteConnection(SqliteConnection):
+    def __init__(self, path, connect_latency=0):
+        '''
+        SQLite connection that takes longer to open, like the handshake with a server
+            connect_latency = Time in seconds added to every connect
+        '''
+
+        time.sleep(connect_latency)
+        super().__init__(path)
+
+
+#-------------------------------------------------------------------------------
+def create_sqlite_database(path):
+    cnx = sqlite3.connect(path)
+    cnx.execute("CREATE TABLE app_dimperson (id INTEGER PRIMARY KEY, %s)" % ", ".join(USER_COLUMNS))
+    cnx.execute("CREATE TABLE app_factalarmlog (id INTEGER PRIMARY KEY AUTOINCREMENT, %s)" % ", ".join(ALARM_COLUMNS))
+    cnx.execute("INSERT INTO app_dimperson (%s) VALUES ('premium', 4, 'token', 'user', 1, 1)" % ", ".join(USER_COLUMNS))
+    cnx.commit()
+    cnx.close()
+
+#-------------------------------------------------------------------------------
+def log_alarm(pool):
+    ''' What the alarm path of a worker does for every alarm '''
+
+    MysqlConnection(pool).query_data(USER_COLUMNS, "app_dimperson", [("user_id", 1)])
+    MysqlConnection(pool).insert_data("app_factalarmlog", [("user_id", 1), ("camera_id", 1),
+                                                           ("log_date", "2024-01-01 12:00:00"), ("log_class", 0),
+                                                           ("log_score", 0.9), ("log_num_img", 0), ("log_status", 0),
+                                                           ("download_status", 0), ("download_url", "")])
+
+#-------------------------------------------------------------------------------
+def run(pool, alarms, threads):
+    ''' Log alarms from a number of threads, returns the latency of every alarm '''
+
+    latencies = []
+
+    def log_alarms():
+        for i in range(alarms // threads):
+            start = time.perf_counter()
+            log_alarm(pool)
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=log_alarms) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sorted(latencies)
+
+#-------------------------------------------------------------------------------
+def print_results(name, latencies, pool):
+    print("%-10s per alarm: mean %7.3f ms, p50 %7.3f ms, p99 %7.3f ms, %s connects" %
+          (name, 1000 * sum(latencies) / len(latencies), 1000 * latencies[len(latencies) // 2],
+           1000 * latencies[int(len(latencies) * 0.99)], pool.connects))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--alarms", type=int, default=2000, help="Number of alarms logged")
+    parser.add_argument("--threads", type=int, default=1, help="Number of threads logging alarms")
+    parser.add_argument("--mysql", action="store_true",
+                        help="Use the MySQL server of the MYSQL_* environment variables instead of SQLite, "
+                             "it needs the app_dimperson and app_factalarmlog tables")
+    parser.add_argument("--connect-latency", type=float, default=0,
+                        help="Milliseconds added to every SQLite connect, like the handshake with a server")
+    args = parser.parse_args()
+
+    if args.mysql:
+        connect = mysql_conn.connect
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        create_sqlite_database(path)
+        connect = lambda: SlowSqliteConnection(path, args.connect_latency / 1000)
+
+    for name, size in (("No pool", 0), ("Pool", args.threads)):
+        pool = ConnectionPool(connect, size=size)
+        print_results(name, run(pool, args.alarms, args.threads), pool)
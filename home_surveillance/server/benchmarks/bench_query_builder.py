@@ -0,0 +1,104 @@
+''' Per call cost of building and running the queries of query_data, string formatting against the query builder '''
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from home_surveillance.server import mysql_conn
+from home_surveillance.server.mysql_conn import ConnectionPool, MysqlConnection, select_statement, where_parameters
+from home_surveillance.server.sqlite_backend import SqliteConnection
+
+COLUMNS = ["camera_name", "rtsp_main", "domain", "port", "user_name", "password", "web_socket", "detection_status",
+           "selected_status"]
+NUM_CAMERAS = 500
+MIN_DURATION = 1
+
+
+#-------------------------------------------------------------------------------
+def build_select_before(columns, table, where_statements):
+    ''' How query_data built its statements before, with the values formatted into the string '''
+
+    query = "SELECT "
+    if columns[0] != "*":
+        for c in range(0, len(columns)):
+            if c < (len(columns) - 1):
+                query += columns[c] + ", "
+            else:
+                query += columns[c] + " FROM "
+    else:
+        query += "* FROM "
+    if len(where_statements) != 0:
+        first = False
+        for w in where_statements:
+            if first != True:
+                query += ("%s WHERE %s = %s" % (table, w[0], w[1]))
+                first = True
+            else:
+                query += (" AND %s = %s" % (w[0], w[1]))
+    else:
+        query += "%s" % table
+    query += ";"
+    return query
+
+#-------------------------------------------------------------------------------
+def build_select_after(columns, table, where_statements):
+    where_shape, data_tuple = where_parameters(where_statements)
+    return select_statement(table, tuple(columns), where_shape), data_tuple
+
+#-------------------------------------------------------------------------------
+def query_before(connection, camera_id):
+    rows = connection.execute(build_select_before(COLUMNS, "app_dimcameras", [("id", camera_id)]), fetch=True)
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+#-------------------------------------------------------------------------------
+def query_after(connection, camera_id):
+    return connection.query_data(COLUMNS, "app_dimcameras", [("id", camera_id)])
+
+#-------------------------------------------------------------------------------
+def measure(function, *args):
+    ''' Call function for every camera until MIN_DURATION has passed, returns microseconds per call '''
+
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < MIN_DURATION:
+        for camera_id in range(1, NUM_CAMERAS + 1):
+            function(*args, camera_id)
+        calls += NUM_CAMERAS
+    return 1e6 * (time.perf_counter() - start) / calls
+
+#-------------------------------------------------------------------------------
+def create_sqlite_database(path):
+    cnx = sqlite3.connect(path)
+    cnx.execute("CREATE TABLE app_dimcameras (id INTEGER PRIMARY KEY, %s)" % ", ".join(COLUMNS))
+    cnx.executemany("INSERT INTO app_dimcameras VALUES (%s)" % ", ".join(["?"] * (len(COLUMNS) + 1)),
+                    [(i, "camera %s" % i, "/stream", "192.168.0.2", 554, "user", "password", 5000 + i, 1, 0)
+                     for i in range(1, NUM_CAMERAS + 1)])
+    cnx.commit()
+    cnx.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mysql", action="store_true",
+                        help="Use the MySQL server of the MYSQL_* environment variables instead of SQLite, "
+                             "it needs the app_dimcameras table")
+    args = parser.parse_args()
+
+    print("%-26s %8.2f us per call" % ("build, formatted values",
+                                        measure(lambda camera_id: build_select_before(COLUMNS, "app_dimcameras", [("id", camera_id)]))))
+    print("%-26s %8.2f us per call" % ("build, query builder",
+                                        measure(lambda camera_id: build_select_after(COLUMNS, "app_dimcameras", [("id", camera_id)]))))
+
+    if args.mysql:
+        connect = mysql_conn.connect
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+        create_sqlite_database(path)
+        connect = lambda: SqliteConnection(path)
+    connection = MysqlConnection(ConnectionPool(connect, size=1))
+    print("%-26s %8.2f us per call" % ("query, formatted values", measure(query_before, connection)))
+    print("%-26s %8.2f us per call" % ("query, query builder", measure(query_after, connection)))
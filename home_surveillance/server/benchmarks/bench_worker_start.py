@@ -0,0 +1,70 @@
+''' Time to first detection and unique memory of new workers, loading their own model against forking from the process template '''
+
+import argparse
+import os
+import sys
+import time
+import multiprocessing as mp
+import numpy as np
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from inference import DETECTION_CLASSES, DETECTION_CONF, import_model
+
+
+#-------------------------------------------------------------------------------
+def run_worker(start_time, results, stop_event):
+    ''' What a worker does before it can detect anything, get the model and analyze a frame '''
+
+    model = import_model()
+    image = np.random.randint(0, 255, (600, 920, 3), dtype=np.uint8)
+    model(image, classes=DETECTION_CLASSES, conf=DETECTION_CONF, verbose=False)
+    results.put((os.getpid(), time.time() - start_time))
+
+    # Stay alive so that the memory of all workers can be measured at the same time
+    stop_event.wait()
+
+#-------------------------------------------------------------------------------
+def start_workers(context, num_workers):
+    ''' Start workers one after the other like cameras being added, returns time to first detection and USS '''
+
+    results = context.Queue()
+    stop_event = context.Event()
+    processes = []
+    times = {}
+    for i in range(num_workers):
+        process = context.Process(target=run_worker, args=(time.time(), results, stop_event), daemon=True)
+        process.start()
+        processes.append(process)
+        pid, elapsed = results.get()
+        times[pid] = elapsed
+
+    memory = {process.pid: psutil.Process(process.pid).memory_full_info() for process in processes}
+    stop_event.set()
+    for process in processes:
+        process.join()
+    return [(times[pid], memory[pid].uss, memory[pid].rss) for pid in times]
+
+#-------------------------------------------------------------------------------
+def print_results(name, results):
+    for i, (elapsed, uss, rss) in enumerate(results):
+        print("%-16s worker %s: first detection after %6.2f s, USS %6.0f MB, RSS %6.0f MB" %
+              (name, i + 1, elapsed, uss / 2 ** 20, rss / 2 ** 20))
+    print("%-16s total USS of %s workers: %.0f MB" % (name, len(results), sum(uss for elapsed, uss, rss in results) / 2 ** 20))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, default=4, help="Number of workers started")
+    args = parser.parse_args()
+
+    # Before, workers forked from the server process load the model themselves
+    print_results("Own model", start_workers(mp.get_context("fork"), args.workers))
+
+    # After, workers forked from the process template get its preloaded model
+    context = mp.get_context("forkserver")
+    context.set_forkserver_preload(["model_template"])
+    start = time.time()
+    context.Process(target=time.sleep, args=(0,)).start()
+    print("Process template started in %.2f s" % (time.time() - start))
+    print_results("Process template", start_workers(context, args.workers))
@@ -0,0 +1,50 @@
+''' Check that stopping a capture process ends it under every start method, and how long it takes '''
+
+import argparse
+import os
+import sys
+import time
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from camera import CaptureProcess
+
+
+#-------------------------------------------------------------------------------
+def stop_capture(method, timeout):
+    ''' Start a capture process on a fake stream and stop it, returns the seconds until it exited or None '''
+
+    # CaptureProcess and the ring take their processes, events and conditions from the default context
+    mp.set_start_method(method, force=True)
+    frame_ring = CaptureProcess.create_frame_ring()
+    capture = CaptureProcess(1, 1, frame_ring, source="fake://?fps=10")
+    capture.start()
+    frame_ring.wait_for_frame(0, 30)
+
+    start = time.perf_counter()
+    capture.stop()
+    capture.join(timeout)
+    elapsed = time.perf_counter() - start
+    if capture.is_alive():
+        capture.kill()
+        capture.join()
+        elapsed = None
+    frame_ring.close()
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--timeout", type=float, default=5, help="Seconds to wait for the process after stop")
+    args = parser.parse_args()
+
+    failed = False
+    for method in ("fork", "forkserver", "spawn"):
+        elapsed = stop_capture(method, args.timeout)
+        if elapsed is None:
+            failed = True
+            print("%-10s still alive %s s after stop" % (method, args.timeout))
+        else:
+            print("%-10s stopped after %.2f s" % (method, elapsed))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,152 @@
+'''
+Open many simultaneous MJPEG streams against the camera view and report frame rate, latency
+behind the camera and server memory. Latency is measured from the X-Capture-Time header of each
+frame, so the test has to run on the same machine as the cameras or with synchronized clocks.
+Slow viewers read at a limited rate to check that they do not hold back the others.
+'''
+
+import argparse
+import asyncio
+import re
+import time
+from urllib.parse import urlsplit
+
+CAPTURE_TIME = re.compile(rb"X-Capture-Time: ([0-9.]+)\r\n")
+
+
+#-------------------------------------------------------------------------------
+def read_server_memory(pid):
+    ''' Resident memory of the server process in MB, None if the process is not on this machine '''
+
+    if pid is None:
+        return None
+    try:
+        with open("/proc/%s/status" % pid) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+#-------------------------------------------------------------------------------
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+#-------------------------------------------------------------------------------
+async def viewer(url, duration, cookie, read_rate=None):
+    ''' Open one stream and count the frames received until the duration has passed, read_rate limits bytes per second '''
+
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    request = "GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n" % (parts.path or "/", parts.netloc)
+    if cookie:
+        request += "Cookie: %s\r\n" % cookie
+    writer.write((request + "\r\n").encode("utf-8"))
+    await writer.drain()
+
+    frames = 0
+    received = 0
+    latencies = []
+    first_frame_time = None
+    tail = b""
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < duration:
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), duration - (time.monotonic() - start))
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            received += len(chunk)
+
+            # The header of a frame can be split between two reads
+            data = tail + chunk
+            end = 0
+            now = time.time()
+            for match in CAPTURE_TIME.finditer(data):
+                latencies.append(now - float(match.group(1)))
+                frames += 1
+                end = match.end()
+            if frames and first_frame_time is None:
+                first_frame_time = time.monotonic() - start
+            tail = data[max(end, len(data) - 64):]
+
+            if read_rate:
+                await asyncio.sleep(len(chunk) / read_rate)
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - start
+    return {"frames": frames, "fps": frames / elapsed, "bytes": received, "first_frame": first_frame_time,
+            "latencies": latencies, "slow": read_rate is not None}
+
+#-------------------------------------------------------------------------------
+def report(name, results):
+    ''' Print frame rate and latency for a group of viewers '''
+
+    if not results:
+        return
+    rates = sorted(r["fps"] for r in results)
+    print("%s viewers (%s):" % (name, len(results)))
+    print("  Frames per viewer:  %.2f fps mean, %.2f min, %.2f median, %.2f max" %
+          (sum(rates) / len(rates), rates[0], rates[len(rates) // 2], rates[-1]))
+    print("  Starved viewers:    %s with less than 1 fps" % len([r for r in rates if r < 1]))
+    latencies = [latency for r in results for latency in r["latencies"][1:]]
+    if latencies:
+        print("  Behind camera:      %.0f ms median, %.0f ms p95, %.0f ms max, %.1f%% of frames over 300 ms" %
+              (1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.95), 1000 * max(latencies),
+               100 * len([l for l in latencies if l > 0.3]) / len(latencies)))
+    first_frames = [r["first_frame"] for r in results if r["first_frame"] is not None]
+    if first_frames:
+        print("  First frame:        %.0f ms median, %.0f ms max" % (1000 * percentile(first_frames, 0.5), 1000 * max(first_frames)))
+    print("  Received:           %.1f MB in total" % (sum(r["bytes"] for r in results) / 1e6))
+
+#-------------------------------------------------------------------------------
+async def monitor_memory(pid, interval, samples):
+    while True:
+        memory = read_server_memory(pid)
+        if memory is not None:
+            samples.append(memory)
+        await asyncio.sleep(interval)
+
+#-------------------------------------------------------------------------------
+async def run(url, num_viewers, num_slow_viewers, slow_rate, duration, ramp_up, cookie, pid):
+    samples = []
+    memory_before = read_server_memory(pid)
+    monitor = asyncio.ensure_future(monitor_memory(pid, 0.5, samples))
+
+    # Spread the connections over the ramp up time, the first viewers are the slow ones
+    tasks = []
+    for i in range(num_viewers):
+        read_rate = slow_rate if i < num_slow_viewers else None
+        tasks.append(asyncio.ensure_future(viewer(url, duration, cookie, read_rate)))
+        await asyncio.sleep(ramp_up / num_viewers)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    monitor.cancel()
+
+    failed = [r for r in results if isinstance(r, Exception)]
+    results = [r for r in results if not isinstance(r, Exception)]
+    print("Viewers:            %s (%s failed to connect)" % (num_viewers, len(failed)))
+    report("Normal", [r for r in results if not r["slow"]])
+    report("Slow", [r for r in results if r["slow"]])
+    if samples:
+        print("Server memory:      %.1f MB before, %.1f MB peak, %.2f MB per viewer" %
+              (memory_before, max(samples), (max(samples) - memory_before) / num_viewers))
+    for e in failed[:5]:
+        print("Error: %s" % e)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("url", help="Camera stream url, e.g. http://localhost:8000/camera/1/")
+    parser.add_argument("--viewers", type=int, default=200)
+    parser.add_argument("--slow-viewers", type=int, default=0, help="Number of viewers reading at a limited rate")
+    parser.add_argument("--slow-rate", type=float, default=100000, help="Bytes per second read by slow viewers")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds each stream is kept open")
+    parser.add_argument("--ramp-up", type=float, default=5, help="Seconds over which the streams are opened")
+    parser.add_argument("--cookie", default="", help="Cookie header, e.g. sessionid=...")
+    parser.add_argument("--pid", type=int, default=None, help="Pid of the server process to measure memory")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.viewers, args.slow_viewers, args.slow_rate, args.duration, args.ramp_up, args.cookie, args.pid))
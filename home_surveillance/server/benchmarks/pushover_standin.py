@@ -0,0 +1,71 @@
+''' Run the alarm dispatcher against a local stand-in for the Pushover endpoint '''
+
+import os
+import random
+import sys
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from alarms import Alarm, AlarmDispatcher
+
+# Stand-in behaviour
+RESPONSE_DELAY = 0.5
+FAILURE_RATE = 0.3
+
+
+class PushoverHandler(BaseHTTPRequestHandler):
+    ''' Slow and unreliable stand-in for api.pushover.net '''
+
+    received = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(RESPONSE_DELAY)
+        if random.random() < FAILURE_RATE:
+            self.send_response(500)
+        else:
+            PushoverHandler.received += 1
+            self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"status":1}')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandinDispatcher(AlarmDispatcher):
+    ''' Dispatcher without database, only the notification is delivered '''
+
+    def import_user_data_from_sql(self, user_id):
+        return {"push_token": "token", "push_user": "user"}
+
+    def log_alarm_to_sql(self, alarm):
+        return 0
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PushoverHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%s/1/messages.json" % server.server_address[1]
+
+    num_alarms = 20
+    dispatcher = StandinDispatcher(1, pushover_url=url, retry_delay=0.1)
+    dispatcher.start()
+    image = np.random.randint(0, 255, (600, 920, 3), dtype=np.uint8)
+
+    # Time spent by the caller, this is what the inference loop waits for
+    start = time.perf_counter()
+    for i in range(num_alarms):
+        dispatcher.dispatch(Alarm(1, 1, "driveway", 1, "person", 0.9, image))
+    dispatch_time = time.perf_counter() - start
+
+    dispatcher.stop()
+    total_time = time.perf_counter() - start
+    server.shutdown()
+
+    print("Dispatching %s alarms took %.2f ms (%.3f ms per alarm)." % (num_alarms, dispatch_time * 1e3, dispatch_time * 1e3 / num_alarms))
+    print("Delivery took %.2f s, %s delivered, %s failed, %s dropped, %s received by stand-in." %
+          (total_time, dispatcher.alarms_delivered, dispatcher.alarms_failed, dispatcher.alarms_dropped, PushoverHandler.received))
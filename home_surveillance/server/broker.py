@@ -0,0 +1,344 @@
+import json
+import logging
+import time
+import zmq
+from mosaic import Mosaic
+from home_surveillance.server.mysql_conn import MysqlConnection
+
+# Create loggers for code
+logger = logging.getLogger("broker")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# GLOBAL VARS
+FRONTEND_PORT = 5550
+STATUS_PORT = 5551
+
+
+####################################################################################
+# Camera feed
+####################################################################################
+class CameraFeed():
+    def __init__(self, camera_id, socket):
+        ''' Latest frame of one camera together with the viewers of it '''
+
+        self.camera_id = camera_id
+        self.socket = socket
+        self.sequence = 0
+        self.header = None
+        self.frame = None
+        self.viewers = {}
+        self.waiting = []
+
+        # Time from capture of the frame in the camera process until it reached the broker
+        self.timestamp = 0
+        self.latency = 0
+        self.max_latency = 0
+        self.frames_received = 0
+        self.frames_replaced = 0
+
+    #-------------------------------------------------------------------------------
+    def add_viewer(self, viewer_id, now, timeout):
+        ''' Count the viewer for timeout seconds from now, a viewer that is counted for longer keeps that '''
+
+        self.viewers[viewer_id] = max(self.viewers.get(viewer_id, 0), now + timeout)
+
+    #-------------------------------------------------------------------------------
+    def count_viewers(self, now):
+        ''' Forget viewers whose time has passed and count the rest '''
+
+        for viewer_id in [v for v, expires in self.viewers.items() if expires < now]:
+            del self.viewers[viewer_id]
+        return len(self.viewers)
+
+    #-------------------------------------------------------------------------------
+    def update_latency(self, header):
+        ''' Smoothed and max latency from the capture time in the header of the frame '''
+
+        self.timestamp = json.loads(header.bytes)["timestamp"]
+        latency = time.time() - self.timestamp
+        self.latency = latency if self.frames_received == 0 else 0.9 * self.latency + 0.1 * latency
+        self.max_latency = max(self.max_latency, latency)
+        self.frames_received += 1
+
+
+####################################################################################
+# Frame broker
+####################################################################################
+class FrameBroker():
+    def __init__(self, frontend_port=FRONTEND_PORT, status_port=STATUS_PORT, request_timeout=2, viewer_timeout=5,
+                 mosaic_fps=2, mosaic_width=1280, mosaic_height=720, snapshot_interval=10, snapshot_timeout=1):
+        '''
+        Receives the footage of every camera once and hands the latest frame to any number of viewers.
+            frontend_port = Port where viewers ask for frames
+            status_port = Port where the number of viewers per camera is published to the workers
+            request_timeout = Max time in seconds a viewer waits for a new frame before an empty reply
+            viewer_timeout = Time in seconds after the last request before a viewer is forgotten
+            mosaic_fps = Max rate at which mosaics are composed
+            mosaic_width = Width of the mosaic images
+            mosaic_height = Height of the mosaic images
+            snapshot_interval = Max age in seconds of the frame snapshots are answered with before a new frame is asked for
+            snapshot_timeout = Time in seconds a snapshot counts as a viewer, long enough for the worker to send a frame
+        '''
+
+        self.context = zmq.Context.instance()
+        self.feeds = {}
+        self.frontend_port = frontend_port
+        self.mosaic_fps = mosaic_fps
+        self.mosaic_height = mosaic_height
+        self.mosaic_width = mosaic_width
+        self.mosaics = {}
+        self.poller = zmq.Poller()
+        self.request_timeout = request_timeout
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_timeout = snapshot_timeout
+        self.statistics_interval = 60
+        self.status_interval = 1
+        self.status_port = status_port
+        self.stopped = False
+        self.viewer_timeout = viewer_timeout
+
+    #-------------------------------------------------------------------------------
+    def add_camera(self, camera_id):
+        ''' Bind a socket for the footage of the camera, the worker of the camera connects to it '''
+
+        port = self.import_camera_port_from_sql(camera_id)
+        # Only the latest frame is of interest, so nothing is queued for the camera
+        socket = self.context.socket(zmq.SUB)
+        socket.setsockopt(zmq.RCVHWM, 1)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.bind('tcp://*:%s' % port)
+        socket.setsockopt_string(zmq.SUBSCRIBE, "")
+        self.poller.register(socket, zmq.POLLIN)
+        self.feeds[camera_id] = CameraFeed(camera_id, socket)
+        logger.info("Receiving footage for camera %s on port %s." % (camera_id, port))
+        return self.feeds[camera_id]
+
+    #-------------------------------------------------------------------------------
+    def compose_mosaics(self):
+        ''' Update the mosaics that are watched and send them to waiting viewers, forget the others '''
+
+        now = time.time()
+        for camera_ids in list(self.mosaics):
+            mosaic = self.mosaics[camera_ids]
+            if now - mosaic.last_request_time > self.viewer_timeout:
+                del self.mosaics[camera_ids]
+                logger.info("Mosaic of cameras %s is no longer watched, %s tiles drawn and %s skipped." %
+                            (", ".join(camera_ids), mosaic.tiles_drawn, mosaic.tiles_skipped))
+                continue
+            try:
+                if mosaic.update():
+                    for identity, since in mosaic.waiting:
+                        self.send_frame(identity, mosaic)
+                    mosaic.waiting = []
+            except Exception as e:
+                logger.error("Failed to compose mosaic of cameras %s: %s" % (", ".join(camera_ids), e))
+
+    #-------------------------------------------------------------------------------
+    def create_sockets(self):
+        ''' Create socket for viewer requests and socket for publishing viewer counts '''
+
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind('tcp://*:%s' % self.frontend_port)
+        self.poller.register(self.frontend, zmq.POLLIN)
+
+        self.status_socket = self.context.socket(zmq.PUB)
+        self.status_socket.bind('tcp://*:%s' % self.status_port)
+        logger.info("Broker listening for viewers on port %s, publishing viewer counts on port %s." % (self.frontend_port, self.status_port))
+
+    #-------------------------------------------------------------------------------
+    def handle_requests(self):
+        ''' Handle all waiting requests from viewers '''
+
+        while True:
+            try:
+                identity, empty, command, camera_id, viewer_id, last_sequence = self.frontend.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            except ValueError:
+                logger.error("Malformed request from viewer.")
+                continue
+
+            try:
+                if command == b"mosaic":
+                    self.handle_mosaic_request(identity, camera_id.decode("utf-8"), viewer_id, int(last_sequence))
+                else:
+                    self.handle_camera_request(identity, command, camera_id.decode("utf-8"), viewer_id, int(last_sequence))
+            except Exception as e:
+                logger.error("Failed to handle request for camera %s: %s" % (camera_id, e))
+                self.send_empty(identity, 0)
+
+    #-------------------------------------------------------------------------------
+    def handle_camera_request(self, identity, command, camera_id, viewer_id, last_sequence):
+        ''' Answer right away if the viewer has not seen the latest frame, otherwise wait for the next '''
+
+        feed = self.feeds.get(camera_id) or self.add_camera(camera_id)
+        now = time.time()
+
+        if command == b"frame":
+            feed.add_viewer(viewer_id, now, self.viewer_timeout)
+            if feed.sequence > last_sequence:
+                self.send_frame(identity, feed)
+            else:
+                feed.waiting.append((identity, now))
+            return
+
+        # Snapshots are answered with the latest frame. Only when it is old the worker is asked for a new one,
+        # for a short while, so that polled thumbnails do not keep the worker rendering.
+        if command == b"snapshot" and now - feed.timestamp > self.snapshot_interval:
+            feed.add_viewer(viewer_id, now, self.snapshot_timeout)
+        if command == b"snapshot" and feed.sequence > 0:
+            self.send_frame(identity, feed)
+        else:
+            self.send_empty(identity, feed.sequence)
+
+    #-------------------------------------------------------------------------------
+    def handle_mosaic_request(self, identity, camera_ids, viewer_id, last_sequence):
+        ''' Same as for a single camera, but with the mosaic of the comma separated cameras '''
+
+        camera_ids = tuple(camera_ids.split(","))
+        mosaic = self.mosaics.get(camera_ids)
+        if mosaic is None:
+            feeds = [self.feeds.get(camera_id) or self.add_camera(camera_id) for camera_id in camera_ids]
+            mosaic = Mosaic(feeds, self.mosaic_width, self.mosaic_height)
+            self.mosaics[camera_ids] = mosaic
+            logger.info("Composing mosaic of cameras %s." % ", ".join(camera_ids))
+
+        # The viewer of a mosaic is a viewer of every camera in it
+        now = time.time()
+        mosaic.last_request_time = now
+        for feed in mosaic.feeds:
+            feed.add_viewer(viewer_id, now, self.viewer_timeout)
+
+        if mosaic.sequence > last_sequence:
+            self.send_frame(identity, mosaic)
+        else:
+            mosaic.waiting.append((identity, now))
+
+    #-------------------------------------------------------------------------------
+    def import_camera_port_from_sql(self, camera_id):
+        ''' Import the port the worker of the camera sends footage to '''
+
+        columns = ["web_socket"]
+        table = "app_dimcameras"
+        where_statements = [("id", camera_id)]
+        return MysqlConnection().query_data(columns, table, where_statements)[0]["web_socket"]
+
+    #-------------------------------------------------------------------------------
+    def log_statistics(self):
+        ''' Log latency and viewers of every camera '''
+
+        for feed in self.feeds.values():
+            logger.info("Camera %s: %s viewers, %s frames received and %s replaced before anyone saw them. Latency from capture %.0f ms, max %.0f ms." %
+                        (feed.camera_id, len(feed.viewers), feed.frames_received, feed.frames_replaced, 1000 * feed.latency, 1000 * feed.max_latency))
+            feed.max_latency = 0
+
+    #-------------------------------------------------------------------------------
+    def publish_status(self):
+        ''' Answer viewers that waited too long and publish viewer counts to the workers '''
+
+        now = time.time()
+        for source in list(self.feeds.values()) + list(self.mosaics.values()):
+            waiting = []
+            for identity, since in source.waiting:
+                if now - since >= self.request_timeout:
+                    self.send_empty(identity, source.sequence)
+                else:
+                    waiting.append((identity, since))
+            source.waiting = waiting
+
+        for feed in self.feeds.values():
+            num_viewers = feed.count_viewers(now)
+            self.status_socket.send_multipart([("viewers-%s:" % feed.camera_id).encode("utf-8"), str(num_viewers).encode("utf-8")])
+
+    #-------------------------------------------------------------------------------
+    def receive_frames(self, feed):
+        ''' Read all frames waiting on the socket and keep only the latest '''
+
+        received = 0
+        while True:
+            try:
+                header, frame = feed.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+                received += 1
+            except zmq.Again:
+                break
+            except ValueError:
+                logger.error("Camera %s: Malformed frame received." % feed.camera_id)
+
+        if received:
+            feed.frames_replaced += received - 1
+            try:
+                feed.update_latency(header)
+            except Exception as e:
+                logger.error("Camera %s: Unable to read capture time of frame: %s" % (feed.camera_id, e))
+            feed.sequence += 1
+            feed.header = header
+            feed.frame = frame
+
+            # Viewers waiting for a new frame all get the same one
+            for identity, since in feed.waiting:
+                self.send_frame(identity, feed)
+            feed.waiting = []
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        ''' Main loop for the broker '''
+
+        self.create_sockets()
+        last_status_time = 0
+        last_mosaic_time = 0
+        last_statistics_time = time.time()
+
+        try:
+            while not self.stopped:
+                timeout = self.status_interval if not self.mosaics else min(self.status_interval, 1 / self.mosaic_fps)
+                events = dict(self.poller.poll(timeout * 1000))
+                if self.frontend in events:
+                    self.handle_requests()
+                for feed in list(self.feeds.values()):
+                    if feed.socket in events:
+                        self.receive_frames(feed)
+
+                if self.mosaics and time.time() - last_mosaic_time >= 1 / self.mosaic_fps:
+                    last_mosaic_time = time.time()
+                    self.compose_mosaics()
+
+                if time.time() - last_status_time >= self.status_interval:
+                    last_status_time = time.time()
+                    self.publish_status()
+
+                if time.time() - last_statistics_time >= self.statistics_interval:
+                    last_statistics_time = time.time()
+                    self.log_statistics()
+        except KeyboardInterrupt:
+            logger.error("Caught keyboard interrupt, exiting.")
+        finally:
+            self.context.destroy(linger=0)
+
+    #-------------------------------------------------------------------------------
+    def send_empty(self, identity, sequence):
+        ''' Tell the viewer there is no new frame '''
+
+        self.frontend.send_multipart([identity, b"", str(sequence).encode("utf-8"), b"", b""])
+
+    #-------------------------------------------------------------------------------
+    def send_frame(self, identity, source):
+        ''' Send the latest frame of a camera feed or mosaic, the same frame object is shared by all viewers '''
+
+        self.frontend.send_multipart([identity, b"", str(source.sequence).encode("utf-8"), source.header, source.frame], copy=False)
+
+
+if __name__ == '__main__':
+    broker = FrameBroker()
+    broker.run()
@@ -6,8 +6,11 @@ import socket
 import time
 import zmq
 from threading import Thread
+from config_cache import get_config_cache
+from fake_camera import FakeStream
+from frames import SharedFrameRing
+from motion import MotionDetector
 from home_surveillance.app.security import encryption
-from home_surveillance.server.mysql_conn import MysqlConnection
 
 
 # Create loggers for code
@@ -28,22 +31,31 @@ consoleHandler.setFormatter(formatter)
 
 
 class Camera(Thread):
-    def __init__(self, parent, user_id, camera_id):
+    # Max size of the images, frames are resized to fit within it
+    img_x = 920
+    img_y = 600
+
+    def __init__(self, parent, user_id, camera_id, frame_ring, fps_limit=4, source=None, camera_data=None):
         Thread.__init__(self)
         self.camera_id = camera_id
-        self.camera_data = self.import_camera_data_from_sql()
-        self.img_x = 920
-        self.img_y = 600
-        self.rtsp = self.generate_rtsp()
-        self.fps_limit = 4
-        self.latest_image = None
+        self.camera_data = camera_data
+        if self.camera_data is None and source is None:
+            self.camera_data = self.import_camera_data_from_sql()
+        self.rtsp = self.generate_rtsp() if source is None else source
+        self.fps_limit = fps_limit
+        self.frame_ring = frame_ring
+        self.motion_detector = MotionDetector()
         self.parent = parent
         self.status = 1
         self.user_id = user_id
 
+        # Frames read from the stream and frames that were actually decoded to images
+        self.frames_grabbed = 0
+        self.frames_decoded = 0
+
         # Get the first frame and get the size of it
         try:
-            self.stream = cv2.VideoCapture(self.rtsp)
+            self.stream = self.open_stream(self.rtsp)
             (self.grabbed, self.frame) = self.stream.read()
             res = self.frame.shape
             self.x_res = res[1]
@@ -78,14 +90,19 @@ class Camera(Thread):
     def import_camera_data_from_sql(self):
         # Import data
         try:
-            columns = ["rtsp_main", "domain", "port", "user_name", "password"]
-            table = "app_dimcameras"
-            where_statements = [("id", self.camera_id)]
-            return MysqlConnection().query_data(columns, table, where_statements)[0]
+            return get_config_cache().camera(self.camera_id)
         except Exception as e:
             logger.error("Failed to import camera data from sql: %s" % e)
             return None
 
+    #-------------------------------------------------------------------------------
+    def open_stream(self, url):
+        ''' Open the camera stream, fake:// urls give generated frames instead of a real camera '''
+
+        if url.startswith("fake://"):
+            return FakeStream(url)
+        return cv2.VideoCapture(url)
+
     #-------------------------------------------------------------------------------
     def resize_image(self, image, x, y):
         ''' Resizing image to fit the video boxes on the home page '''
@@ -131,20 +148,28 @@ class Camera(Thread):
         prev = 0
 
         while not self.stopped:
-            # Get new frames
-            time_elapsed = time.time() - prev
-            (grabbed, frame) = self.stream.read()
+            # Advance the stream, frames are only retrieved when they are going to be used
+            if not self.stream.grab():
+                skip_counter += 1
+                continue
+            self.frames_grabbed += 1
 
             # If time elapsed is larger than frame rate
+            time_elapsed = time.time() - prev
             if time_elapsed > (1 / self.fps_limit):
                 prev = time.time()
+                (grabbed, frame) = self.stream.retrieve()
 
                 # Check if images is OK
                 if grabbed:
+                    self.frames_decoded += 1
                     try:
-                        # Resize image
+                        # Resize image and check if the scene has changed since earlier frames
                         if self.status == 1:
-                            self.latest_image = self.resize_image(frame, self.img_x, self.img_y)
+                            image = self.resize_image(frame, self.img_x, self.img_y)
+                            motion = self.motion_detector.detect(image)
+                            self.frame_ring.put(image, motion)
+                            self.frame_ring.update_statistics(self.frames_grabbed, self.frames_decoded)
 
                     except Exception as e:
                         logger.error("Camera %s: No analyzed image was recieved under main loop: %s" % (self.camera_id, e))
@@ -158,3 +183,61 @@ class Camera(Thread):
     #---------------------------------------------------------------------------
     def stop(self):
         self.stopped = True
+
+
+class CaptureProcess(mp.Process):
+    def __init__(self, user_id, camera_id, frame_ring, fps_limit=4, source=None, camera_data=None, stop_event=None):
+        '''
+        Process reading the camera stream and writing resized frames to a shared frame ring,
+        so that decoding does not compete with the analysis in the worker for the same GIL
+            source = Url of the stream, by default the rtsp stream of the camera in the database
+            camera_data = Config already fetched by the server, imported from sql if not given
+            stop_event = Event the process stops on, shared with the process that started it
+        '''
+
+        super(CaptureProcess, self).__init__()
+        self.camera_data = camera_data
+        self.camera_id = camera_id
+        self.fps_limit = fps_limit
+        self.frame_ring = frame_ring
+        self.source = source
+        self.stop_event = stop_event if stop_event is not None else mp.Event()
+        self.user_id = user_id
+
+    #-------------------------------------------------------------------------------
+    def __reduce__(self):
+        ''' Here we return a tuple containing the class reference and initialization arguments. '''
+        # The stop event goes along, otherwise the child under spawn or forkserver waits on an event of its own
+        return (self.__class__, (self.user_id, self.camera_id, self.frame_ring, self.fps_limit, self.source,
+                                 self.camera_data, self.stop_event))
+
+    #-------------------------------------------------------------------------------
+    @staticmethod
+    def create_frame_ring(num_slots=4):
+        ''' Create a frame ring large enough for the images from Camera.resize_image '''
+
+        size = max(Camera.img_x, Camera.img_y)
+        return SharedFrameRing(size, size, num_slots)
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        ''' Run the camera until the process is told to stop '''
+
+        camera = Camera(self, self.user_id, self.camera_id, self.frame_ring, self.fps_limit, self.source,
+                        self.camera_data)
+        camera.daemon = True
+        camera.start()
+
+        # Wait for stop, or for the camera to stop by itself
+        while camera.is_alive() and not self.stop_event.wait(1):
+            pass
+
+        camera.stop()
+        camera.join()
+        logger.info("Capture process stopped for camera %s." % self.camera_id)
+
+    #---------------------------------------------------------------------------
+    def stop(self):
+        # Setting the event waits for every process sleeping on it, one that crashed while waiting never answers
+        if self.is_alive():
+            self.stop_event.set()
@@ -0,0 +1,103 @@
+# Commands sent from the web app to the server over the control connection
+VIEW_CAMERA = "view_camera"
+START_SYSTEM = "start_system"
+STOP_SYSTEM = "stop_system"
+CAMERA_STATUS = "camera_status"
+CONFIG_CHANGED = "config_changed"
+ACTIONS = (VIEW_CAMERA, START_SYSTEM, STOP_SYSTEM, CAMERA_STATUS, CONFIG_CHANGED)
+
+# Status of the command as a whole
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+
+# Status of each camera affected by a command
+CAMERA_STARTED = "started"
+CAMERA_ALREADY_RUNNING = "already_running"
+CAMERA_STOPPED = "stopped"
+CAMERA_NOT_RUNNING = "not_running"
+CAMERA_FAILED = "failed"
+CAMERA_CONFIG_RELOADED = "config_reloaded"
+
+
+class CommandError(ValueError):
+    pass
+
+
+class Command():
+    def __init__(self, action, user_id, camera_id=None):
+        '''
+        A command for the server
+            action = One of ACTIONS
+            user_id = User the command is sent for
+            camera_id = Camera to show for VIEW_CAMERA, camera whose settings changed for CONFIG_CHANGED,
+                        for CONFIG_CHANGED without camera_id the settings of the user have changed
+        '''
+
+        self.action = action
+        self.user_id = user_id
+        self.camera_id = camera_id
+
+    #-------------------------------------------------------------------------------
+    def __repr__(self):
+        return "Command(%s, user %s, camera %s)" % (self.action, self.user_id, self.camera_id)
+
+    #-------------------------------------------------------------------------------
+    @classmethod
+    def from_dict(cls, data):
+        ''' Validate and create a command from a received request, raises CommandError if invalid '''
+
+        if not isinstance(data, dict):
+            raise CommandError("Command must be an object, got %s." % type(data).__name__)
+        action = data.get("action")
+        if action not in ACTIONS:
+            raise CommandError("Unknown action %r." % action)
+        try:
+            user_id = int(data["user_id"])
+            camera_id = int(data["camera_id"]) if data.get("camera_id") is not None else None
+        except (KeyError, TypeError, ValueError) as e:
+            raise CommandError("Invalid ids in command: %s" % e)
+        if action == VIEW_CAMERA and camera_id is None:
+            raise CommandError("Action %s needs a camera_id." % action)
+        return cls(action, user_id, camera_id)
+
+    #-------------------------------------------------------------------------------
+    def to_dict(self):
+        return {"action": self.action, "user_id": self.user_id, "camera_id": self.camera_id}
+
+
+class CommandResponse():
+    def __init__(self, status, cameras=None, error=None):
+        '''
+        Acknowledgement of a command, sent when the command has been carried out
+            status = STATUS_OK, or STATUS_ERROR if the command or any camera failed
+            cameras = Dict with the status of each camera the command affected, for CAMERA_STATUS
+                      the uptime and restart counts of each camera of the user
+            error = Description of what went wrong
+        '''
+
+        self.status = status
+        self.cameras = cameras if cameras is not None else {}
+        self.error = error
+
+    #-------------------------------------------------------------------------------
+    def __repr__(self):
+        return "CommandResponse(%s, cameras %s, error %s)" % (self.status, self.cameras, self.error)
+
+    #-------------------------------------------------------------------------------
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("status", STATUS_ERROR), data.get("cameras"), data.get("error"))
+
+    #-------------------------------------------------------------------------------
+    @classmethod
+    def from_cameras(cls, cameras):
+        ''' Response for a command that was carried out for the given cameras '''
+
+        failed = [camera_id for camera_id, status in cameras.items() if status == CAMERA_FAILED]
+        if failed:
+            return cls(STATUS_ERROR, cameras, "Cameras %s failed." % ", ".join(str(c) for c in failed))
+        return cls(STATUS_OK, cameras)
+
+    #-------------------------------------------------------------------------------
+    def to_dict(self):
+        return {"status": self.status, "cameras": self.cameras, "error": self.error}
@@ -0,0 +1,121 @@
+import copy
+import os
+import threading
+import time
+from collections import Counter
+from home_surveillance.server.mysql_conn import MysqlConnection
+
+# Time in seconds config is used before it is read again, changes not announced by the server show up after it
+TTL = float(os.getenv('CONFIG_CACHE_TTL', 300))
+
+# Kinds of config
+CAMERA = "camera"
+CLASSES = "classes"
+USER = "user"
+
+# Message put on the camera queue of a worker, followed by the kind and key of the config that changed
+INVALIDATE = "invalidate"
+
+CAMERA_COLUMNS = ["camera_name", "rtsp_main", "domain", "port", "user_name", "password", "web_socket",
+                  "detection_status", "selected_status"]
+CLASS_COLUMNS = ["id", "class_label"]
+USER_COLUMNS = ["account_type", "max_cameras", "push_token", "push_user", "user_id", "system_status"]
+
+
+class ConfigCache():
+    def __init__(self, ttl=TTL):
+        '''
+        Camera, class and user settings of one process, so that they are read from SQL once and not
+        on every use. Entries are dropped after ttl seconds, or when the server announces a change.
+            ttl = Time in seconds an entry is used
+        '''
+
+        self.entries = {}
+        self.generation = 0
+        self.hits = Counter()
+        self.lock = threading.Lock()
+        self.misses = Counter()
+        self.ttl = ttl
+
+    #-------------------------------------------------------------------------------
+    def camera(self, camera_id):
+        ''' Settings of a camera from app_dimcameras '''
+
+        where_statements = [("id", camera_id)]
+        return self.get(CAMERA, str(camera_id),
+                        lambda: MysqlConnection().query_data(CAMERA_COLUMNS, "app_dimcameras", where_statements)[0])
+
+    #-------------------------------------------------------------------------------
+    def classes(self):
+        ''' Rows of app_dimclasses '''
+
+        return self.get(CLASSES, None, lambda: MysqlConnection().query_data(CLASS_COLUMNS, "app_dimclasses", []))
+
+    #-------------------------------------------------------------------------------
+    def get(self, kind, key, load):
+        '''
+        Returns a copy of the cached value, loading it if missing or expired
+            kind = One of CAMERA, CLASSES or USER
+            key = Id of the row, None if the kind has no key
+            load = Function reading the value from SQL, errors are raised to the caller
+        '''
+
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is not None and entry[1] > now:
+                self.hits[kind] += 1
+                value = entry[0]
+            else:
+                self.misses[kind] += 1
+                value = None
+            generation = self.generation
+
+        if value is None:
+            value = load()
+            with self.lock:
+                # A value read before an invalidation may already be outdated
+                if generation == self.generation:
+                    self.entries[(kind, key)] = (value, now + self.ttl)
+
+        # Callers may change what they get
+        return copy.deepcopy(value)
+
+    #-------------------------------------------------------------------------------
+    def invalidate(self, kind, key=None):
+        ''' Drop an entry, or every entry of the kind if key is None '''
+
+        with self.lock:
+            self.generation += 1
+            for entry_kind, entry_key in list(self.entries):
+                if entry_kind == kind and (key is None or entry_key == key):
+                    del self.entries[(entry_kind, entry_key)]
+
+    #-------------------------------------------------------------------------------
+    def statistics(self):
+        ''' Hits and misses of each kind '''
+
+        return {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in (CAMERA, CLASSES, USER)}
+
+    #-------------------------------------------------------------------------------
+    def user(self, user_id):
+        ''' Settings of a user from app_dimperson '''
+
+        where_statements = [("user_id", user_id)]
+        return self.get(USER, str(user_id),
+                        lambda: MysqlConnection().query_data(USER_COLUMNS, "app_dimperson", where_statements)[0])
+
+
+# One cache per process
+config_caches = {}
+config_caches_lock = threading.Lock()
+
+
+#-------------------------------------------------------------------------------
+def get_config_cache():
+    pid = os.getpid()
+    config_cache = config_caches.get(pid)
+    if config_cache is None:
+        with config_caches_lock:
+            config_cache = config_caches.setdefault(pid, ConfigCache())
+    return config_cache
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from framing import MessageDecoder, encode_message
+
+# Create loggers for code
+logger = logging.getLogger("control")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+
+class ControlConnection(asyncio.BufferedProtocol):
+    def __init__(self, handler):
+        '''
+        Persistent connection from a control client. Every request is handled in its own task,
+        so any number of them can be in flight, and every response carries the request id of
+        its request so the client can match them. Data is received straight into the buffer
+        of the decoder.
+            handler = Coroutine function called with the content of each request, returns the response
+        '''
+
+        self.handler = handler
+        self.addr = None
+        self.decoder = MessageDecoder()
+        self.tasks = set()
+        self.transport = None
+
+    #-------------------------------------------------------------------------------
+    def buffer_updated(self, nbytes):
+        ''' Start a task for every complete request '''
+
+        self.decoder.buffer_updated(nbytes)
+        try:
+            messages = self.decoder.messages()
+        except Exception as e:
+            logger.info("Connection from %s failed: %s" % (self.addr[0], e))
+            self.transport.close()
+            return
+        for header, request in messages:
+            task = asyncio.ensure_future(self.handle_request(header.get("request-id"), request))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    #-------------------------------------------------------------------------------
+    def connection_lost(self, exc):
+        # Commands already started are carried out, their responses are just not sent
+        logger.info("Connection from host %s through port %s closed." % self.addr[:2])
+
+    #-------------------------------------------------------------------------------
+    def connection_made(self, transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info("peername")
+        logger.info("Accepted connection from host %s through port %s." % self.addr[:2])
+
+    #-------------------------------------------------------------------------------
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    #-------------------------------------------------------------------------------
+    async def handle_request(self, request_id, request):
+        ''' Handle one request and send the response, unless the client has gone away '''
+
+        try:
+            response = await self.handler(request)
+        except Exception as e:
+            logger.error("Failed to handle request %s from %s: %s" % (request, self.addr, e))
+            response = {"status": "error", "error": str(e)}
+        if not self.transport.is_closing():
+            self.transport.write(encode_message(response, request_id))
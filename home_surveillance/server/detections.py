@@ -0,0 +1,71 @@
+import numpy as np
+
+# Labels of the classes and alarm statuses for frames with more than one box of a class, like verbose() gave them
+PLURAL_LABELS = {"person": "persons", "bicycle": "bicycles", "car": "cars", "motorcycle": "motorcycles",
+                 "bus": "buses", "truck": "trucks", "dog": "dogs", "horse": "horses"}
+
+
+class Detections():
+    def __init__(self, class_ids=None, scores=None, boxes=None, names=None):
+        '''
+        Compact record of everything detected in one frame
+            class_ids = Array with the YOLO class id of each box
+            scores = Array with the confidence of each box
+            boxes = Array with xyxy coordinates of each box
+            names = Dict from class id to class label
+        '''
+
+        self.class_ids = class_ids if class_ids is not None else np.empty(0, dtype=np.int64)
+        self.scores = scores if scores is not None else np.empty(0, dtype=np.float32)
+        self.boxes = boxes if boxes is not None else np.empty((0, 4), dtype=np.float32)
+        self.names = names if names is not None else {}
+
+        # Number of boxes and max score per class label, the plural label is used for more than one box
+        self.counts = {}
+        self.max_scores = {}
+        if len(self.class_ids) > 0:
+            unique_ids, inverse, counts = np.unique(self.class_ids, return_inverse=True, return_counts=True)
+            max_scores = np.zeros(len(unique_ids), dtype=np.float32)
+            np.maximum.at(max_scores, inverse, self.scores)
+            for class_id, count, score in zip(unique_ids.tolist(), counts.tolist(), max_scores.tolist()):
+                label = self.names.get(class_id, str(class_id))
+                if count > 1:
+                    label = PLURAL_LABELS.get(label, label)
+                self.counts[label] = count
+                self.max_scores[label] = score
+
+    #-------------------------------------------------------------------------------
+    @property
+    def labels(self):
+        return list(self.counts.keys())
+
+    #-------------------------------------------------------------------------------
+    @property
+    def max_score(self):
+        return float(self.scores.max()) if len(self.scores) > 0 else 0.0
+
+    #-------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.class_ids)
+
+
+#-------------------------------------------------------------------------------
+def extract_detections(results):
+    ''' Read classes, scores and boxes from the YOLOv8 results as arrays, without string formatting '''
+
+    class_ids = []
+    scores = []
+    boxes = []
+    names = {}
+    for result in results:
+        names = result.names
+        if result.boxes is None or len(result.boxes) == 0:
+            continue
+        data = result.boxes.data.cpu().numpy()
+        boxes.append(data[:, 0:4])
+        scores.append(data[:, -2])
+        class_ids.append(data[:, -1].astype(np.int64))
+
+    if len(class_ids) == 0:
+        return Detections(names=names)
+    return Detections(np.concatenate(class_ids), np.concatenate(scores), np.concatenate(boxes), names)
@@ -0,0 +1,92 @@
+import cv2
+import logging
+import numpy as np
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+# Create loggers for code
+logger = logging.getLogger("fake_camera")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+
+class FakeStream():
+    def __init__(self, url):
+        '''
+        Stand-in for cv2.VideoCapture that generates frames, for running the server without cameras.
+        Options are given as query parameters, e.g. fake://?fps=10&crash_after=100
+            width, height = Size of the frames, default 640x480
+            fps = Frame rate of the stream, default 10
+            crash_after = Kill the process after this many frames, like a crash in the decoder
+            hang_after = Stop delivering frames after this many frames, like a dropped rtsp stream
+            crash_file = Kill the process as soon as this file exists, to crash it on demand
+        '''
+
+        options = {key: values[-1] for key, values in parse_qs(urlparse(url).query).items()}
+        self.width = int(options.get("width", 640))
+        self.height = int(options.get("height", 480))
+        self.fps = float(options.get("fps", 10))
+        self.crash_after = int(options["crash_after"]) if "crash_after" in options else None
+        self.hang_after = int(options["hang_after"]) if "hang_after" in options else None
+        self.crash_file = options.get("crash_file")
+        self.frames = 0
+        self.next_frame_time = time.time()
+
+    #-------------------------------------------------------------------------------
+    def check_for_crash(self):
+        ''' Exit without any cleanup, as when the process is killed '''
+
+        if ((self.crash_after is not None and self.frames >= self.crash_after) or
+                (self.crash_file is not None and os.path.exists(self.crash_file))):
+            logger.error("Fake camera crashing process %s after %s frames." % (os.getpid(), self.frames))
+            os._exit(1)
+
+    #-------------------------------------------------------------------------------
+    def grab(self):
+        ''' Wait for the next frame, returns False when the stream has stopped delivering '''
+
+        self.check_for_crash()
+        self.next_frame_time = max(self.next_frame_time + 1 / self.fps, time.time())
+        time.sleep(max(0, self.next_frame_time - time.time()))
+        if self.hang_after is not None and self.frames >= self.hang_after:
+            return False
+        self.frames += 1
+        return True
+
+    #-------------------------------------------------------------------------------
+    def isOpened(self):
+        return True
+
+    #-------------------------------------------------------------------------------
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    #-------------------------------------------------------------------------------
+    def release(self):
+        pass
+
+    #-------------------------------------------------------------------------------
+    def retrieve(self):
+        ''' Draw a box moving across the frame, so that motion is detected '''
+
+        image = np.full((self.height, self.width, 3), 64, dtype=np.uint8)
+        size = self.height // 4
+        x = (self.frames * 8) % max(1, self.width - size)
+        cv2.rectangle(image, (x, size), (x + size, 2 * size), (255, 255, 255), -1)
+        cv2.putText(image, "fake %s" % self.frames, (10, self.height - 20), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                    (255, 255, 255), 2)
+        return True, image
@@ -0,0 +1,174 @@
+import time
+import multiprocessing as mp
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+
+# Layout of the shared frame ring, a state block followed by one header and one image per slot
+RING_STATE = np.dtype([("sequence", np.uint64), ("last_motion_sequence", np.uint64),
+                       ("frames_grabbed", np.uint64), ("frames_decoded", np.uint64)])
+SLOT_HEADER = np.dtype([("sequence", np.uint64), ("timestamp", np.float64), ("height", np.uint32),
+                        ("width", np.uint32), ("channels", np.uint32), ("motion", np.uint32)])
+
+
+class Frame():
+    def __init__(self, sequence, timestamp, image, motion):
+        ''' A frame from the camera together with its sequence number and capture time '''
+
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.image = image
+        self.motion = motion
+
+    #-------------------------------------------------------------------------------
+    def copy(self):
+        ''' Frame with an image of its own, for frames that are used for longer than the ring keeps them '''
+
+        return Frame(self.sequence, self.timestamp, self.image.copy(), self.motion)
+
+
+class SharedFrameRing():
+    def __init__(self, max_height, max_width, num_slots=4, name=None, condition=None):
+        '''
+        Ring of frames in shared memory, written by the capture process and read by the worker
+        without pickling. Frames are views into the ring, a frame that is kept for longer than
+        num_slots frames has to be copied with Frame.copy. Each slot has a header with sequence number, capture time
+        and shape of the image. A new ring is created when no name is given, otherwise the
+        existing ring with that name is attached.
+            max_height = Max height of the images in the ring
+            max_width = Max width of the images in the ring
+            num_slots = Number of frames kept, a frame is overwritten num_slots frames later
+        '''
+
+        self.max_height = max_height
+        self.max_width = max_width
+        self.num_slots = num_slots
+        self.slot_size = max_height * max_width * 3
+        header_size = RING_STATE.itemsize + num_slots * SLOT_HEADER.itemsize
+        header_size += -header_size % 64
+
+        # Create or attach the shared memory
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=header_size + num_slots * self.slot_size)
+            self.condition = mp.Condition()
+        else:
+            # Rings are only attached by child processes, which share the resource tracker of the server.
+            # Attaching registers the memory there a second time, unregistering it would drop the entry of the owner.
+            self.shm = SharedMemory(name=name)
+            self.condition = condition
+
+        # Views into the shared memory
+        self.state = np.ndarray((1,), dtype=RING_STATE, buffer=self.shm.buf)
+        self.headers = np.ndarray((num_slots,), dtype=SLOT_HEADER, buffer=self.shm.buf, offset=RING_STATE.itemsize)
+        self.data = np.ndarray((num_slots, self.slot_size), dtype=np.uint8, buffer=self.shm.buf, offset=header_size)
+
+    #-------------------------------------------------------------------------------
+    def __reduce__(self):
+        ''' Attach to the same shared memory when sent to another process '''
+        return (self.__class__, (self.max_height, self.max_width, self.num_slots, self.shm.name, self.condition))
+
+    #-------------------------------------------------------------------------------
+    @property
+    def frames_decoded(self):
+        return int(self.state["frames_decoded"][0])
+
+    #-------------------------------------------------------------------------------
+    @property
+    def frames_grabbed(self):
+        return int(self.state["frames_grabbed"][0])
+
+    #-------------------------------------------------------------------------------
+    @property
+    def last_motion_sequence(self):
+        return int(self.state["last_motion_sequence"][0])
+
+    #-------------------------------------------------------------------------------
+    @property
+    def sequence(self):
+        return int(self.state["sequence"][0])
+
+    #-------------------------------------------------------------------------------
+    @property
+    def timestamp(self):
+        ''' Time the latest frame was written, 0 if there is no frame yet '''
+
+        sequence = self.sequence
+        if sequence == 0:
+            return 0
+        return float(self.headers["timestamp"][sequence % self.num_slots])
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        ''' Release the views and close the shared memory in this process '''
+
+        self.state = None
+        self.headers = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    #-------------------------------------------------------------------------------
+    def get_frame(self, sequence):
+        ''' Get frame with the given sequence number as a view into the ring, None if overwritten '''
+
+        index = sequence % self.num_slots
+        header = self.headers[index]
+        if int(header["sequence"]) != sequence:
+            return None
+        height, width, channels = int(header["height"]), int(header["width"]), int(header["channels"])
+        image = self.data[index, :height * width * channels].reshape(height, width, channels)
+        return Frame(sequence, float(header["timestamp"]), image, bool(header["motion"]))
+
+    #-------------------------------------------------------------------------------
+    def is_valid(self, frame):
+        ''' Check that the slot of the frame has not been overwritten while the frame was used '''
+
+        return int(self.headers["sequence"][frame.sequence % self.num_slots]) == frame.sequence
+
+    #-------------------------------------------------------------------------------
+    def put(self, image, motion):
+        ''' Copy image into the next slot and wake up everyone waiting for it '''
+
+        height, width, channels = image.shape
+        if height > self.max_height or width > self.max_width or channels != 3:
+            raise ValueError("Image of shape %s does not fit in the frame ring." % (image.shape,))
+
+        # The slot is marked as invalid while it is written
+        sequence = self.sequence + 1
+        index = sequence % self.num_slots
+        self.headers["sequence"][index] = 0
+        self.data[index, :image.size].reshape(image.shape)[...] = image
+        header = self.headers[index:index + 1]
+        header["timestamp"] = time.time()
+        header["height"] = height
+        header["width"] = width
+        header["channels"] = channels
+        header["motion"] = motion
+        header["sequence"] = sequence
+
+        with self.condition:
+            self.state["sequence"][0] = sequence
+            if motion:
+                self.state["last_motion_sequence"][0] = sequence
+            self.condition.notify_all()
+
+    #-------------------------------------------------------------------------------
+    def update_statistics(self, frames_grabbed, frames_decoded):
+        self.state["frames_grabbed"][0] = frames_grabbed
+        self.state["frames_decoded"][0] = frames_decoded
+
+    #-------------------------------------------------------------------------------
+    def wait_for_frame(self, last_sequence, timeout=None):
+        ''' Block until there is a frame newer than last_sequence, returns None on timeout '''
+
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.sequence > last_sequence, remaining):
+                    return None
+            # The latest frame can be overwritten before it is read if the reader is very slow
+            frame = self.get_frame(self.sequence)
+            if frame is not None:
+                return frame
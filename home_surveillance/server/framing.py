@@ -0,0 +1,148 @@
+import functools
+import json
+import struct
+import sys
+
+# Same layout as the messages of libserver and libclient, a two byte length of the json header,
+# the json header and the content. The header may also carry a request id to match responses.
+HEADER_LENGTH = struct.Struct(">H")
+
+
+#-------------------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
+def header_prefix(content_type, content_encoding):
+    ''' The part of the json header that is the same for every message of a content type, without the closing brace '''
+
+    header = {"byteorder": sys.byteorder, "content-type": content_type, "content-encoding": content_encoding}
+    return json.dumps(header)[:-1]
+
+#-------------------------------------------------------------------------------
+def encode_message(content, request_id=None, content_type="text/json", content_encoding="utf-8"):
+    ''' Create a message, json content is encoded here while other content types must be bytes '''
+
+    if content_type == "text/json":
+        content = json.dumps(content, ensure_ascii=False).encode(content_encoding)
+    if request_id is None:
+        header = '%s, "content-length": %d}' % (header_prefix(content_type, content_encoding), len(content))
+    else:
+        header = '%s, "content-length": %d, "request-id": %s}' % (header_prefix(content_type, content_encoding),
+                                                                  len(content), json.dumps(request_id))
+    header_bytes = header.encode("utf-8")
+    return b"".join((HEADER_LENGTH.pack(len(header_bytes)), header_bytes, content))
+
+
+class MessageDecoder():
+    def __init__(self, buffer_size=65536, max_message_size=16 * 1024 * 1024):
+        '''
+        Splits a stream of bytes into messages, any number of messages may arrive in one read.
+        Data is received straight into a preallocated buffer and parsed in place, the buffer only
+        grows when a message does not fit and the header of a message is only parsed once, however
+        many reads its content is spread over.
+            buffer_size = Initial size of the receive buffer in bytes
+            max_message_size = Largest content-length accepted, larger messages raise ValueError before the buffer grows
+        '''
+
+        self.buffer_size = buffer_size
+        self.max_message_size = max_message_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+        # Header of the message whose content is being received
+        self.header = None
+
+    #-------------------------------------------------------------------------------
+    def buffer_updated(self, nbytes):
+        ''' Mark nbytes written into the buffer from get_buffer as received '''
+
+        self.end += nbytes
+
+    #-------------------------------------------------------------------------------
+    def decode_content(self, header, content):
+        ''' Copy the content out of the buffer, json content is decoded without an intermediate string '''
+
+        if header["content-type"] == "text/json":
+            if header["content-encoding"] == "utf-8":
+                return json.loads(bytes(content))
+            return json.loads(str(content, header["content-encoding"]))
+        return bytes(content)
+
+    #-------------------------------------------------------------------------------
+    def feed(self, data):
+        ''' Add received bytes and return a list with the header and content of every complete message '''
+
+        buffer = self.get_buffer(len(data))
+        buffer[:len(data)] = data
+        self.buffer_updated(len(data))
+        return self.messages()
+
+    #-------------------------------------------------------------------------------
+    def get_buffer(self, sizehint=-1):
+        ''' Return a writable view of the free part of the buffer, with room for at least sizehint bytes '''
+
+        required = max(sizehint, 4096)
+        if self.header is not None:
+            # Make room for the rest of the message so it is received in place
+            required = max(required, self.header["content-length"] - (self.end - self.start))
+
+        if len(self.buffer) - self.end < required:
+            # Move unparsed bytes to the front, grow the buffer if that is not enough
+            pending = self.end - self.start
+            if len(self.buffer) - pending < required:
+                buffer = bytearray(pending + required)
+                buffer[:pending] = self.view[self.start:self.end]
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return self.view[self.end:]
+
+    #-------------------------------------------------------------------------------
+    def messages(self):
+        ''' Parse the received bytes and return a list with the header and content of every complete message '''
+
+        messages = []
+        while True:
+            if self.header is None:
+                if self.end - self.start < HEADER_LENGTH.size:
+                    break
+                header_start = self.start + HEADER_LENGTH.size
+                header_end = header_start + HEADER_LENGTH.unpack_from(self.buffer, self.start)[0]
+                if self.end < header_end:
+                    break
+                header = json.loads(self.buffer[header_start:header_end])
+                for key in ("byteorder", "content-length", "content-type", "content-encoding"):
+                    if key not in header:
+                        raise ValueError("Missing required header %s." % key)
+                content_length = header["content-length"]
+                if not isinstance(content_length, int) or not 0 <= content_length <= self.max_message_size:
+                    raise ValueError("Invalid content-length %s, at most %s bytes are accepted."
+                                     % (content_length, self.max_message_size))
+                self.header = header
+                self.start = header_end
+
+            content_end = self.start + self.header["content-length"]
+            if self.end < content_end:
+                break
+            messages.append((self.header, self.decode_content(self.header, self.view[self.start:content_end])))
+            self.header = None
+            self.start = content_end
+
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buffer) > 4 * self.buffer_size:
+                # Give back the memory of a large message
+                self.buffer = bytearray(self.buffer_size)
+                self.view = memoryview(self.buffer)
+        return messages
+
+    #-------------------------------------------------------------------------------
+    def recv_into(self, sock):
+        ''' Receive from a socket straight into the buffer, returns the number of bytes received '''
+
+        nbytes = sock.recv_into(self.get_buffer())
+        self.buffer_updated(nbytes)
+        return nbytes
@@ -0,0 +1,189 @@
+import logging
+import os
+import queue
+import sys
+import time
+import multiprocessing as mp
+from ultralytics import YOLO
+
+# Create loggers for code
+logger = logging.getLogger("inference")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# Classes: 0: person, 1: bicycle, 2: car, 3: motorcycle, 5: bus, 7: truck, 16: dog, 17, horse
+DETECTION_CLASSES = [0, 1, 2, 3, 5, 7, 16, 17]
+DETECTION_CONF = 0.8
+
+# Weights of the YOLOv8 model
+MODEL_WEIGHTS = os.getenv('YOLO_WEIGHTS', 'yolov8m.pt')
+
+# Load the YOLOv8 model, processes forked from the process template get the model it has preloaded
+def import_model(preloaded=True):
+    template = sys.modules.get("model_template")
+    if preloaded and template is not None and template.model is not None:
+        return template.model
+    return YOLO(MODEL_WEIGHTS)
+
+
+####################################################################################
+# Inference client, used by the workers
+####################################################################################
+class InferenceClient():
+    def __init__(self, client_id, slot, request_queue, result_queue, timeout=5):
+        ''' Handle for a worker to send frames to the shared inference service '''
+
+        self.client_id = client_id
+        self.slot = slot
+        self.request_queue = request_queue
+        self.result_queue = result_queue
+        self.request_id = 0
+        self.timeout = timeout
+
+    #-------------------------------------------------------------------------------
+    def analyze(self, image):
+        ''' Send image to the inference service and wait for the results of that image '''
+
+        if image is None:
+            raise ValueError("No image to analyze.")
+
+        # The queue pickles the image later in its feeder thread, a view into the frame ring could be overwritten by then
+        if not image.flags.owndata:
+            image = image.copy()
+
+        self.request_id += 1
+        request_key = (self.client_id, self.request_id)
+        self.request_queue.put((self.slot, request_key, image))
+
+        # Results from requests that timed out earlier, or from a previous client of the slot, are thrown away
+        deadline = time.time() + self.timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError("No result from inference service within %s seconds." % self.timeout)
+            result_key, results = self.result_queue.get(timeout=remaining)
+            if result_key == request_key:
+                break
+
+        if results is None:
+            raise RuntimeError("Inference service failed to analyze the image.")
+
+        # The image is not sent back from the service, put it back for plotting
+        for result in results:
+            result.orig_img = image
+        return results
+
+
+####################################################################################
+# Inference service
+####################################################################################
+class InferenceService(mp.Process):
+    def __init__(self, max_batch_size=8, max_latency=0.05, max_clients=32):
+        '''
+        Process holding the only YOLO model, analyzing frames from all workers in batches
+            max_batch_size = Max number of frames in one forward pass
+            max_latency = Max time in seconds the first frame of a batch waits for more frames
+            max_clients = Number of workers that can be connected at the same time
+        '''
+
+        super(InferenceService, self).__init__()
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.request_queue = mp.Queue()
+        self.result_queues = [mp.Queue() for i in range(max_clients)]
+        self.free_slots = list(range(max_clients))
+        self.clients_created = 0
+        self.stopped = False
+
+    #-------------------------------------------------------------------------------
+    def analyze_batch(self, batch):
+        ''' Run one forward pass for all frames in the batch and return results to the workers '''
+
+        try:
+            images = [request[2] for request in batch]
+            results = self.model(images, classes=DETECTION_CLASSES, conf=DETECTION_CONF, verbose=False)
+        except Exception as e:
+            logger.error("Failed to analyze batch of %s images: %s" % (len(batch), e))
+            results = [None] * len(batch)
+
+        for (slot, request_key, image), result in zip(batch, results):
+            try:
+                if result is not None:
+                    # The worker already has the image, no need to send it back
+                    result = result.cpu()
+                    result.orig_img = None
+                    result = [result]
+                self.result_queues[slot].put((request_key, result))
+            except Exception as e:
+                logger.error("Failed to return result to slot %s: %s" % (slot, e))
+
+    #-------------------------------------------------------------------------------
+    def collect_batch(self):
+        ''' Wait for the first frame, then collect frames until the batch is full or the deadline is reached '''
+
+        first = self.request_queue.get()
+        if first is None:
+            self.stopped = True
+            return []
+
+        batch = [first]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                request = self.request_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.stopped = True
+                break
+            batch.append(request)
+        return batch
+
+    #-------------------------------------------------------------------------------
+    def create_client(self):
+        ''' Reserve a result slot and create a client for a new worker '''
+
+        if len(self.free_slots) == 0:
+            raise RuntimeError("No free slots left in the inference service.")
+        slot = self.free_slots.pop(0)
+        self.clients_created += 1
+        return InferenceClient(self.clients_created, slot, self.request_queue, self.result_queues[slot])
+
+    #-------------------------------------------------------------------------------
+    def release_client(self, client):
+        ''' Give back the result slot of a worker that has been stopped '''
+
+        if client.slot not in self.free_slots:
+            self.free_slots.append(client.slot)
+
+    #-------------------------------------------------------------------------------
+    def run(self):
+        ''' Main loop for the inference service '''
+
+        self.model = import_model()
+        logger.info("Inference service started with batch size %s and max latency %s s." % (self.max_batch_size, self.max_latency))
+
+        while not self.stopped:
+            batch = self.collect_batch()
+            if len(batch) > 0:
+                self.analyze_batch(batch)
+
+        logger.info("Inference service stopped.")
+
+    #-------------------------------------------------------------------------------
+    def stop(self):
+        self.request_queue.put(None)
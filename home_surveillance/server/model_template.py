@@ -0,0 +1,43 @@
+''' Imported by the forkserver process when it starts if workers run inference themselves, see
+MODEL_TEMPLATE_MODULE in server_main.
+
+The model is loaded and run once on a blank image here, which also fuses its layers, so that every
+process forked from the forkserver starts with a ready model. The pages of the weights are shared
+copy-on-write by all of them instead of being loaded by each process. The server process itself
+should not import this module.
+'''
+
+import logging
+import time
+import numpy as np
+from inference import DETECTION_CLASSES, DETECTION_CONF, import_model
+
+# Create loggers for code
+logger = logging.getLogger("model_template")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# Size of the blank image used for the warm-up inference
+WARM_UP_SHAPE = (640, 640, 3)
+
+model = None
+try:
+    start = time.time()
+    model = import_model(preloaded=False)
+    model(np.zeros(WARM_UP_SHAPE, dtype=np.uint8), classes=DETECTION_CLASSES, conf=DETECTION_CONF, verbose=False)
+    logger.info("Model preloaded in the process template in %.1f s." % (time.time() - start))
+except Exception as e:
+    # The forkserver must not die, processes load their own model instead
+    model = None
+    logger.error("Failed to preload model in the process template: %s" % e)
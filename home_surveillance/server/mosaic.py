@@ -0,0 +1,100 @@
+import cv2
+import json
+import math
+import time
+import numpy as np
+
+
+class Mosaic():
+    def __init__(self, feeds, width=1280, height=720, quality=80):
+        '''
+        Grid with the latest frames of several cameras, composed on a preallocated canvas and
+        encoded once for all viewers. Only tiles whose camera has a new frame are redrawn.
+            feeds = Camera feeds of the broker, one tile per feed
+            width = Width of the mosaic image
+            height = Height of the mosaic image
+            quality = Jpg quality of the encoded mosaic
+        '''
+
+        self.feeds = feeds
+        self.columns = math.ceil(math.sqrt(len(feeds)))
+        self.rows = math.ceil(len(feeds) / self.columns)
+        self.tile_width = width // self.columns
+        self.tile_height = height // self.rows
+        self.canvas = np.zeros((self.rows * self.tile_height, self.columns * self.tile_width, 3), dtype=np.uint8)
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        # Broker sequence and image shape of the frame currently drawn in each tile
+        self.tile_sequences = [0] * len(feeds)
+        self.tile_shapes = [None] * len(feeds)
+
+        # Latest encoded mosaic and the viewers waiting for the next one
+        self.sequence = 0
+        self.header = None
+        self.frame = None
+        self.waiting = []
+        self.last_request_time = 0
+
+        # Statistics
+        self.tiles_drawn = 0
+        self.tiles_skipped = 0
+
+    #-------------------------------------------------------------------------------
+    def decode(self, index, jpg):
+        ''' Decode the jpg of a tile, at reduced size if the frames of the camera are much larger than the tile '''
+
+        flag = cv2.IMREAD_COLOR
+        shape = self.tile_shapes[index]
+        if shape is not None:
+            for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+                if shape[0] // factor >= self.tile_height and shape[1] // factor >= self.tile_width:
+                    flag = reduced_flag
+                    break
+        image = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), flag)
+        if image is not None and flag == cv2.IMREAD_COLOR:
+            self.tile_shapes[index] = image.shape
+        return image
+
+    #-------------------------------------------------------------------------------
+    def draw_tile(self, index, image):
+        ''' Scale the image into its tile, keeping the aspect ratio '''
+
+        row, column = divmod(index, self.columns)
+        tile = self.canvas[row * self.tile_height:(row + 1) * self.tile_height,
+                           column * self.tile_width:(column + 1) * self.tile_width]
+        scale = min(self.tile_width / image.shape[1], self.tile_height / image.shape[0])
+        width, height = max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))
+        x, y = (self.tile_width - width) // 2, (self.tile_height - height) // 2
+        if width != self.tile_width or height != self.tile_height:
+            tile[...] = 0
+        tile[y:y + height, x:x + width] = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    #-------------------------------------------------------------------------------
+    def update(self):
+        ''' Redraw the tiles that have a new frame and encode the mosaic, returns True if it changed '''
+
+        changed = False
+        for index, feed in enumerate(self.feeds):
+            if feed.frame is None or feed.sequence == self.tile_sequences[index]:
+                self.tiles_skipped += 1
+                continue
+            image = self.decode(index, feed.frame.buffer)
+            if image is None:
+                continue
+            self.draw_tile(index, image)
+            self.tile_sequences[index] = feed.sequence
+            self.tiles_drawn += 1
+            changed = True
+
+        if changed:
+            is_success, buffer = cv2.imencode(".jpg", self.canvas, self.encode_params)
+            if not is_success:
+                return False
+            self.sequence += 1
+            self.frame = buffer.tobytes()
+
+            # The capture time of the mosaic is that of its oldest tile
+            self.header = json.dumps({"cameras": [feed.camera_id for feed in self.feeds],
+                                      "timestamp": min(feed.timestamp for feed in self.feeds if feed.frame is not None),
+                                      "composed": time.time()}).encode("utf-8")
+        return changed
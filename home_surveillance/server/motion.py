@@ -0,0 +1,67 @@
+import cv2
+import logging
+import numpy as np
+
+# Create loggers for code
+logger = logging.getLogger("motion")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+
+class MotionDetector():
+    def __init__(self, width=160, threshold=25, min_area=0.005, learning_rate=0.05):
+        '''
+        Cheap change detector running on downscaled grayscale frames
+            width = Width in pixels the frame is downscaled to before comparing
+            threshold = Min change in gray level for a pixel to count as changed
+            min_area = Min share of changed pixels for the frame to count as motion
+            learning_rate = How fast the background adapts to slow changes like light
+        '''
+
+        self.width = width
+        self.threshold = threshold
+        self.min_area = min_area
+        self.learning_rate = learning_rate
+        self.background = None
+        self.motion_score = 0
+
+    #-------------------------------------------------------------------------------
+    def detect(self, image):
+        ''' Compare image with the background and return True if the scene has changed '''
+
+        try:
+            # Downscale and blur to get rid of noise from the camera
+            height = max(1, int(image.shape[0] * self.width / image.shape[1]))
+            small = cv2.resize(image, (self.width, height), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+            # First frame, or the resolution of the stream changed
+            if self.background is None or self.background.shape != gray.shape:
+                self.background = gray.astype(np.float32)
+                self.motion_score = 1
+                return True
+
+            # Share of pixels that differs from the background
+            diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+            _, mask = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+            self.motion_score = cv2.countNonZero(mask) / mask.size
+
+            # Update background
+            cv2.accumulateWeighted(gray, self.background, self.learning_rate)
+
+            return self.motion_score >= self.min_area
+        except Exception as e:
+            logger.error("Motion detection failed, treating frame as changed: %s" % e)
+            return True
@@ -1,8 +1,14 @@
-import mysql.connector
 import logging
 import os
-
-# Set logger for mysql
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from home_surveillance.server import sqlite_backend
+
+# Set logger for mysql, the driver itself is only imported when a MySQL connection is opened
 logger = logging.getLogger('mysql.connector')
 logger.setLevel(logging.ERROR)
 
@@ -12,43 +18,349 @@ password = os.getenv('MYSQL_PASS')
 host = os.getenv('MYSQL_HOST')
 db = os.getenv('MYSQL_DB_HS')
 
+# Database the helpers run on, "mysql" or "sqlite" for the file SQLITE_DB, see sqlite_backend
+BACKEND = os.getenv('DB_BACKEND', 'mysql')
 
-class MysqlConnection():
-    def __init__(self):
-        pass
+# Connections kept open per process, 0 opens a new connection for every statement
+POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 5))
+# Time in seconds to wait for a free connection when all are in use
+POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', 30))
+# Idle time in seconds after which a connection is pinged before it is used again
+POOL_PING_INTERVAL = float(os.getenv('MYSQL_POOL_PING_INTERVAL', 10))
+
+# Errors of a connection the server has closed, e.g. after wait_timeout or a restart
+CONNECTION_LOST_ERRORS = (2006, 2013, 2055)
+# Run the statements of the query builder as prepared statements, and how many are kept per connection
+PREPARED = os.getenv('MYSQL_PREPARED', '1') == '1'
+PREPARED_STATEMENTS = 64
+
+# Names of tables and columns, values are always passed as parameters
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+#-------------------------------------------------------------------------------
+def connect():
+    if BACKEND == "sqlite":
+        return sqlite_backend.connect()
+    import mysql.connector
+    return mysql.connector.connect(user=user, password=password, host=host, database=db)
+
+#-------------------------------------------------------------------------------
+def is_connection_error(error):
+    ''' Errors after which a statement can succeed once the database can be reached again, others are permanent '''
+
+    if isinstance(error, PoolError) or getattr(error, "errno", None) in CONNECTION_LOST_ERRORS:
+        return True
+
+    # Errors of the driver only exist if it has been imported
+    errors = sys.modules.get("mysql.connector.errors")
+    if errors is not None and isinstance(error, (errors.InterfaceError, errors.OperationalError)):
+        return True
+    return sqlite_backend.is_connection_error(error)
+
+
+class PoolError(Exception):
+    ''' No connection of the pool became free within its timeout '''
+
+
+class ConnectionPool():
+    def __init__(self, connect, size=POOL_SIZE, timeout=POOL_TIMEOUT, ping_interval=POOL_PING_INTERVAL):
+        '''
+        Connections to the database shared by the threads of one process
+            connect = Function opening a new connection
+            size = Number of connections kept open, 0 disables pooling
+            timeout = Time in seconds to wait for a free connection
+            ping_interval = Idle time in seconds after which a connection is checked before use
+        '''
+
+        self.condition = threading.Condition()
+        self.connect = connect
+        self.connects = 0
+        self.idle = deque()
+        self.open = 0
+        self.ping_interval = ping_interval
+        self.prepared = PREPARED
+        self.prepared_cursors = {}
+        self.size = size
+        self.timeout = timeout
+
+    #---------------------------------------------------------------------------
+    def checkin(self, cnx):
+        ''' Give back a connection that is in a clean state '''
+
+        if self.size == 0:
+            self.close(cnx)
+            return
+        with self.condition:
+            self.idle.append((cnx, time.monotonic()))
+            self.condition.notify()
+
+    #---------------------------------------------------------------------------
+    def checkout(self):
+        '''
+        Returns a connection and whether it was reused without being checked. Idle connections are
+        reused, newest first, a new one is opened while the pool has room, else waits for one.
+        '''
+
+        if self.size == 0:
+            return self.create(), False
+
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            while not self.idle and self.open >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError("No free connection after %s s" % self.timeout)
+                self.condition.wait(remaining)
+            if self.idle:
+                cnx, last_used = self.idle.pop()
+            else:
+                cnx, last_used = None, None
+                self.open += 1
+
+        if cnx is None:
+            return self.create(), False
+
+        # Connections idle for a while may have been closed by the server. Any error of the ping, whatever
+        # the backend, replaces the connection, create() frees the place in the pool if that fails too.
+        if time.monotonic() - last_used < self.ping_interval:
+            return cnx, True
+        try:
+            cnx.ping(reconnect=False)
+            return cnx, False
+        except Exception:
+            self.close(cnx)
+            return self.create(), False
 
     #---------------------------------------------------------------------------
-    def create_connection(self):
-        ''' Create cursor object '''
+    def close(self, cnx):
+        self.prepared_cursors.pop(cnx, None)
+        try:
+            cnx.close()
+        except Exception:
+            pass
 
-        # Create connection object
-        cnx = mysql.connector.connect(user=user, password=password,
-                                      host=host,
-                                      database=db)
+    #---------------------------------------------------------------------------
+    def create(self):
+        ''' Open a new connection, its place in the pool has already been taken '''
+
+        try:
+            cnx = self.connect()
+        except Exception:
+            self.release()
+            raise
+        self.connects += 1
         return cnx
-    
+
     #---------------------------------------------------------------------------
-    def custom_query_data(self, query):
-        ''' Query data from database '''
-  
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
+    def discard(self, cnx):
+        ''' Close a connection that failed and free its place in the pool '''
 
-        # Execute
-        cursor.execute(query)
+        self.close(cnx)
+        self.release()
 
-        # Get results
-        results = []
-        for row in cursor:
-            results.append(row)
+    #---------------------------------------------------------------------------
+    def prepared_cursor(self, cnx, query):
+        '''
+        Returns the prepared cursor of the statement on the connection, None if the driver has none.
+        The cursor prepares the statement again unless it gets the same string object, the
+        statements of the query builder are cached and always are.
+        '''
 
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        if not self.prepared:
+            return None
+        cursors = self.prepared_cursors.setdefault(cnx, OrderedDict())
+        cursor = cursors.get(query)
+        if cursor is not None:
+            cursors.move_to_end(query)
+            return cursor
+
+        try:
+            cursor = cnx.cursor(prepared=True)
+        except TypeError:
+            self.prepared = False
+            return None
+        cursors[query] = cursor
+        if len(cursors) > PREPARED_STATEMENTS:
+            cursors.popitem(last=False)[1].close()
+        return cursor
+
+    #---------------------------------------------------------------------------
+    def release(self):
+        if self.size == 0:
+            return
+        with self.condition:
+            self.open -= 1
+            self.condition.notify()
+
+
+# One pool per process, connections must not be shared with forked processes
+pools = {}
+pools_lock = threading.Lock()
+
+
+#-------------------------------------------------------------------------------
+def get_pool():
+    pid = os.getpid()
+    pool = pools.get(pid)
+    if pool is None:
+        with pools_lock:
+            pool = pools.setdefault(pid, ConnectionPool(connect))
+    return pool
+
+
+#-------------------------------------------------------------------------------
+def reset_after_fork():
+    ''' The lock may have been held by another thread of the parent when it forked '''
+
+    global pools_lock
+    pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
+#-------------------------------------------------------------------------------
+def check_identifiers(*names):
+    for name in names:
+        if not IDENTIFIER.fullmatch(name):
+            raise ValueError("Invalid table or column name %r" % name)
+
+#-------------------------------------------------------------------------------
+def in_list_size(count):
+    ''' Number of placeholders of an IN list, rounded up to a power of two so that few statements are built '''
+
+    size = 1
+    while size < count:
+        size *= 2
+    return size
+
+#-------------------------------------------------------------------------------
+def where_parameters(where_statements):
+    '''
+    Shape and values of where statements, returns None as values if an IN list is empty
+        where_statements = List of tuples with column name and value, or a list of values for IN
+    '''
+
+    shape = []
+    values = []
+    for column, value in where_statements:
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = list(value)
+            if not value:
+                return tuple(shape), None
+            size = in_list_size(len(value))
+            shape.append((column, size))
+
+            # Repeating a value does not change the result of IN
+            values.extend(value + [value[-1]] * (size - len(value)))
+        else:
+            shape.append((column, None))
+            values.append(value)
+    return tuple(shape), values
+
+#-------------------------------------------------------------------------------
+def where_clause(where_shape):
+    ''' WHERE with a placeholder for each value, where_shape is a tuple of column and IN list size, None for = '''
+
+    conditions = []
+    for column, size in where_shape:
+        check_identifiers(column)
+        if size is None:
+            conditions.append("%s = %%s" % column)
+        else:
+            conditions.append("%s IN (%s)" % (column, ", ".join(["%s"] * size)))
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def count_statement(table, id_column, group_column):
+    check_identifiers(table, id_column, group_column)
+    return "SELECT COUNT(%s) FROM %s WHERE %s = %%s GROUP BY %s" % (group_column, table, id_column, id_column)
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def delete_statement(table, where_shape):
+    check_identifiers(table)
+    return "DELETE FROM %s%s" % (table, where_clause(where_shape))
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def insert_statement(table, columns, rows=1):
+    check_identifiers(table, *columns)
+    row_string = "(%s)" % ", ".join(["%s"] * len(columns))
+    return "INSERT INTO %s (%s) VALUES %s" % (table, ", ".join(columns), ", ".join([row_string] * rows))
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def select_statement(table, columns, where_shape):
+    check_identifiers(table, *[column for column in columns if column != "*"])
+    return "SELECT %s FROM %s%s" % (", ".join(columns), table, where_clause(where_shape))
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def update_statement(table, columns, where_shape):
+    check_identifiers(table, *columns)
+    return "UPDATE %s SET %s%s" % (table, ", ".join("%s = %%s" % column for column in columns), where_clause(where_shape))
 
-        return results
+
+class MysqlConnection():
+    def __init__(self, pool=None):
+        '''
+        Helpers running statements on the connection pool of the process
+            pool = ConnectionPool to use instead of the one of the process
+        '''
+
+        self.pool = pool if pool is not None else get_pool()
+
+    #---------------------------------------------------------------------------
+    def execute(self, query, data=None, fetch=False, prepared=False):
+        '''
+        Run one statement on a pooled connection, returns the rows if fetch is set, else the id of
+        the last inserted row. A reused connection the server has closed meanwhile is replaced and
+        the statement run again, nothing has been committed on it.
+            query = String with the statement
+            data = List with the values of the placeholders in query
+            fetch = True to return the rows of the result
+            prepared = True to run the statement as a prepared statement, if the driver supports it
+        '''
+
+        while True:
+            cnx, reused = self.pool.checkout()
+            try:
+                cursor = self.pool.prepared_cursor(cnx, query) if prepared else None
+                if cursor is not None:
+                    cursor.execute(query, data)
+                    result = cursor.fetchall() if fetch else cursor.lastrowid
+                else:
+                    cursor = cnx.cursor()
+                    try:
+                        cursor.execute(query, data)
+                        result = cursor.fetchall() if fetch else cursor.lastrowid
+                    finally:
+                        cursor.close()
+
+                # Commit also after reads, it ends the transaction so the next read sees new rows
+                cnx.commit()
+            except Exception as e:
+                self.pool.discard(cnx)
+                if reused and getattr(e, "errno", None) in CONNECTION_LOST_ERRORS:
+                    continue
+                raise
+
+            self.pool.checkin(cnx)
+            return result
+    
+    #---------------------------------------------------------------------------
+    def custom_query_data(self, query, data=None):
+        '''
+        Query data from database
+            query = String with the statement, with %s placeholders for values
+            data = List with the values of the placeholders
+        '''
+
+        # Execute and get results
+        return self.execute(query, data, fetch=True)
 
     #---------------------------------------------------------------------------
     def example_strings(self):
@@ -65,58 +377,22 @@ class MysqlConnection():
         Query data from database
             columns = List with column names as strings
             table = String with table name
-            where_statements = List of tuples with column name and values
+            where_statements = List of tuples with column name and values, a list of values is matched with IN
         '''
 
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
-
-        # Create start string
-        query = "SELECT "
-
-        # Add columns to export
-        if columns[0] != "*":
-            for c in range(0, len(columns)):
-                if c < (len(columns) - 1):
-                    query += columns[c] + ", "
-                else:
-                    query += columns[c] + " FROM "
-        else:
-            query += "* FROM "
-
-        # Adding where statements
-        if len(where_statements) != 0:
-            first = False
-            for w in where_statements:
-                if first != True:
-                    query += ("%s WHERE %s = %s" % (table, w[0], w[1]))
-                    first = True
-                else:
-                    query += (" AND %s = %s" % (w[0], w[1]))
-        else:
-            query += "%s" % table
-
-        # Add final
-        query += ";"
+        # Statements of the same shape are built once
+        where_shape, data_tuple = where_parameters(where_statements)
+        if data_tuple is None:
+            return []
+        query = select_statement(table, tuple(columns), where_shape)
 
         # Execute
-        cursor.execute(query)
+        rows = self.execute(query, data_tuple, fetch=True, prepared=True)
 
         # Get results
         results = []
-        for row in cursor:
-            temp_row = {}
-            counter = 0
-            for c in columns:
-                temp_row[c] = row[counter]
-                counter += 1
-            results.append(temp_row)
-
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        for row in rows:
+            results.append(dict(zip(columns, row)))
 
         return results
 
@@ -128,54 +404,28 @@ class MysqlConnection():
             data = List with tuples with column name and values
         '''
 
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
-
-        # Create start string
-        query = "INSERT INTO %s (" % table
-
-        # Add columns
-        data_tuple = []
-        first = False
-        for d in data:
-            if first != True:
-                query += ("%s" % d[0])
-                data_tuple.append(d[1])
-                first = True
-            else:
-                query += (", %s" % d[0])
-                data_tuple.append(d[1])
-
-        # Add values
-        query += ") VALUES ("
-        first = False
-        for d in data:
-            if first != True:
-                query += "%s"
-                first = True
-            else:
-                query += ", %s"
+        query = insert_statement(table, tuple(d[0] for d in data))
+        data_tuple = [d[1] for d in data]
 
-        # Final string
-        query += ")"
+        # Execute and get the last inserted row id
+        return self.execute(query, data_tuple, prepared=True)
 
-        # Execute
-        cursor.execute(query, data_tuple)
-
-        # Getting last inserted row id
-        query = "SELECT LAST_INSERT_ID();"
-        cursor.execute(query)
-        row_id = None
-        for row in cursor:
-            row_id = row[0]
+    #---------------------------------------------------------------------------
+    def insert_many(self, table, columns, rows):
+        '''
+        Insert rows to database in one statement. The ids of the rows are not returned, they are
+        only consecutive with innodb_autoinc_lock_mode below 2 and an auto_increment_increment of 1.
+            table = String with table name
+            columns = List with column names
+            rows = List with a list of values for each row, in the order of columns
+        '''
 
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        # One multi-row INSERT, as executemany would send it
+        query = insert_statement(table, tuple(columns), len(rows))
+        data_tuple = [value for row in rows for value in row]
 
-        return row_id
+        # Execute
+        self.execute(query, data_tuple, prepared=True)
 
     #---------------------------------------------------------------------------
     def update_data(self, table, data, where_statements):
@@ -183,86 +433,33 @@ class MysqlConnection():
         Update data in database
             table = String with table name
             data = List with tuples with column name and values
-            where_statements = List of tuples with column name and values
+            where_statements = List of tuples with column name and values, a list of values is matched with IN
         '''
 
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
-
-        # Create update string
-        query = "UPDATE %s SET" % table
-
-        # Ad data to update
-        data_tuple = []
-        first = False
-        for d in data:
-            if first != True:
-                query += (" %s" % d[0]) + "=%s"
-                data_tuple.append(d[1])
-                first = True
-            else:
-                query += (", %s" % d[0]) + "=%s"
-                data_tuple.append(d[1])
-
-        # Ad where statements
-        if len(where_statements) != 0:
-            first = False
-            for w in where_statements:
-                if first != True:
-                    query += " WHERE %s" % w[0] + "=%s"
-                    data_tuple.append(w[1])
-                    first = True
-                else:
-                    query += " AND %s" % w[0] + "=%s"
-                    data_tuple.append(w[1])
-
-        # Add final
-        query += ";"
+        where_shape, where_values = where_parameters(where_statements)
+        if where_values is None:
+            return
+        query = update_statement(table, tuple(d[0] for d in data), where_shape)
+        data_tuple = [d[1] for d in data] + where_values
 
         # Execute
-        cursor.execute(query, data_tuple)
-
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        self.execute(query, data_tuple, prepared=True)
 
     #---------------------------------------------------------------------------
     def delete_data(self, table, where_statements):
         '''
-        Insert data to database
+        Delete data from database
             table = String with table name
-            data = List with tuples with column name and values
+            where_statements = List of tuples with column name and values, a list of values is matched with IN
         '''
 
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
-
-        # Create start string
-        query = "DELETE FROM %s" % table
-
-        # Ad where statements
-        data_tuple = []
-        if len(where_statements) != 0:
-            first = False
-            for w in where_statements:
-                if first != True:
-                    query += " WHERE %s" % w[0] + "=%s"
-                    data_tuple.append(w[1])
-                    first = True
-                else:
-                    query += " AND %s" % w[0] + "=%s"
-                    data_tuple.append(w[1])
+        where_shape, data_tuple = where_parameters(where_statements)
+        if data_tuple is None:
+            return
+        query = delete_statement(table, where_shape)
 
         # Execute
-        cursor.execute(query, data_tuple)
-
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
+        self.execute(query, data_tuple, prepared=True)
 
     #---------------------------------------------------------------------------
     def count_data(self, table, id_column, group_column, id_value):
@@ -270,24 +467,14 @@ class MysqlConnection():
         Group by column
         '''
 
-        # Create cursor object
-        cnx = self.create_connection()
-        cursor = cnx.cursor()
-
-        # Create start string
-        query = "SELECT COUNT(%s) FROM %s WHERE %s=%s GROUP BY %s" % (group_column, table, id_column, id_value, id_column)
+        query = count_statement(table, id_column, group_column)
 
         # Execute
-        cursor.execute(query)
+        rows = self.execute(query, [id_value], fetch=True, prepared=True)
 
         # Get results
         results = 0
-        for row in cursor:
+        for row in rows:
             results = row[0]
 
-        # Close connection
-        cnx.commit()
-        cursor.close()
-        cnx.close()
-
-        return results
+        return results
\ No newline at end of file
@@ -1,10 +1,21 @@
-import libserver
+import asyncio
 import logging
-import selectors
-import socket
+import os
 import sys
 import time
 import multiprocessing as mp
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from camera import CaptureProcess
+from commands import (Command, CommandError, CommandResponse, STATUS_ERROR, STATUS_OK, VIEW_CAMERA, START_SYSTEM,
+                      STOP_SYSTEM, CAMERA_STATUS, CAMERA_STARTED, CAMERA_ALREADY_RUNNING, CAMERA_STOPPED,
+                      CAMERA_NOT_RUNNING, CAMERA_FAILED, CAMERA_CONFIG_RELOADED, CONFIG_CHANGED)
+from config_cache import CAMERA, CLASSES, INVALIDATE, USER, get_config_cache
+from control import ControlConnection
+from supervisor import Supervisor
+from timeline import StartupTimeline, CONFIG, SPAWN
+from inference import InferenceService
 from worker import Worker
 from home_surveillance.server.mysql_conn import MysqlConnection
 
@@ -25,48 +36,102 @@ formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s
 consoleHandler.setFormatter(formatter)
 
 
+# Modules imported by the process template that workers, capture processes and the inference service are forked from
+PROCESS_TEMPLATE_MODULES = ["worker", "camera"]
+# Module loading the model in the process template, only used when workers run inference themselves
+MODEL_TEMPLATE_MODULE = "model_template"
+
+
 ####################################################################################
 # Server class
 ####################################################################################
 class Server():
     def __init__(self):
         self.active_camera_id = None
+        self.camera_captures = {}
+        self.camera_heartbeats = {}
+        self.camera_rings = {}
         self.camera_workers = {}
         self.camera_queues = {}
-        self.host = "192.168.0.135"
-        self.port = 8080
+        self.host = os.getenv('SERVER_HOST', "192.168.0.135")
+        self.port = int(os.getenv('SERVER_PORT', 8080))
         self.stopped = False
 
-    #-------------------------------------------------------------------------------
-    def accept_wrapper(self, sel, sock):
-        ''' Verify the connection and accept it '''
-
-        try:
-            conn, addr = sock.accept()  # Should be ready to read
-            conn.setblocking(False)
-            message = libserver.Message(sel, conn, addr)
-            sel.register(conn, selectors.EVENT_READ, data=message)
-            logger.info("Accepted connection from host %s through port %s." % addr)
-        except Exception as e:
-            logger.error("The accept wrapper failed due to: %s" % e)
+        # Blocking work like SQL queries and starting processes is done in these threads, so that
+        # the event loop keeps answering commands. Commands for the same camera are serialized.
+        self.executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="server")
+        self.camera_locks = defaultdict(asyncio.Lock)
+
+        # Frame rate captured per camera, cameras not in camera_fps_limits use fps_limit
+        self.fps_limit = 4
+        self.camera_fps_limits = {}
+
+        # Stream urls of cameras that should not use the rtsp stream in the database, e.g. fake:// for testing.
+        # CAMERA_SOURCE is used for all cameras not in camera_sources.
+        self.camera_sources = {}
+        self.camera_source = os.getenv('CAMERA_SOURCE')
+
+        # Restarts cameras whose processes die or hang
+        self.supervisor = Supervisor(self)
+
+        # Time of each stage of the startup of every camera, from config load to first analyzed image
+        self.startup_timeline = StartupTimeline()
+        self.report_tasks = set()
+
+        # Shared inference service, set use_inference_service to False to let each worker load its own model
+        self.use_inference_service = True
+        self.inference_batch_size = 8
+        self.inference_max_latency = 0.05
+        # Number of workers that can use the inference service at the same time, one per camera
+        self.inference_max_clients = 32
+        self.inference_clients = {}
+        self.inference_lock = Lock()
+        self.inference_service = None
 
     #-------------------------------------------------------------------------------
-    def add_new_stream(self, user_id, camera_id):
-        ''' Start a new camera and store it in active camera dictionary '''
+    def add_new_stream(self, user_id, camera_id, camera_data=None, class_data=None):
+        '''
+        Start a new camera and store it in active camera dictionary, returns the status of the camera
+            camera_data, class_data = Config from import_camera_config, the processes import it themselves if not given
+        '''
 
         status = self.check_if_camera_exists(camera_id)
         if status == False:
+            if camera_data is None:
+                self.startup_timeline.begin([camera_id])
             try:
                 self.active_camera_id = camera_id
                 self.camera_queues[camera_id] = mp.Queue()
-                self.camera_workers[camera_id] = Worker(user_id, camera_id, self.camera_queues[camera_id])
+
+                # Capture runs in its own process and hands frames to the worker through shared memory
+                self.camera_rings[camera_id] = CaptureProcess.create_frame_ring()
+                self.camera_captures[camera_id] = CaptureProcess(user_id, camera_id, self.camera_rings[camera_id],
+                                                                 self.camera_fps_limits.get(camera_id, self.fps_limit),
+                                                                 self.camera_sources.get(camera_id, self.camera_source),
+                                                                 camera_data)
+                self.camera_captures[camera_id].daemon = True
+                self.camera_captures[camera_id].start()
+
+                if self.inference_service is not None:
+                    # Cameras are started from several threads at once
+                    with self.inference_lock:
+                        self.inference_clients[camera_id] = self.inference_service.create_client()
+                self.camera_heartbeats[camera_id] = mp.Value("d", time.time(), lock=False)
+                self.camera_workers[camera_id] = Worker(user_id, camera_id, self.camera_queues[camera_id],
+                                                        self.camera_rings[camera_id], self.inference_clients.get(camera_id),
+                                                        self.camera_heartbeats[camera_id], camera_data, class_data,
+                                                        self.startup_timeline.events)
                 self.camera_workers[camera_id].daemon = True
                 self.camera_workers[camera_id].start()
+                self.startup_timeline.record(camera_id, SPAWN)
+                return CAMERA_STARTED
             except Exception as e:
                 logger.error("Camera %s failed to start for user %s due to: %s" % (camera_id, user_id, e))
+                self.close_old_stream(camera_id)
+                return CAMERA_FAILED
         else:
             logger.info("Camera %s is already active." % camera_id)
-
+            return CAMERA_ALREADY_RUNNING
 
     #-------------------------------------------------------------------------------
     def check_if_camera_exists(self, camera_id):
@@ -81,36 +146,30 @@ class Server():
             logger.error("Check if camera is active failed: %s" % e)
             return False
 
-    #-------------------------------------------------------------------------------
-    def convert_tuple_to_string(self, tuple):
-        return "(" + ",".join(tuple) + ")"
-
     #-------------------------------------------------------------------------------
     def close_old_stream(self, camera_id):
-        ''' Close active camera '''
+        ''' Close active camera, returns the status of the camera '''
 
+        if camera_id not in self.camera_workers and camera_id not in self.camera_captures:
+            return CAMERA_NOT_RUNNING
         try:
-            self.camera_queues[camera_id].put("stop")
+            self.camera_workers.pop(camera_id, None)
+            self.camera_heartbeats.pop(camera_id, None)
+            if camera_id in self.camera_queues:
+                self.camera_queues.pop(camera_id).put("stop")
+            if camera_id in self.camera_captures:
+                self.camera_captures.pop(camera_id).stop()
+            if camera_id in self.camera_rings:
+                # Processes that still use the ring keep their mapping until they exit
+                self.camera_rings.pop(camera_id).close()
+            if camera_id in self.inference_clients:
+                with self.inference_lock:
+                    self.inference_service.release_client(self.inference_clients.pop(camera_id))
             logger.info("Camera %s closed successfully." % camera_id)
+            return CAMERA_STOPPED
         except Exception as e:
             logger.error("Camera %s failed to stop due to: %s" % (camera_id, e))
-
-    #-------------------------------------------------------------------------------
-    def create_socket(self):
-        ''' Create a socket '''
-
-        try:
-            sel = selectors.DefaultSelector()
-            lsock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            lsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            lsock.bind((self.host, self.port))
-            lsock.listen()
-            lsock.setblocking(False)
-            sel.register(lsock, selectors.EVENT_READ, data=None)
-            logger.info("Listening on %s at port %s." % (self.host, self.port))
-            return sel
-        except Exception as e:
-            logger.error("Failed to create socket due to: %s" % e)
+            return CAMERA_FAILED
 
     #--------------------------------------------------------------------------------
     def create_user_camera_dict(self, user_list):
@@ -120,21 +179,19 @@ class Server():
         return user_dict
 
     #-------------------------------------------------------------------------------
-    def first_startup_check(self):
+    async def first_startup_check(self):
         ''' Check if system is set to active '''
 
         # Import user data
-        user_list = self.get_users_with_system_active()
+        user_list = await self.run_in_executor(self.get_users_with_system_active)
 
         # Import camera data
-        if len(user_list) > 0:
-            user_camera_dict = self.import_user_camera_data(user_list)
+        if user_list:
+            user_camera_dict = await self.run_in_executor(self.import_user_camera_data, user_list)
 
             # Start cameras
-            for user_id in user_camera_dict:
-                for camera_id in user_camera_dict[user_id]:
-                    logger.info("At startup: Starting camera %s for user %s." % (camera_id, user_id))
-                    self.add_new_stream(user_id, camera_id)
+            logger.info("At startup: Starting cameras %s." % user_camera_dict)
+            await self.start_cameras(user_camera_dict, "Startup")
 
     #-------------------------------------------------------------------------------
     def get_camera_selection_status(self, camera_id):
@@ -142,44 +199,110 @@ class Server():
 
         query = """ SELECT system_status FROM app_dimcameras
                     WHERE camera_id = %s;
-                """ % camera_id
+                """
         try:
-            return MysqlConnection().custom_query_data(query)[0]
+            return MysqlConnection().custom_query_data(query, [camera_id])[0]
         except Exception as e:
             logger.error("Unable to import active user list from MySQL: %s" % e)
 
+    #-------------------------------------------------------------------------------
+    async def handle_command(self, request):
+        ''' Carry out a command from the control connection and return the acknowledgement '''
+
+        try:
+            command = Command.from_dict(request)
+        except CommandError as e:
+            logger.error("Invalid command recieved from client: %s" % e)
+            return CommandResponse(STATUS_ERROR, error=str(e)).to_dict()
+
+        logger.info("Command recieved from client: %s" % command)
+        user_id = str(command.user_id)
+        if command.action == VIEW_CAMERA:
+            cameras = await self.view_camera(user_id, str(command.camera_id))
+        elif command.action == START_SYSTEM:
+            cameras = await self.start_system(user_id)
+        elif command.action == STOP_SYSTEM:
+            cameras = await self.stop_system(user_id)
+            await self.run_in_executor(self.update_system_status, 0, user_id)
+        elif command.action == CONFIG_CHANGED:
+            cameras = self.invalidate_config(user_id, None if command.camera_id is None else str(command.camera_id))
+        elif command.action == CAMERA_STATUS:
+            cameras = self.supervisor.status(user_id)
+            for camera_id in cameras:
+                cameras[camera_id]["startup"] = self.startup_timeline.to_dict(camera_id)
+            return CommandResponse(STATUS_OK, cameras).to_dict()
+        return CommandResponse.from_cameras(cameras).to_dict()
+
+    #-------------------------------------------------------------------------------
+    def import_camera_config(self, camera_ids):
+        ''' Import the config of all cameras in one query, returns a dict with the data of each camera and the class data '''
+
+        columns = ["id", "camera_name", "rtsp_main", "domain", "port", "user_name", "password", "web_socket",
+                   "detection_status", "selected_status"]
+        where_statements = [("id", camera_ids)]
+
+        camera_dict = {}
+        class_data = None
+        try:
+            for r in MysqlConnection().query_data(columns, "app_dimcameras", where_statements):
+                camera_dict[str(r["id"])] = r
+            class_data = MysqlConnection().query_data(["id", "class_label"], "app_dimclasses", [])
+        except Exception as e:
+            logger.error("Unable to import camera config from MySQL, cameras will import their own: %s" % e)
+        return camera_dict, class_data
+
     #-------------------------------------------------------------------------------
     def import_user_camera_data(self, user_list):
         ''' Get a list of all cameras with active status for all users with active system '''
 
-        str_tuple = self.convert_tuple_to_string(user_list)
-        query = """ SELECT id, user_id FROM app_dimcameras
-                    WHERE user_id IN %s
-                    AND detection_status = 1;
-                """ % str_tuple
+        columns = ["id", "user_id"]
+        where_statements = [("user_id", user_list), ("detection_status", 1)]
 
         user_dict = self.create_user_camera_dict(user_list)
         try:
-            results = MysqlConnection().custom_query_data(query)
+            results = MysqlConnection().query_data(columns, "app_dimcameras", where_statements)
             for r in results:
-                user_dict[str(r[1])].append(str(r[0]))
+                user_dict[str(r["user_id"])].append(str(r["id"]))
             return user_dict
         except Exception as e:
             logger.error("Unable to import active camera list from MySQL: %s" % e)
             return user_dict
 
+    #-------------------------------------------------------------------------------
+    def invalidate_config(self, user_id, camera_id=None):
+        '''
+        Drop config changed in the web app from the caches of the server and the workers. Returns
+        the workers that have been told.
+            camera_id = Camera whose row changed, the user and class rows changed if None
+        The web app announces camera rows and the row of the user. Classes are not edited there,
+        so they are dropped together with the user and otherwise expire after the TTL of the cache.
+        '''
+
+        if camera_id is not None:
+            changes = [(CAMERA, camera_id)]
+            camera_ids = [camera_id] if camera_id in self.camera_workers else []
+        else:
+            changes = [(USER, user_id), (CLASSES, None)]
+            camera_ids = [camera_id for camera_id, worker in self.camera_workers.items() if str(worker.user_id) == user_id]
+
+        for kind, key in changes:
+            get_config_cache().invalidate(kind, key)
+        cameras = {}
+        for camera_id in camera_ids:
+            for kind, key in changes:
+                self.camera_queues[camera_id].put((INVALIDATE, kind, key))
+            cameras[camera_id] = CAMERA_CONFIG_RELOADED
+        return cameras
+
     #-------------------------------------------------------------------------------
     def get_users_with_system_active(self):
         ''' Import complete list of users that has system_status set to 1 '''
 
-        query = """ SELECT user_id FROM app_dimperson
-                    WHERE system_status = 1;
-                """
         try:
-            results = MysqlConnection().custom_query_data(query)
+            results = MysqlConnection().query_data(["user_id"], "app_dimperson", [("system_status", 1)])
             list_of_users = []
             for r in results:
-                list_of_users.append(str(r[0]))
+                list_of_users.append(str(r["user_id"]))
             return tuple(list_of_users)
         except Exception as e:
             logger.error("Unable to import active user list from MySQL: %s" % e)
@@ -214,71 +337,142 @@ class Server():
     def run(self):
         ''' Main server script '''
 
-        # Check if system is set to active
-        self.first_startup_check()
-
-        # Create a socket
-        sel = self.create_socket()
-
         try:
-            while not self.stopped:
-                events = sel.select(timeout=None)
-                for key, mask in events:
-                    if key.data is None:
-                        self.accept_wrapper(sel, key.fileobj)
-                    else:
-                        message = key.data
-                        try:
-                            message.process_events(mask)
-                            msg = message.request.decode('utf-8')
-                            logger.info("Messsage recieved from client: %s" % msg)
-                            # View function, action/camera_id, user_id
-                            category, selection, current_user = msg.split('-')
-                            if category == "view":
-                                camera_status = self.check_if_camera_exists(selection)
-                                if camera_status == False:
-                                    self.add_new_stream(current_user, selection)
-                                self.reset_active_camera_settings()
-                                self.camera_queues[selection].put("activate")
-                                message.close()
-                            elif category == "manage":
-                                if selection == "start":
-                                    self.start_system(current_user)
-                                    message.close()
-                                elif selection == "stop":
-                                    self.stop_system(current_user)
-                                    self.update_system_status(0, current_user)
-                                    message.close()
-                        except Exception as e:
-                            logger.error("Error in retrieving message for starting cameras due to: %s" % e)
-                            message.close()
+            asyncio.run(self.serve())
         except Exception as e:
             logger.error("Server main script failed due to: %s" % e)
         except KeyboardInterrupt:
             logger.error("Caught keyboard interrupt, exiting.")
         finally:
-            sel.close()
+            self.executor.shutdown(wait=False)
+            if self.inference_service is not None:
+                self.inference_service.stop()
 
     #-------------------------------------------------------------------------------
-    def start_system(self, user_id):
+    async def run_in_executor(self, function, *args):
+        ''' Run blocking function in the executor threads without blocking the event loop '''
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    #-------------------------------------------------------------------------------
+    async def serve(self):
+        ''' Accept control connections, cameras that should be active are started at the same time '''
+
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: ControlConnection(self.handle_command), self.host, self.port)
+        logger.info("Listening on %s at port %s." % (self.host, self.port))
+
+        # Every process is forked from the process template, the inference service included
+        await self.run_in_executor(self.start_process_template)
+
+        # Start the shared inference service before any worker is started
+        if self.use_inference_service:
+            self.start_inference_service()
+
+        # The tasks are kept referenced here for as long as the server runs
+        supervisor_task = asyncio.ensure_future(self.supervisor.run())
+        timeline_task = asyncio.ensure_future(self.startup_timeline.run())
+
+        # Check if system is set to active
+        await self.first_startup_check()
+
+        async with server:
+            await server.serve_forever()
+
+    #-------------------------------------------------------------------------------
+    async def start_camera(self, user_id, camera_id, camera_data=None, class_data=None):
+        ''' Start camera unless it is already running, returns the status of the camera '''
+
+        async with self.camera_locks[camera_id]:
+            if self.check_if_camera_exists(camera_id):
+                return CAMERA_ALREADY_RUNNING
+            status = await self.run_in_executor(self.add_new_stream, user_id, camera_id, camera_data, class_data)
+            if status == CAMERA_STARTED:
+                self.supervisor.add(user_id, camera_id)
+            return status
+
+    #-------------------------------------------------------------------------------
+    async def start_cameras(self, user_camera_dict, title):
+        ''' Start the cameras of all users at the same time, returns the status of each camera '''
+
+        results = {camera_id: CAMERA_ALREADY_RUNNING for user_id in user_camera_dict for camera_id in user_camera_dict[user_id]}
+        cameras = [(user_id, camera_id) for user_id in user_camera_dict for camera_id in user_camera_dict[user_id]
+                   if not self.check_if_camera_exists(camera_id)]
+        if not cameras:
+            return results
+
+        # Config of all cameras is imported at once instead of by every process
+        camera_ids = [camera_id for user_id, camera_id in cameras]
+        self.startup_timeline.begin(camera_ids)
+        camera_dict, class_data = await self.run_in_executor(self.import_camera_config, camera_ids)
+        for camera_id in camera_ids:
+            self.startup_timeline.record(camera_id, CONFIG)
+
+        # Processes are spawned from the executor threads at the same time
+        statuses = await asyncio.gather(*[self.start_camera(user_id, camera_id, camera_dict.get(camera_id), class_data)
+                                          for user_id, camera_id in cameras])
+        results.update(zip(camera_ids, statuses))
+
+        # Log the timeline once every started camera has analyzed its first image
+        task = asyncio.ensure_future(self.startup_timeline.report(
+            [camera_id for camera_id in camera_ids if results[camera_id] == CAMERA_STARTED], title))
+        self.report_tasks.add(task)
+        task.add_done_callback(self.report_tasks.discard)
+        return results
+
+    #-------------------------------------------------------------------------------
+    def start_inference_service(self):
+        ''' Start the process that analyzes the images from all workers '''
+
+        try:
+            self.inference_service = InferenceService(self.inference_batch_size, self.inference_max_latency,
+                                                      self.inference_max_clients)
+            self.inference_service.daemon = True
+            self.inference_service.start()
+        except Exception as e:
+            self.inference_service = None
+            logger.error("Failed to start inference service, workers will load their own models: %s" % e)
+
+    #-------------------------------------------------------------------------------
+    def start_process_template(self):
+        ''' Start the forkserver and wait until it has imported its modules and, if it preloads it, loaded the model '''
+
+        if mp.get_start_method() != "forkserver":
+            return
+        start = time.time()
+        try:
+            # The forkserver only answers once the preload is done, so starting any process waits for it
+            process = mp.Process(target=time.sleep, args=(0,))
+            process.start()
+            process.join()
+            logger.info("Process template started in %.1f s." % (time.time() - start))
+        except Exception as e:
+            logger.error("Failed to start process template: %s" % e)
+
+    #-------------------------------------------------------------------------------
+    async def start_system(self, user_id):
         ''' When user presses the start button, start all cameras with status active'''
 
         # Import camera data
-        user_camera_dict = self.import_user_camera_data([user_id])
+        user_camera_dict = await self.run_in_executor(self.import_user_camera_data, [user_id])
 
         # Start cameras
-        for camera_id in user_camera_dict[user_id]:
-            self.add_new_stream(user_id, camera_id)
+        return await self.start_cameras(user_camera_dict, "Start of system for user %s" % user_id)
 
     #-------------------------------------------------------------------------------
-    def stop_system(self, user_id):
+    async def stop_system(self, user_id):
         ''' When user presses the stop button, stop all cameras with status active'''
 
         # Import camera data
-        user_camera_dict = self.import_user_camera_data([user_id])
+        user_camera_dict = await self.run_in_executor(self.import_user_camera_data, [user_id])
+
         # Stop cameras
+        cameras = {}
         for camera_id in user_camera_dict[user_id]:
-            self.close_old_stream(camera_id)
+            async with self.camera_locks[camera_id]:
+                self.supervisor.remove(camera_id)
+                cameras[camera_id] = await self.run_in_executor(self.close_old_stream, camera_id)
+        return cameras
 
     #-------------------------------------------------------------------------------
     def update_system_status(self, system_status, user_id):
@@ -293,7 +487,29 @@ class Server():
         except Exception as e:
             logger.error("Failed to update system status for user %s: %s" % (user_id, e))
 
+    #-------------------------------------------------------------------------------
+    async def view_camera(self, user_id, camera_id):
+        ''' Start camera if needed and make it the one shown in the browser '''
+
+        status = await self.start_camera(user_id, camera_id)
+        if status != CAMERA_FAILED:
+            self.reset_active_camera_settings()
+            self.camera_queues[camera_id].put("activate")
+        return {camera_id: status}
+
 
 if __name__ == '__main__':
+    # New processes are forked from a template process that has imported everything, instead of each of
+    # them starting from scratch. Must be set before any process or queue is created.
+    mp.set_start_method("forkserver")
     server = Server()
+
+    # The model is only preloaded when workers run inference themselves, with the inference service
+    # the workers never use it. Processes forked from the template share its pages, capture processes
+    # that never touch the model do not get a private copy of it.
+    preload = list(PROCESS_TEMPLATE_MODULES)
+    if not server.use_inference_service:
+        preload.insert(0, MODEL_TEMPLATE_MODULE)
+    mp.set_forkserver_preload(preload)
+
     server.run()
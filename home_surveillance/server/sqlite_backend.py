@@ -0,0 +1,195 @@
+''' SQLite database for MysqlConnection, to run and measure the server without a MySQL server.
+
+Selected with DB_BACKEND=sqlite, the database file is SQLITE_DB. A relative path is relative to the
+project directory, as in the settings of the web app, so that the server and the web app open the
+same file. The tables are created from the models of the web app, create the database and a user
+with cameras with
+
+    python sqlite_backend.py --cameras 2
+
+and start the server with CAMERA_SOURCE=fake:// to use generated frames instead of rtsp streams.
+'''
+
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import sys
+from functools import lru_cache
+
+# Create loggers for code
+logger = logging.getLogger("sqlite_backend")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# Directory of manage.py, the BASE_DIR of the web app
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SQLITE_DB = os.path.join(PROJECT_DIR, os.getenv('SQLITE_DB', 'home_surveillance.sqlite3'))
+# Time in seconds to wait for a write lock held by another process
+BUSY_TIMEOUT = 30
+
+# Models of the web app the server uses
+SCHEMA_MODELS = ["DimCameras", "DimClasses", "DimPerson", "FactAlarmLog"]
+
+# Labels of the classes the workers alarm for, with the id of the class in the model
+CLASSES = [(0, "person"), (0, "persons"), (1, "bicycle"), (1, "bicycles"), (2, "car"), (2, "cars"),
+           (3, "motorcycle"), (3, "motorcycles"), (5, "bus"), (5, "buses"), (7, "truck"), (7, "trucks"),
+           (16, "dog"), (16, "dogs"), (17, "horse"), (17, "horses")]
+
+PLACEHOLDER = re.compile(r"%(s|%)")
+
+# Messages of the OperationalErrors that are transient, SQLite reports e.g. unknown columns with the same type
+TRANSIENT_ERRORS = ("database is locked", "database table is locked", "unable to open database file", "disk I/O error")
+
+
+#-------------------------------------------------------------------------------
+@lru_cache(maxsize=1024)
+def translate_placeholders(query):
+    ''' Placeholders of mysql.connector to those of sqlite3, %s to ? and %% to % '''
+
+    return PLACEHOLDER.sub(lambda match: "?" if match.group(1) == "s" else "%", query)
+
+
+class SqliteCursor():
+    def __init__(self, cursor):
+        ''' Cursor of SqliteConnection, runs statements written for mysql.connector '''
+
+        self.cursor = cursor
+        self.inserted = False
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        self.cursor.close()
+
+    #-------------------------------------------------------------------------------
+    def execute(self, query, data=None):
+        # Without values mysql.connector leaves the statement as it is
+        if data is None:
+            self.cursor.execute(query)
+        else:
+            self.cursor.execute(translate_placeholders(query), data)
+        self.inserted = query.lstrip()[:6].upper() == "INSERT"
+
+    #-------------------------------------------------------------------------------
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    #-------------------------------------------------------------------------------
+    @property
+    def lastrowid(self):
+        ''' Id of the first row of the last INSERT, as MySQL gives it, SQLite gives the id of the last row '''
+
+        if self.inserted and self.cursor.rowcount > 0:
+            return self.cursor.lastrowid - self.cursor.rowcount + 1
+        return self.cursor.lastrowid
+
+
+class SqliteConnection():
+    def __init__(self, path=SQLITE_DB):
+        '''
+        Connection to an SQLite file with the part of the mysql.connector interface MysqlConnection uses
+            path = Path of the database file
+        '''
+
+        self.cnx = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+
+        # Readers do not block the writer, the server, workers and web app use the file at the same time
+        self.cnx.execute("PRAGMA journal_mode=WAL")
+
+    #-------------------------------------------------------------------------------
+    def close(self):
+        self.cnx.close()
+
+    #-------------------------------------------------------------------------------
+    def commit(self):
+        self.cnx.commit()
+
+    #-------------------------------------------------------------------------------
+    def cursor(self):
+        return SqliteCursor(self.cnx.cursor())
+
+    #-------------------------------------------------------------------------------
+    def ping(self, reconnect=False):
+        self.cnx.execute("SELECT 1")
+
+
+#-------------------------------------------------------------------------------
+def connect():
+    return SqliteConnection(SQLITE_DB)
+
+#-------------------------------------------------------------------------------
+def create_schema(path=SQLITE_DB):
+    ''' Create the tables of SCHEMA_MODELS that are missing, with the schema editor of Django '''
+
+    # The web app is imported the way Django imports it, from the project directory
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+
+    import django
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": path}},
+                           INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes", "app"])
+        django.setup()
+    from django.apps import apps
+    from django.db import connection
+
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for name in SCHEMA_MODELS:
+            model = apps.get_model("app", name)
+            if model._meta.db_table not in existing:
+                editor.create_model(model)
+                logger.info("Created table %s in %s." % (model._meta.db_table, path))
+
+#-------------------------------------------------------------------------------
+def create_user(path=SQLITE_DB, user_id=1, cameras=1, first_web_socket=5555):
+    ''' Add a user with the system started, cameras with detection on and the classes if there are none '''
+
+    cnx = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    with cnx:
+        if cnx.execute("SELECT COUNT(*) FROM app_dimclasses").fetchone()[0] == 0:
+            cnx.executemany("INSERT INTO app_dimclasses (yolo_id, class_label) VALUES (?, ?)", CLASSES)
+        cnx.execute("INSERT INTO app_dimperson (user_id, account_type, max_cameras, push_token, push_user, system_status) "
+                    "VALUES (?, 'standard', ?, '', '', 1)", (user_id, str(cameras)))
+        camera_ids = []
+        for i in range(cameras):
+            cursor = cnx.execute("INSERT INTO app_dimcameras (user_id, camera_name, camera_model, x_res, y_res, "
+                                 "rtsp_main, domain, port, user_name, password, web_socket, description, "
+                                 "detection_status, selected_status, detection_classes) "
+                                 "VALUES (?, ?, 'fake', 640, 480, '', 'localhost', '554', '', '', ?, '', 1, 0, '')",
+                                 (user_id, "Camera %s" % (i + 1), first_web_socket + i))
+            camera_ids.append(cursor.lastrowid)
+    cnx.close()
+    return camera_ids
+
+#-------------------------------------------------------------------------------
+def is_connection_error(error):
+    ''' Errors after which a statement can succeed on another try, e.g. while another process holds the write lock '''
+
+    return isinstance(error, sqlite3.OperationalError) and str(error).startswith(TRANSIENT_ERRORS)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the SQLite database of the server")
+    parser.add_argument("--path", default=SQLITE_DB, help="Path of the database file")
+    parser.add_argument("--cameras", type=int, default=0, help="Add a user with this many cameras")
+    parser.add_argument("--user-id", type=int, default=1, help="Id of the user added")
+    args = parser.parse_args()
+
+    create_schema(args.path)
+    if args.cameras:
+        camera_ids = create_user(args.path, args.user_id, args.cameras)
+        logger.info("Added user %s with cameras %s." % (args.user_id, camera_ids))
@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import time
+from commands import CAMERA_ALREADY_RUNNING, CAMERA_STARTED
+
+# Create loggers for code
+logger = logging.getLogger("supervisor")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# States of a supervised camera
+RUNNING = "running"
+RESTARTING = "restarting"
+
+
+class CameraHealth():
+    def __init__(self, user_id, camera_id, now):
+        ''' Uptime and crash accounting of one supervised camera '''
+
+        self.camera_id = camera_id
+        self.failures = 0
+        self.last_failure = None
+        self.last_failure_time = None
+        self.restart_time = None
+        self.restarts = 0
+        self.start_time = now
+        self.state = RUNNING
+        self.user_id = user_id
+
+    #-------------------------------------------------------------------------------
+    def failed(self, reason, now, backoff_initial, backoff_max):
+        ''' Schedule a restart, the delay doubles for every failure in a row '''
+
+        self.last_failure = reason
+        self.last_failure_time = now
+        self.restart_time = now + min(backoff_max, backoff_initial * 2 ** self.failures)
+        self.failures += 1
+        self.state = RESTARTING
+
+    #-------------------------------------------------------------------------------
+    def started(self, now):
+        self.restart_time = None
+        self.start_time = now
+        self.state = RUNNING
+
+    #-------------------------------------------------------------------------------
+    def to_dict(self, now):
+        return {
+            "state": self.state,
+            "uptime": round(now - self.start_time, 1) if self.state == RUNNING else 0,
+            "restarts": self.restarts,
+            "failures_in_row": self.failures,
+            "last_failure": self.last_failure,
+            "last_failure_time": self.last_failure_time,
+            "next_restart_in": round(max(0, self.restart_time - now), 1) if self.state == RESTARTING else None,
+        }
+
+
+class Supervisor():
+    def __init__(self, server, check_interval=1, heartbeat_timeout=30, frame_timeout=60, backoff_initial=1,
+                 backoff_max=300, stable_time=300):
+        '''
+        Watches the processes of every started camera and restarts cameras whose worker or capture
+        process has died or hung, and restarts the inference service if it has died. Runs as a task
+        in the event loop of the server.
+            check_interval = Time in seconds between checks
+            heartbeat_timeout = Time in seconds without a heartbeat before a worker is considered hung
+            frame_timeout = Time in seconds without a frame before the capture is considered hung
+            backoff_initial, backoff_max = First and longest delay in seconds before a restart
+            stable_time = Time in seconds a camera must run before its failures in a row are forgotten
+        '''
+
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.cameras = {}
+        self.check_interval = check_interval
+        self.frame_timeout = frame_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.inference_failures = 0
+        self.inference_restart_time = None
+        self.inference_restarts = 0
+        self.inference_start_time = time.time()
+        self.inference_task = None
+        self.server = server
+        self.stable_time = stable_time
+        self.statistics_interval = 60
+        self.tasks = {}
+
+    #-------------------------------------------------------------------------------
+    def add(self, user_id, camera_id):
+        ''' Start supervising a camera that has just been started, the counts are kept if it was restarting '''
+
+        health = self.cameras.get(camera_id)
+        if health is None or health.user_id != user_id:
+            self.cameras[camera_id] = CameraHealth(user_id, camera_id, time.time())
+        else:
+            health.started(time.time())
+
+    #-------------------------------------------------------------------------------
+    def add_task(self, camera_id, task):
+        ''' Keep the task stopping or restarting a camera, the camera is left alone until it is done '''
+
+        self.tasks[camera_id] = task
+        task.add_done_callback(lambda task, camera_id=camera_id: self.tasks.pop(camera_id, None))
+
+    #-------------------------------------------------------------------------------
+    def check_camera(self, camera_id, health, now):
+        ''' Returns the reason the camera needs a restart, or None if it is healthy '''
+
+        worker = self.server.camera_workers.get(camera_id)
+        capture = self.server.camera_captures.get(camera_id)
+        if worker is None or capture is None:
+            return "processes missing"
+        if not worker.is_alive():
+            return "worker exited with code %s" % worker.exitcode
+        if not capture.is_alive():
+            return "capture exited with code %s" % capture.exitcode
+
+        # Time since start counts as well, workers and cameras need a moment to get going
+        heartbeat = self.server.camera_heartbeats.get(camera_id)
+        if heartbeat is not None and now - max(heartbeat.value, health.start_time) > self.heartbeat_timeout:
+            return "no heartbeat from worker for %.0f s" % (now - max(heartbeat.value, health.start_time))
+        ring = self.server.camera_rings.get(camera_id)
+        if ring is not None and now - max(ring.timestamp, health.start_time) > self.frame_timeout:
+            return "no frames from camera for %.0f s" % (now - max(ring.timestamp, health.start_time))
+        return None
+
+    #-------------------------------------------------------------------------------
+    def check_inference_service(self, now):
+        ''' Restart the inference service if it has died, with the same backoff as cameras '''
+
+        service = self.server.inference_service
+        if service is None or (self.inference_task is not None and not self.inference_task.done()):
+            return
+        if service.is_alive():
+            if self.inference_failures and now - self.inference_start_time > self.stable_time:
+                self.inference_failures = 0
+            return
+
+        if self.inference_restart_time is None:
+            self.inference_restart_time = now + min(self.backoff_max, self.backoff_initial * 2 ** self.inference_failures)
+            self.inference_failures += 1
+            logger.error("Inference service exited with code %s, restarting in %.0f s." %
+                         (service.exitcode, self.inference_restart_time - now))
+        if now >= self.inference_restart_time:
+            self.inference_task = asyncio.ensure_future(self.restart_inference_service())
+
+    #-------------------------------------------------------------------------------
+    def log_statistics(self):
+        now = time.time()
+        for camera_id, health in self.cameras.items():
+            logger.info("Camera %s: %s, up %.0f s, %s restarts, last failure: %s" %
+                        (camera_id, health.state, now - health.start_time if health.state == RUNNING else 0,
+                         health.restarts, health.last_failure))
+        if self.server.inference_service is not None:
+            logger.info("Inference service: up %.0f s, %s restarts." % (now - self.inference_start_time, self.inference_restarts))
+
+    #-------------------------------------------------------------------------------
+    def remove(self, camera_id):
+        ''' Stop supervising a camera that has been stopped on purpose '''
+
+        self.cameras.pop(camera_id, None)
+
+    #-------------------------------------------------------------------------------
+    async def restart_camera(self, camera_id, health):
+        ''' Start a camera again once its backoff has passed '''
+
+        async with self.server.camera_locks[camera_id]:
+            # The camera may have been stopped or started by a user while waiting for the lock
+            if self.cameras.get(camera_id) is not health or health.state != RESTARTING:
+                return
+            status = await self.server.run_in_executor(self.server.add_new_stream, health.user_id, camera_id)
+
+        now = time.time()
+        if status in (CAMERA_STARTED, CAMERA_ALREADY_RUNNING):
+            health.restarts += 1
+            health.started(now)
+            logger.info("Camera %s restarted, %s restarts so far." % (camera_id, health.restarts))
+        else:
+            health.failed("restart failed", now, self.backoff_initial, self.backoff_max)
+            logger.error("Camera %s failed to restart, next try in %.0f s." % (camera_id, health.restart_time - now))
+
+    #-------------------------------------------------------------------------------
+    async def restart_inference_service(self):
+        '''
+        Start a new inference service. The clients of the running workers use the queues of the old
+        service, a queue its process died reading from may stay locked, so the cameras are restarted too.
+        '''
+
+        await self.server.run_in_executor(self.server.start_inference_service)
+        now = time.time()
+        self.inference_restart_time = None
+        self.inference_restarts += 1
+        self.inference_start_time = now
+        logger.info("Inference service restarted, %s restarts so far." % self.inference_restarts)
+
+        for camera_id, health in list(self.cameras.items()):
+            if health.state != RUNNING or camera_id in self.tasks:
+                continue
+            health.failed("inference service restarted", now, self.backoff_initial, self.backoff_max)
+            self.add_task(camera_id, asyncio.ensure_future(self.stop_camera(camera_id, health)))
+
+    #-------------------------------------------------------------------------------
+    async def run(self):
+        ''' Check the cameras until the server stops '''
+
+        statistics_time = time.time()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.supervise()
+            except Exception as e:
+                logger.error("Supervising cameras failed: %s" % e)
+
+            if time.time() - statistics_time > self.statistics_interval:
+                statistics_time = time.time()
+                self.log_statistics()
+
+    #-------------------------------------------------------------------------------
+    def status(self, user_id=None):
+        ''' Health of every supervised camera, only those of user_id if given '''
+
+        now = time.time()
+        return {camera_id: health.to_dict(now) for camera_id, health in self.cameras.items()
+                if user_id is None or health.user_id == user_id}
+
+    #-------------------------------------------------------------------------------
+    def stop_processes(self, camera_id):
+        ''' Stop the processes of a failed camera, killing those that do not stop by themselves '''
+
+        worker = self.server.camera_workers.get(camera_id)
+        capture = self.server.camera_captures.get(camera_id)
+        self.server.close_old_stream(camera_id)
+        for process in (worker, capture):
+            if process is None:
+                continue
+            process.join(5)
+            if process.is_alive():
+                logger.info("Camera %s: Killing hung process %s." % (camera_id, process.pid))
+                process.kill()
+                process.join(5)
+
+    #-------------------------------------------------------------------------------
+    async def stop_camera(self, camera_id, health):
+        ''' Stop the processes of a failed camera, unless it was stopped by a user meanwhile '''
+
+        async with self.server.camera_locks[camera_id]:
+            if self.cameras.get(camera_id) is health:
+                await self.server.run_in_executor(self.stop_processes, camera_id)
+
+    #-------------------------------------------------------------------------------
+    def supervise(self):
+        ''' Stop failed cameras and restart the ones whose backoff has passed '''
+
+        now = time.time()
+        self.check_inference_service(now)
+        for camera_id, health in list(self.cameras.items()):
+            # Stopping a hung process takes a while, other cameras are checked meanwhile
+            if camera_id in self.tasks:
+                continue
+
+            if health.state == RUNNING:
+                reason = self.check_camera(camera_id, health, now)
+                if reason is None:
+                    if health.failures and now - health.start_time > self.stable_time:
+                        health.failures = 0
+                    continue
+
+                health.failed(reason, now, self.backoff_initial, self.backoff_max)
+                logger.error("Camera %s failed: %s, restarting in %.0f s." %
+                             (camera_id, reason, health.restart_time - now))
+                task = asyncio.ensure_future(self.stop_camera(camera_id, health))
+            elif now >= health.restart_time:
+                task = asyncio.ensure_future(self.restart_camera(camera_id, health))
+            else:
+                continue
+            self.add_task(camera_id, task)
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import queue
+import time
+import multiprocessing as mp
+
+# Create loggers for code
+logger = logging.getLogger("timeline")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+# Create handler
+consoleHandler = logging.StreamHandler()
+consoleHandler.setLevel(logging.INFO)
+
+# Add handler to logger
+logger.addHandler(consoleHandler)
+
+# Set formatting to logger
+formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
+consoleHandler.setFormatter(formatter)
+
+# Stages of the startup of a camera, in the order they are passed
+CONFIG = "config"
+SPAWN = "spawn"
+MODEL = "model"
+FIRST_FRAME = "first_frame"
+FIRST_INFERENCE = "first_inference"
+STAGES = (CONFIG, SPAWN, MODEL, FIRST_FRAME, FIRST_INFERENCE)
+
+
+class StartupTimeline():
+    def __init__(self, timeout=300):
+        '''
+        Collects the time each camera passes the stages of its startup. The server records the
+        stages it carries out itself, the workers put theirs on the events queue.
+            timeout = Time in seconds to wait for a startup to finish before it is reported anyway
+        '''
+
+        self.cameras = {}
+        self.events = mp.Queue()
+        self.timeout = timeout
+
+    #-------------------------------------------------------------------------------
+    def begin(self, camera_ids):
+        ''' Start a new timeline for the cameras '''
+
+        now = time.time()
+        for camera_id in camera_ids:
+            self.cameras[camera_id] = {"start": now}
+
+    #-------------------------------------------------------------------------------
+    def drain(self):
+        ''' Record every event the workers have sent '''
+
+        while True:
+            try:
+                camera_id, stage, timestamp = self.events.get_nowait()
+            except queue.Empty:
+                return
+            self.record(camera_id, stage, timestamp)
+
+    #-------------------------------------------------------------------------------
+    def format(self, camera_id):
+        stages = self.to_dict(camera_id)
+        return ", ".join("%s %.2f s" % (stage, stages[stage]) if stages.get(stage) is not None else "%s -" % stage
+                         for stage in STAGES)
+
+    #-------------------------------------------------------------------------------
+    def is_complete(self, camera_id):
+        return FIRST_INFERENCE in self.cameras.get(camera_id, {})
+
+    #-------------------------------------------------------------------------------
+    def record(self, camera_id, stage, timestamp=None):
+        timeline = self.cameras.setdefault(camera_id, {"start": time.time() if timestamp is None else timestamp})
+        timeline[stage] = time.time() if timestamp is None else timestamp
+        if stage == FIRST_INFERENCE:
+            logger.info("Camera %s started: %s" % (camera_id, self.format(camera_id)))
+
+    #-------------------------------------------------------------------------------
+    async def report(self, camera_ids, title):
+        ''' Wait until all cameras have analyzed their first image, or the timeout, and log a summary '''
+
+        start = time.time()
+        while not all(self.is_complete(camera_id) for camera_id in camera_ids):
+            if time.time() - start > self.timeout:
+                for camera_id in camera_ids:
+                    if not self.is_complete(camera_id):
+                        logger.error("Camera %s not started after %.0f s: %s" %
+                                     (camera_id, self.timeout, self.format(camera_id)))
+                break
+            await asyncio.sleep(0.1)
+
+        started = [camera_id for camera_id in camera_ids if self.is_complete(camera_id)]
+        if started:
+            slowest = max(started, key=lambda camera_id: self.to_dict(camera_id)[FIRST_INFERENCE])
+            logger.info("%s: %s of %s cameras detecting, the last after %.2f s (camera %s)." %
+                        (title, len(started), len(camera_ids), self.to_dict(slowest)[FIRST_INFERENCE], slowest))
+
+    #-------------------------------------------------------------------------------
+    async def run(self):
+        ''' Collect the events of the workers until the server stops '''
+
+        while True:
+            self.drain()
+            await asyncio.sleep(0.1)
+
+    #-------------------------------------------------------------------------------
+    def to_dict(self, camera_id):
+        ''' Seconds from the start of the timeline to each stage the camera has passed '''
+
+        timeline = self.cameras.get(camera_id)
+        if timeline is None:
+            return {}
+        return {stage: round(timeline[stage] - timeline["start"], 3) if stage in timeline else None for stage in STAGES}
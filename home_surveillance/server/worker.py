@@ -1,20 +1,19 @@
-import base64
 import cv2
+import json
 import logging
 import numpy as np
-import requests
 import socket
 import time
 import zmq
-from datetime import datetime
 from itertools import repeat
 from functools import partial
 from PIL import Image
 from threading import Thread
-from ultralytics import YOLO
 import multiprocessing as mp
-from camera import Camera
-from home_surveillance.server.mysql_conn import MysqlConnection
+from alarms import Alarm, AlarmDispatcher
+from config_cache import CAMERA, CLASSES, INVALIDATE, get_config_cache
+from detections import Detections, extract_detections
+from inference import DETECTION_CLASSES, DETECTION_CONF, import_model
 
 # Create loggers for code
 logger = logging.getLogger("worker")
@@ -32,42 +31,82 @@ logger.addHandler(consoleHandler)
 formatter = logging.Formatter('%(asctime)s  %(name)s  %(levelname)s: %(message)s')
 consoleHandler.setFormatter(formatter)
 
-# Load the YOLOv8 model
-def import_model():
-    return YOLO('yolov8m.pt')
-
 class Worker(mp.Process):
-    def __init__(self, user_id, camera_id, camera_queue):
-        ''' Worker thread for performing the actual work, analyzing, saving and alarming '''
+    def __init__(self, user_id, camera_id, camera_queue, frame_ring, inference_client=None, heartbeat=None,
+                 camera_data=None, class_data_sql=None, startup_events=None):
+        '''
+        Worker thread for performing the actual work, analyzing, saving and alarming.
+        Frames are read from the shared frame ring written by the capture process of the camera.
+        If an inference client is given the images are analyzed by the shared inference
+        service, otherwise the worker loads its own model. If a heartbeat is given, a shared
+        double, the time of every turn of the main loop is written to it for the supervisor.
+            camera_data, class_data_sql = Config already fetched by the server, imported from sql if not given
+            startup_events = Queue the stages of the startup are reported to
+        '''
 
         # Specifying class specific parameters
         super(Worker, self).__init__()
         self.camera_id = camera_id
-        self.camera_data = self.import_camera_data_from_sql()
+        self.camera_data = camera_data if camera_data is not None else self.import_camera_data_from_sql()
         self.camera_detection_status = int(self.camera_data["detection_status"])
         self.camera_selected_status = int(self.camera_data["selected_status"])
         self.camera_queue = camera_queue
-        self.class_data_sql = self.import_class_data_from_sql()
+        self.class_data_sql = class_data_sql if class_data_sql is not None else self.import_class_data_from_sql()
         self.class_data = self.convert_class_data_to_dict(self.class_data_sql)
+        self.frame_ring = frame_ring
+        self.heartbeat = heartbeat
         self.host = "192.168.0.135"
-        self.start_time = 0
+        self.inference_client = inference_client
+        self.startup_events = startup_events
+        self.startup_stages = set()
         self.stopped = False
         self.user_id = user_id
         self.web_socket = self.camera_data["web_socket"]
 
-        # Alarm statuses
+        # Alarm statuses, alarms are logged and delivered by the dispatcher threads
+        self.alarm_dispatcher = None
         self.alarm_status = 0
         self.class_statuses = self.create_class_statuses()
         self.max_time_no_spots = 30
 
-        # Results
-        self.result_class_list = []
-        self.max_class_probability = 0
+        # Motion gating, images are only analyzed when the scene has changed or when the
+        # forced interval has passed, so that stationary objects are still checked
+        self.force_inference_interval = 10
+        self.last_inference_time = 0
+
+        # Frame statistics, frames are dropped when the camera delivers faster than the worker analyzes
+        self.frame = None
+        self.last_sequence = 0
+        self.last_analyzed_sequence = 0
+        self.last_frame_time = 0
+        self.fps = 0
+        self.frames_analyzed = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.statistics_interval = 60
+        self.statistics_time = time.time()
+
+        # Results, the annotated and encoded images are only created when someone needs them
+        # and at most once per frame
+        self.detections = Detections()
+        self.results = None
         self.result_image = None
-
-        # Create socket
-        #self.check_if_port_is_used()
-        self.footage_socket = self.create_socket()
+        self.result_image_sequence = 0
+        self.encoded_image = None
+        self.encoded_image_sequence = 0
+        self.images_rendered = 0
+        self.images_encoded = 0
+
+        # Viewer counts published by the frame broker, the selected status of the camera is
+        # used instead when the broker has not been heard from for a while
+        self.broker_status_port = 5551
+        self.viewer_count = 0
+        self.viewer_count_time = 0
+        self.viewer_count_timeout = 5
+        self.viewer_socket = None
+
+        # Socket for the footage, created in the worker process since zmq sockets do not survive a fork
+        self.footage_socket = None
 
         # Message user
         logger.info("Worker process started for user %s and camera %s." % (self.user_id, self.camera_id))
@@ -75,7 +114,8 @@ class Worker(mp.Process):
     #-------------------------------------------------------------------------------
     def __reduce__(self):
         ''' Here we return a tuple containing the class reference and initialization arguments. '''
-        return (self.__class__, (self.user_id, self.camera_id, self.camera_queue))
+        return (self.__class__, (self.user_id, self.camera_id, self.camera_queue, self.frame_ring, self.inference_client,
+                                 self.heartbeat, self.camera_data, self.class_data_sql, self.startup_events))
     
     #-------------------------------------------------------------------------------
     def add_labels_to_image(self, results):
@@ -83,8 +123,11 @@ class Worker(mp.Process):
         try:
             # Visualize the results
             active_class_list = self.check_active_alarms()
-            result_image = results[0].plot()
-            fps_label = "FPS: %.2f   Alarm status: %s   Active classes: %s" % ((1 / (time.time() - self.start_time)), self.alarm_status, active_class_list)
+            if results is not None:
+                result_image = results[0].plot()
+            else:
+                result_image = self.frame.image.copy()
+            fps_label = "FPS: %.2f   Alarm status: %s   Active classes: %s" % (self.fps, self.alarm_status, active_class_list)
             cv2.rectangle(result_image, (0, 0), (result_image.shape[1], 20), (0,0,0), -1)
             cv2.putText(result_image, fps_label, (10, 15), cv2.FONT_HERSHEY_PLAIN, 0.85, (255, 255, 255), 1)
             return result_image
@@ -97,12 +140,20 @@ class Worker(mp.Process):
         ''' Analyze image that comes from the camera using YOLOv8 '''
 
         try:
-            # Classes: 0: person, 1: bicycle, 2: car, 3: motorcycle, 5: bus, 7: truck, 16: dog, 17, horse
-            return self.model(self.camera_stream.latest_image, classes=[0, 1, 2, 3, 5, 7, 16, 17], conf=0.8, verbose=False)
+            if self.inference_client is not None:
+                return self.inference_client.analyze(self.frame.image)
+            return self.model(self.frame.image, classes=DETECTION_CLASSES, conf=DETECTION_CONF, verbose=False)
         except Exception as e:
             logger.error("Camera %s: Failed to analyze the image from the camera feed: %s" % (self.camera_id, e))
             return None
         
+    #-------------------------------------------------------------------------------
+    def beat(self):
+        ''' Tell the supervisor that the worker is alive '''
+
+        if self.heartbeat is not None:
+            self.heartbeat.value = time.time()
+
     #-------------------------------------------------------------------------------
     def check_active_alarms(self):
         ''' Check what classes are active '''
@@ -120,6 +171,26 @@ class Worker(mp.Process):
             logger.error("Camera %s: Unable to create active class string: %s" % (self.camera_id, e))
             return ""
 
+    #-------------------------------------------------------------------------------
+    def check_if_image_should_be_analyzed(self):
+        ''' Analyze image if motion was detected since the last analysis or if the forced interval has passed '''
+
+        try:
+            if self.frame_ring.last_motion_sequence > self.last_analyzed_sequence:
+                return True
+            return (time.time() - self.last_inference_time) >= self.force_inference_interval
+        except Exception as e:
+            logger.error("Camera %s: Unable to check motion status: %s" % (self.camera_id, e))
+            return True
+
+    #-------------------------------------------------------------------------------
+    def check_if_someone_is_watching(self):
+        ''' Check if the footage of the camera is watched by anyone '''
+
+        if time.time() - self.viewer_count_time < self.viewer_count_timeout:
+            return self.viewer_count > 0
+        return self.camera_selected_status == 1
+
     #-------------------------------------------------------------------------------
     def check_if_port_is_used(self):
         ''' Check if the port is beeing used '''
@@ -143,6 +214,8 @@ class Worker(mp.Process):
         try:
             new_dict = {}
             for item in class_data:
+                # The rows are shared by all workers started together, they must not be changed
+                item = dict(item)
                 class_label = item.pop('class_label')
                 new_dict[class_label] = item
             return new_dict
@@ -183,36 +256,67 @@ class Worker(mp.Process):
         ''' Create a socket connection for streaming camera feed '''
 
         try:
-            context = zmq.Context()
+            # Only the latest frame is kept, frames are dropped instead of queued when the broker is behind
+            context = zmq.Context.instance()
             footage_socket = context.socket(zmq.PUB)
+            footage_socket.setsockopt(zmq.SNDHWM, 1)
+            footage_socket.setsockopt(zmq.LINGER, 0)
             footage_socket.connect('tcp://localhost:%s' % self.web_socket)
             return footage_socket
         except Exception as e:
             logger.error("Failed to create socket due to: %s" % e)
             return None
         
+    #-------------------------------------------------------------------------------
+    def create_viewer_socket(self):
+        ''' Create a socket subscribing to the viewer count of the camera from the frame broker '''
+
+        try:
+            context = zmq.Context.instance()
+            viewer_socket = context.socket(zmq.SUB)
+            viewer_socket.setsockopt(zmq.LINGER, 0)
+            viewer_socket.connect('tcp://localhost:%s' % self.broker_status_port)
+            viewer_socket.setsockopt_string(zmq.SUBSCRIBE, "viewers-%s:" % self.camera_id)
+            return viewer_socket
+        except Exception as e:
+            logger.error("Camera %s: Failed to create viewer socket due to: %s" % (self.camera_id, e))
+            return None
+
     #------------------------------------------------------------------------------
     def extract_results_from_analyzed_image(self, results):
         ''' Extract result from the results object of the YOLOv8 model '''
 
         try:
-            self.result_class_list = []
-            for result in results:
-                if "(no detections)," not in result.verbose():
-                    self.max_class_probability = result.boxes.conf[0].detach().item()
-                    class_string = result.verbose().split(" ")[1]
-                    self.result_class_list.append(class_string[0:len(class_string)-1])
+            self.detections = Detections()
+            self.detections = extract_detections(results)
         except Exception as e:
             logger.error("Camera %s: Unable to extract results from results object: %s" % (self.camera_id, e))
 
+    #-------------------------------------------------------------------------------
+    def get_encoded_image(self):
+        ''' Get the annotated image of the current frame as jpg, encoded at most once per frame '''
+
+        if self.encoded_image_sequence != self.frame.sequence:
+            encoded, self.encoded_image = cv2.imencode('.jpg', self.get_result_image())
+            self.encoded_image_sequence = self.frame.sequence
+            self.images_encoded += 1
+        return self.encoded_image
+
+    #-------------------------------------------------------------------------------
+    def get_result_image(self):
+        ''' Get the annotated image of the current frame, rendered at most once per frame '''
+
+        if self.result_image_sequence != self.frame.sequence:
+            self.result_image = self.add_labels_to_image(self.results)
+            self.result_image_sequence = self.frame.sequence
+            self.images_rendered += 1
+        return self.result_image
+
     #-------------------------------------------------------------------------------
     def import_camera_data_from_sql(self):
         ''' Import camera data '''
         try:
-            columns = ["camera_name", "rtsp_main", "domain", "port", "user_name", "password", "web_socket", "detection_status", "selected_status"]
-            table = "app_dimcameras"
-            where_statements = [("id", self.camera_id)]
-            return MysqlConnection().query_data(columns, table, where_statements)[0]
+            return get_config_cache().camera(self.camera_id)
         except Exception as e:
             logger.error("Failed to import camera data from sql: %s" % e)
             return None
@@ -222,50 +326,27 @@ class Worker(mp.Process):
         ''' Import user data '''
 
         try:
-            columns = ["id", "class_label"]
-            table = "app_dimclasses"
-            where_statements = []
-            return MysqlConnection().query_data(columns, table, where_statements)
+            return get_config_cache().classes()
         except Exception as e:
             logger.error("Failed to import class data from sql: %s" % e)
             return None
         
     #-------------------------------------------------------------------------------
-    def import_user_data_from_sql(self):
-        ''' Import user data '''
-
-        try:
-            columns = ["account_type", "max_cameras", "push_token", "push_user", "user_id", "system_status"]
-            table = "app_dimperson"
-            where_statements = [("user_id", self.user_id)]
-            return MysqlConnection().query_data(columns, table, where_statements)[0]
-        except Exception as e:
-            logger.error("Failed to import user data from sql: %s" % e)
-            return None
-        
-    #---------------------------------------------------------------------------
-    def log_alarm_to_sql(self):
-        ''' Log event to SQL '''
-
-        try:
-            # Update logs with standard deviations
-            table = "app_factalarmlog"
-            data = [
-                ("user_id", self.user_id),
-                ("camera_id", self.camera_id),
-                ("log_date", datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
-                ("log_class", self.class_data[self.result_class_list[0]]["id"]),
-                ("log_score", float(self.max_class_probability)),
-                ("log_num_img", 0),
-                ("log_status", 0),
-                ("download_status", 0),
-                ("download_url", ""),
-            ]
-            log_id = MysqlConnection().insert_data(table, data)
-
-            logger.info('Camera %s: Detection logged to SQL, alarm status %s.' % (self.camera_id, 1))
-        except Exception as e:
-            logger.error('Camera %s: Saving log to SQL in collecting_data failed: %s' % (self.camera_id, e))
+    def invalidate_config(self, kind, key):
+        ''' Drop config that has been changed from the cache and read the settings of the camera again '''
+
+        get_config_cache().invalidate(kind, key)
+        if kind == CAMERA:
+            camera_data = self.import_camera_data_from_sql()
+            if camera_data is not None:
+                self.camera_data = camera_data
+                self.camera_detection_status = int(camera_data["detection_status"])
+        elif kind == CLASSES:
+            class_data_sql = self.import_class_data_from_sql()
+            if class_data_sql is not None:
+                self.class_data_sql = class_data_sql
+                self.class_data = self.convert_class_data_to_dict(class_data_sql)
+        logger.info("Camera %s: Config of %s changed." % (self.camera_id, kind if key is None else "%s %s" % (kind, key)))
 
     #-------------------------------------------------------------------------------
     def manage_camera_status(self, action):
@@ -275,28 +356,6 @@ class Worker(mp.Process):
         elif action == "inactivate":
             self.camera_selected_status = 0
 
-    #-------------------------------------------------------------------------------
-    def pushover_alert(self, spotted_class, first_image):
-        ''' Message user when something has been spotted. '''
-
-        try:
-            settings = self.import_user_data_from_sql()
-            priority = 1
-            is_success, im_buf_arr = cv2.imencode(".jpg", first_image)
-            r = requests.post("https://api.pushover.net/1/messages.json", data = {
-              "token": settings["push_token"],
-              "user": settings["push_user"],
-              "message": "A %s has been spotted on camera %s with priority %s!" % (spotted_class, self.camera_data["camera_name"], priority),
-              "priority": priority,
-              "retry": 60,
-              "expire": 180
-            },
-            files = {"attachment": ("image.jpg", im_buf_arr, "image/jpeg")}
-            )
-            logger.info("Camera %s: Pushover successfully delivered with priority %s" % (self.camera_id, priority))
-        except Exception as e:
-            logger.error("Camera %s: Pushover failed to deliver alarm message: %s" % (self.camera_id, e))
-
     #-------------------------------------------------------------------------------
     def reset_statuses(self):
         ''' Reset all alarm statuses that have not had any spots in a certain time period '''
@@ -325,43 +384,83 @@ class Worker(mp.Process):
     def run(self):
         ''' Main loop for worker '''
 
-        # Start camera stream
-        logger.info("Starting camera thread for user %s and camera %s." % (self.user_id, self.camera_id))
-        self.camera_stream = Camera(self, self.user_id, self.camera_id)
-        self.camera_stream.daemon = True
-        self.camera_stream.start()
+        # Loading the model can take a while, let the supervisor know the worker is alive
+        self.beat()
+
+        # Start threads for logging and delivering alarms
+        self.alarm_dispatcher = AlarmDispatcher(self.camera_id)
+        self.alarm_dispatcher.start()
 
-        # Import model
-        self.model = import_model()
+        # Import model, unless the shared inference service is used
+        if self.inference_client is None:
+            self.model = import_model()
+        self.report_startup("model")
+
+        # Socket for the footage and for listening to the number of viewers of the camera
+        self.footage_socket = self.create_socket()
+        self.viewer_socket = self.create_viewer_socket()
 
         action = ""
         while not self.stopped:
+            self.beat()
             try:
                 # Check if command was sent
                 if not self.camera_queue.empty():
-                    action = self.camera_queue.get()
-                    logger.info("Command recieved for camera %s: %s" % (self.camera_id, action))
+                    message = self.camera_queue.get()
+                    if isinstance(message, tuple) and message[0] == INVALIDATE:
+                        self.invalidate_config(*message[1:])
+                    else:
+                        action = message
+                        logger.info("Command recieved for camera %s: %s" % (self.camera_id, action))
             except Exception as e:
                 logger.error("Camera %s: Unable to retrieve camera status: %s" % (self.camera_id, e))
 
             # Manage camera status for when camera is activated or deactivated to be shown in browser
             self.manage_camera_status(action)
-            
-            # Calculating time
-            self.start_time = time.time()
-
-            # Analyze data
-            results = self.analyze_image()
-
-            # Extract results from analyzed image
-            self.extract_results_from_analyzed_image(results)
-
-            # Add labels to image and send it through socket
-            if self.camera_detection_status == 1:
-                self.result_image = self.add_labels_to_image(results)
-                if self.camera_selected_status == 1:
-                    self.send_image_through_socket(self.result_image)
-            
+
+            # Wait for a frame that has not been analyzed before
+            frame = self.frame_ring.wait_for_frame(self.last_sequence, timeout=1)
+            if frame is None:
+                self.stop_system(action)
+                continue
+            self.update_frame_statistics(frame)
+            self.report_startup("first_frame")
+
+            # Analyze data if the scene has changed
+            copied = False
+            if self.check_if_image_should_be_analyzed():
+                # Inference can take longer than the ring keeps a frame, analyze a copy so that the detections,
+                # the labelled image and the alarm image all come from the same frame
+                frame = self.frame = frame.copy()
+                copied = True
+                if not self.frame_ring.is_valid(frame):
+                    logger.info("Camera %s: Frame %s was overwritten before it was analyzed." % (self.camera_id, frame.sequence))
+                    self.frames_dropped += 1
+                    self.stop_system(action)
+                    continue
+
+                self.last_inference_time = time.time()
+                self.last_analyzed_sequence = frame.sequence
+                self.results = self.analyze_image()
+                self.frames_analyzed += 1
+                self.report_startup("first_inference")
+
+                # Extract results from analyzed image
+                self.extract_results_from_analyzed_image(self.results)
+            else:
+                self.results = None
+                self.detections = Detections()
+                self.frames_skipped += 1
+
+            # Add labels to image and send it through socket, only if someone is watching.
+            # A frame that is still a view into the ring is not reliable once it is overwritten, it is not sent then.
+            self.update_viewer_count()
+            if self.camera_detection_status == 1 and self.check_if_someone_is_watching():
+                if copied or self.frame_ring.is_valid(frame):
+                    self.send_image_through_socket()
+                else:
+                    logger.info("Camera %s: Frame %s was overwritten before it was sent." % (self.camera_id, frame.sequence))
+
             # Update alarm status, if off, set to active. If active, update timestamp.
             self.update_alarm_status()
 
@@ -373,11 +472,43 @@ class Worker(mp.Process):
             self.stop_system(action)
 
     #-------------------------------------------------------------------------------
-    def send_image_through_socket(self, image):
-        try: 
-            encoded, buffer = cv2.imencode('.jpg', image)
-            jpg_as_text = base64.b64encode(buffer)
-            self.footage_socket.send(jpg_as_text)
+    def report_startup(self, stage):
+        ''' Report the time a stage of the startup was passed, once per stage '''
+
+        if self.startup_events is not None and stage not in self.startup_stages:
+            self.startup_stages.add(stage)
+            self.startup_events.put((self.camera_id, stage, time.time()))
+
+    #--------------------------------------------------------------------------------
+    def send_alarm(self, spotted_class):
+        ''' Hand the alarm over to the dispatcher, logging and notification is done in the background '''
+
+        try:
+            # Alarms come from analyzed frames, which are copies that are not overwritten
+            image = self.get_result_image()
+            if image is None:
+                image = self.frame.image
+
+            # Reuse the jpg if it was already encoded for the viewer
+            snapshot = None
+            if self.encoded_image_sequence == self.frame.sequence:
+                snapshot = self.encoded_image.tobytes()
+
+            alarm = Alarm(self.user_id, self.camera_id, self.camera_data["camera_name"], self.class_data[spotted_class]["id"],
+                          spotted_class, self.detections.max_scores[spotted_class], image, snapshot)
+            self.alarm_dispatcher.dispatch(alarm)
+        except Exception as e:
+            logger.error("Camera %s: Failed to send alarm for %s: %s" % (self.camera_id, spotted_class, e))
+
+    #-------------------------------------------------------------------------------
+    def send_image_through_socket(self):
+        ''' Send the jpg as raw bytes, with a small json header with the capture and send time of the frame '''
+
+        try:
+            buffer = self.get_encoded_image()
+            header = json.dumps({"camera_id": self.camera_id, "sequence": self.frame.sequence,
+                                 "timestamp": self.frame.timestamp, "sent": time.time()}).encode("utf-8")
+            self.footage_socket.send_multipart([header, buffer], copy=False)
         except Exception as e:
             logger.error("Camera %s: Failed to send image through socket due to: %s" % (self.camera_id, e))
 
@@ -386,26 +517,75 @@ class Worker(mp.Process):
         ''' Stop video stream '''
         try:
             if action == "stop":
-                self.camera_stream.stop()
-                self.camera_stream.join()
+                self.alarm_dispatcher.stop()
+                if self.viewer_socket is not None:
+                    self.viewer_socket.close()
+                if self.footage_socket is not None:
+                    self.close_socket()
                 self.stopped = True
-                logger.info("Camera %s: Video thread has been successfully stopped." % self.camera_id)
+                logger.info("Camera %s: Worker has been successfully stopped." % self.camera_id)
         except Exception as e:
-            logger.error("Camera %s: Failed to stop video thread due to: %s" % (self.camera_id, e))
+            logger.error("Camera %s: Failed to stop worker due to: %s" % (self.camera_id, e))
 
     #--------------------------------------------------------------------------------
     def update_alarm_status(self):
         try:    
-            if len(self.result_class_list) > 0:
-                for spotted_class in self.result_class_list:
+            if len(self.detections) > 0:
+                for spotted_class in self.detections.labels:
                     if self.class_statuses[spotted_class]["status"] == 0:
                         self.class_statuses[spotted_class]["status"] = 1
                         self.class_statuses[spotted_class]["timestamp"] = time.time()
-                        self.log_alarm_to_sql()
-                        self.pushover_alert(spotted_class, self.result_image)
+                        self.send_alarm(spotted_class)
                         self.alarm_status = 1
                         logger.info("Camera %s: Status for %s set to active. User has been notified." % (self.camera_id, spotted_class))
                     else:
                         self.class_statuses[spotted_class]["timestamp"] = time.time()
         except Exception as e:
             logger.error("Camera %s: Alarm status failed to update due to: %s" % (self.camera_id, e))
+
+    #--------------------------------------------------------------------------------
+    def update_frame_statistics(self, frame):
+        ''' Count frames that were never seen by the worker and keep track of the frame rate '''
+
+        try:
+            if self.last_sequence > 0:
+                self.frames_dropped += frame.sequence - self.last_sequence - 1
+            self.last_sequence = frame.sequence
+            self.frame = frame
+
+            # Smoothed frame rate of the worker
+            now = time.time()
+            if self.last_frame_time > 0 and now > self.last_frame_time:
+                self.fps = 0.9 * self.fps + 0.1 * (1 / (now - self.last_frame_time))
+            self.last_frame_time = now
+
+            # Log statistics now and then
+            if now - self.statistics_time >= self.statistics_interval:
+                self.statistics_time = now
+                frames_used = self.frames_analyzed + self.frames_skipped
+                logger.info("Camera %s: %.2f fps, %s frames analyzed, %s skipped without motion and %s dropped. %s frames grabbed and %s decoded from stream." %
+                            (self.camera_id, self.fps, self.frames_analyzed, self.frames_skipped, self.frames_dropped,
+                             self.frame_ring.frames_grabbed, self.frame_ring.frames_decoded))
+                logger.info("Camera %s: %s of %s frames rendered and %s encoded, %s renders avoided." %
+                            (self.camera_id, self.images_rendered, frames_used, self.images_encoded, frames_used - self.images_rendered))
+                logger.info("Camera %s: Config cache %s." % (self.camera_id, ", ".join(
+                    "%s %s hits %s misses" % (kind, counts["hits"], counts["misses"])
+                    for kind, counts in get_config_cache().statistics().items())))
+        except Exception as e:
+            logger.error("Camera %s: Failed to update frame statistics: %s" % (self.camera_id, e))
+
+    #--------------------------------------------------------------------------------
+    def update_viewer_count(self):
+        ''' Read the latest viewer count published by the frame broker, without blocking '''
+
+        if self.viewer_socket is None:
+            return
+        try:
+            while True:
+                topic, count = self.viewer_socket.recv_multipart(zmq.NOBLOCK)
+                self.viewer_count = int(count)
+                self.viewer_count_time = time.time()
+        except zmq.Again:
+            pass
+        except Exception as e:
+            logger.error("Camera %s: Failed to read viewer count: %s" % (self.camera_id, e))